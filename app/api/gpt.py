@@ -1,14 +1,19 @@
 # app/api/gpt.py
 import logging
 import asyncio
+import json
+import re
+import time
 import httpx
-from typing import Tuple
+from typing import Awaitable, Callable, Tuple
 from app.config import settings
+from app.api import model_router, openai_guard, prompts
+from app.utils.metrics import AI_GUARD_REJECTS, AI_HEDGES, AI_REQUEST, record_usage
+from app.utils.tracing import span, traced
 
 logger = logging.getLogger(__name__)
 
 MAX_RETRIES = 3
-RETRY_DELAYS = [1, 2, 4]
 
 # Singleton httpx client — переиспользует TCP-соединения
 _http_client: httpx.AsyncClient | None = None
@@ -27,132 +32,15 @@ async def close_client():
         await _http_client.aclose()
         _http_client = None
 
-SYSTEM_PROMPT = """Ты — эксперт по питанию. Анализируй сообщения пользователя и определяй что он хочет.
-
-ТИПЫ НАМЕРЕНИЙ (intent):
-- "add" — добавить еду/напиток в рацион (ПО УМОЛЧАНИЮ для фото и описания)
-- "calculate" — только посчитать калории, НЕ добавлять
-- "edit" — изменить прием пищи (по названию или последний)
-- "delete" — удалить что-то из рациона
-- "add_previous" — добавить то, что только что рассчитывали
-- "unknown" — непонятно что хочет пользователь
-
-КОГДА ADD (по умолчанию):
-- Фото еды/напитка → ВСЕГДА "add" (если нет явного вопроса)
-- "съел...", "ел...", "выпил...", "на завтрак/обед/ужин..." → "add"
-- Просто название еды или напитка → "add"
-- Название продукта + калорийность/КБЖУ + вес → "add" (НЕ edit!)
-- Если пользователь указывает калорийность на порцию и сколько съел → "add", пересчитай пропорционально
-
-⚠️ ЭТО ВСЁ ADD, НЕ EDIT (пользователь добавляет НОВЫЙ продукт):
-- "Протеиновый шоколад калорийность на 20г 110 ккал, было 28г" → ADD, пересчитай на 28г
-- "творог 5% 200г, калорийность на 100г: 121 ккал белки 18 жиры 5 углеводы 1.8" → ADD
-- "было 2 яйца" → ADD (= "съел 2 яйца")
-- "выпил кофе, было 300мл" → ADD
-- "шоколадка, съел половину, было 100г" → ADD (50г)
-- "каша на воде 250г, на 100г: 88 ккал" → ADD, пересчитай на 250г
-- "батончик, калорийность написана 200 ккал на штуку" → ADD
-
-ЧТО СЧИТАТЬ (еда И напитки):
-- ЕДА: любые блюда, продукты, снеки, десерты, выпечка
-- НАПИТКИ: кофе с молоком, латте, капучино, сок, смузи, кола, лимонад, чай с сахаром, пиво, вино, коктейли, кефир, ряженка, молоко, какао и т.д.
-- СПОРТПИТ: протеин, гейнер, BCAA, креатин, казеин — это ПРОДУКТЫ, не нутриенты!
-- Вода без добавок = 0 ккал (единственное исключение)
-
-ВАЖНО — ПРОДУКТЫ vs НУТРИЕНТЫ:
-- "Протеин", "протеиновый коктейль", "whey" — это ПРОДУКТ (порошок/напиток), НЕ нутриент "белок"!
-  Пример: "протеин 30г" → name: "Протеин (порошок)", weight_grams: 30, calories: 120, protein: 24, fat: 1, carbs: 3
-- Если пользователь указывает конкретные значения КБЖУ (напр. "белки 47, жиры 6, углеводы 3") — используй ИМЕННО ЭТИ значения, пересчитав на указанный вес
-
-КОГДА CALCULATE (только посчитать):
-- Явный вопрос: "сколько калорий в...?", "какая калорийность?"
-- "посчитай КБЖУ", "а если съесть...?"
-
-КОГДА DELETE:
-- "убери", "удали", "отмени", "не ел"
-- delete_target: "last" / "all" / название
-
-КОГДА EDIT (СТРОГО! Только если ВСЕ 3 условия выполнены):
-1. В тексте ЕСТЬ одно из ключевых слов-команд: "исправь", "исправить", "поправь", "поправить", "поменяй", "поменять", "измени", "изменить", "обнови", "обновить", "замени", "заменить", "не X а Y", "на самом деле было"
-2. Пользователь ЯВНО ссылается на уже добавленное блюдо (не описывает новое)
-3. Пользователь показывает что хочет именно ИСПРАВИТЬ запись, а не добавить новую
-
-⛔ ЕСЛИ НЕТ ключевого слова-команды из п.1 — это ВСЕГДА ADD, даже если:
-- Название продукта совпадает с уже добавленным ("Яйцо варёное 60г" когда уже было яйцо → ADD новое яйцо)
-- Указан вес ("творог 200г" → ADD)
-- Указаны КБЖУ ("батончик 30г, 150 ккал" → ADD)
-- В тексте есть слово "было" без команды исправления ("выпил кофе, было 300мл" → ADD)
-
-ПРИМЕРЫ ADD (НЕ edit!):
-- "Яйцо варёное 60 грамм" → ADD (просто новая запись, даже если яйцо уже есть в списке)
-- "ещё одно яблоко" → ADD
-- "съел ещё 100г творога" → ADD
-- "банан 120г" → ADD
-
-ПРИМЕРЫ EDIT:
-- "исправь яйцо, там было 50г а не 60" → EDIT
-- "поменяй творог на 150г" → EDIT
-- "обнови вес гречки — 200г" → EDIT
-
-edit_target: название блюда для поиска, или "last" если не указано
-
-ВРЕМЯ ПРИЁМА:
-- Если пользователь указывает время ("в 8 утра", "на завтрак в 9:00", "вчера вечером") → meal_time: "HH:MM"
-- Если не указано → НЕ включать meal_time в ответ
-
-ФОРМАТ ОТВЕТА (строго JSON):
-{
-  "intent": "add|calculate|edit|delete|add_previous|unknown",
-  "items": [
-    {
-      "name": "Полное название продукта/напитка",
-      "weight_grams": число,
-      "calories": число,
-      "protein": число,
-      "fat": число,
-      "carbs": число
-    }
-  ],
-  "meal_time": "HH:MM (только если указано пользователем)",
-  "delete_target": "last|all|название (для delete)",
-  "edit_target": "last|название (для edit)",
-  "notes": "комментарий"
-}
-
-⚠️ КРИТИЧЕСКИ ВАЖНО — РАСЧЁТ КБЖУ:
-1. Ты ОБЯЗАН рассчитать РЕАЛЬНЫЕ значения калорий и БЖУ для ЛЮБОЙ еды и напитков!
-2. НИКОГДА не возвращай нули! Используй справочные данные о калорийности.
-3. Формула проверки: калории ≈ (белки × 4) + (жиры × 9) + (углеводы × 4)
-4. Если пользователь указал вес — рассчитай КБЖУ на этот вес
-5. Если вес не указан — используй стандартную порцию
-6. Для напитков: вес = объём в мл (100мл ≈ 100г)
-7. Если на фото видна этикетка с КБЖУ — используй значения с этикетки, пересчитав на вес пользователя
-
-ПРИМЕРЫ:
-- "гречка 200г" → weight: 200, cal: 220, p: 8, f: 2, c: 50
-- "куриная грудка 150г" → weight: 150, cal: 165, p: 31, f: 3.5, c: 0
-- "латте 300мл" → weight: 300, cal: 150, p: 7.5, f: 6, c: 15
-- "кола 330мл" → weight: 330, cal: 140, p: 0, f: 0, c: 35
-- "пиво 500мл" → weight: 500, cal: 215, p: 1.5, f: 0, c: 18
-- "протеин 30г" → weight: 30, cal: 120, p: 24, f: 1, c: 3
-- "яблоко" → weight: 180, cal: 85, p: 0.5, f: 0.5, c: 20
-
-❌ ЗАПРЕЩЕНО возвращать нули для реальной еды/напитков!
-❌ ЗАПРЕЩЕНО игнорировать КБЖУ с этикетки, если они видны!
-
-Если не уверен — используй средние значения. Лучше примерные, чем нули!
-"""
-
 
-async def ai_request(
-    user_id: int,
+def _build_payload(
     text: str,
     image_link: str = None,
     context: str = None,
     history: list[dict] = None,
-) -> Tuple[int, str]:
-    """Отправляет запрос к OpenAI API"""
-
+    route: model_router.Route = None,
+) -> dict:
+    """Собирает тело запроса к Chat Completions; route — модель, max_tokens и detail"""
     user_message = text
     if context:
         user_message = f"КОНТЕКСТ:\n{context}\n\nЗАПРОС: {text}"
@@ -162,11 +50,13 @@ async def ai_request(
     if image_link:
         content.append({
             "type": "image_url",
-            "image_url": {"url": image_link, "detail": "high"}
+            "image_url": {"url": image_link, "detail": route.detail if route else settings.openai_image_detail}
         })
 
-    # Собираем messages: system → история диалога → текущий запрос
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    # Порядок ради кэша префикса у провайдера (см. app.api.prompts):
+    # неизменный system → история диалога → текущий запрос с контекстом
+    variant = route.prompt if route else prompts.FULL
+    messages = [{"role": "system", "content": prompts.get_prompt(variant)}]
 
     if history:
         for entry in history:
@@ -178,31 +68,190 @@ async def ai_request(
     messages.append({"role": "user", "content": content})
 
     payload = {
-        "model": settings.openai_default_model,
+        "model": route.model if route else settings.openai_default_model,
         "messages": messages,
         "temperature": settings.openai_temperature,
-        "max_tokens": settings.openai_max_tokens,
+        "max_tokens": route.max_tokens if route else settings.openai_max_tokens,
         "response_format": {"type": "json_object"}
     }
-    
-    last_error = None
-    
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.info(f"[GPT API] Request for user {user_id} (attempt {attempt + 1})")
-            
-            client = _get_client()
+    _set_cache_key(payload, variant)
+    return payload
+
+
+def _set_cache_key(payload: dict, variant: str) -> None:
+    """prompt_cache_key: запросы с одинаковым префиксом попадают на один кэш провайдера"""
+    if settings.openai_prompt_cache_key:
+        payload["prompt_cache_key"] = f"{settings.openai_prompt_cache_key}:{variant}"
+
+
+def _auth_headers() -> dict:
+    return {
+        "Authorization": f"Bearer {settings.openai_api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+async def ai_request(
+    user_id: int,
+    text: str,
+    image_link: str = None,
+    context: str = None,
+    history: list[dict] = None,
+    meta: dict = None,
+) -> Tuple[int, str]:
+    """
+    Отправляет запрос к OpenAI API.
+
+    Модель и бюджет токенов выбираются по классу запроса (model_router);
+    забракованный ответ дешёвой модели повторяется на резервной.
+    В meta (если передан) пишутся model и prompt, которыми получен ответ.
+    """
+    route = model_router.pick_route(text, image_link, history)
+    code, content = await _send_routed(route, user_id, text, image_link, context, history)
+
+    fallback = model_router.fallback_for(route, code, content)
+    if fallback:
+        route = fallback
+        code, content = await _send_routed(fallback, user_id, text, image_link, context, history)
+    if meta is not None:
+        meta.update(model=route.model, prompt=route.prompt)
+    return code, content
+
+
+async def _send_routed(
+    route: model_router.Route,
+    user_id: int,
+    text: str,
+    image_link: str = None,
+    context: str = None,
+    history: list[dict] = None,
+) -> Tuple[int, str]:
+    payload = _build_payload(text, image_link, context, history, route)
+    usage = {}
+    started = time.perf_counter()
+    code, content = await _send_payload(payload, f"user {user_id} ({route.name}/{route.model})", usage)
+    model_router.record(route.name, route.model, time.perf_counter() - started, usage)
+    return code, content
+
+
+def _has_image(payload: dict) -> bool:
+    return any(
+        isinstance(m.get("content"), list)
+        and any(part.get("type") == "image_url" for part in m["content"])
+        for m in payload.get("messages", [])
+    )
+
+
+async def _post(payload: dict, attempt: int, hedge: bool = False) -> httpx.Response:
+    """Один POST в Chat Completions с метриками и спаном"""
+    client = _get_client()
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with span("openai.chat", attempt=attempt + 1, hedge=hedge, model=payload.get("model", "")) as s:
             response = await client.post(
                 settings.openai_api_url,
-                headers={
-                    "Authorization": f"Bearer {settings.openai_api_key}",
-                    "Content-Type": "application/json"
-                },
+                headers=_auth_headers(),
                 json=payload
             )
+            s.set("status", response.status_code)
+        status = str(response.status_code)
+        return response
+    except httpx.TimeoutException:
+        status = "timeout"
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        AI_REQUEST.labels(status=status, attempt="hedge" if hedge else str(attempt + 1)).observe(
+            time.perf_counter() - started
+        )
+
+
+async def _post_hedged(payload: dict, attempt: int, cost: int, kind: str) -> httpx.Response:
+    """
+    Если ответа нет дольше p95 обычной задержки — параллельно отправляет
+    второй такой же запрос (только при свободной квоте) и берёт первый успешный.
+    """
+    primary = asyncio.create_task(_post(payload, attempt))
+    if not settings.openai_hedge_enabled:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=openai_guard.latency[kind].hedge_delay())
+    if done or not await openai_guard.acquire(cost, max_wait=0):
+        return await primary
+
+    AI_HEDGES.labels(outcome="fired").inc()
+    secondary = asyncio.create_task(_post(payload, attempt, hedge=True))
+    pending = {primary, secondary}
+    finished = []
+    # _send_payload учитывает usage одного ответа — токены второго запроса возвращаем
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result().status_code == 200:
+                    AI_HEDGES.labels(outcome="won" if task is secondary else "lost").inc()
+                    return task.result()
+                finished.append(task)
+    finally:
+        for task in pending:
+            task.cancel()
+        await openai_guard.refund(cost)
+
+    # Оба неуспешны: ответ с кодом информативнее исключения
+    for task in finished:
+        if task.exception() is None:
+            return task.result()
+    raise finished[0].exception()
+
+
+async def _send_payload(payload: dict, label: str, usage_out: dict = None) -> Tuple[int, str]:
+    """
+    POST в Chat Completions с ретраями. Возвращает (код, content);
+    usage успешного ответа дописывается в usage_out.
+
+    Перед каждой попыткой — общий circuit breaker и квоты RPM/TPM ключа
+    (app.api.openai_guard). Между попытками — экспоненциальная задержка
+    с jitter, не меньше Retry-After; все попытки укладываются в OPENAI_DEADLINE_SECONDS.
+    """
+    last_error = None
+    cost = openai_guard.estimate_tokens(payload)
+    kind = "vision" if _has_image(payload) else "text"
+    deadline = time.monotonic() + settings.openai_deadline
+
+    for attempt in range(MAX_RETRIES):
+        allowed = await openai_guard.breaker_allow()
+        if not allowed:
+            AI_GUARD_REJECTS.labels(reason="breaker").inc()
+            logger.warning(f"[GPT API] Circuit open, request for {label} rejected")
+            return last_error or 503, ""
+        probe = openai_guard.probe_token(allowed)
+
+        max_wait = min(settings.openai_rate_max_wait, max(0.0, deadline - time.monotonic()))
+        if not await openai_guard.acquire(cost, max_wait=max_wait):
+            await openai_guard.breaker_release(probe)
+            AI_GUARD_REJECTS.labels(reason="rate_limit").inc()
+            logger.warning(f"[GPT API] Local rate limit, request for {label} rejected")
+            return 429, ""
+
+        retry_after = 0.0
+        try:
+            logger.info(f"[GPT API] Request for {label} (attempt {attempt + 1})")
+            started = time.perf_counter()
+            response = await _post_hedged(payload, attempt, cost, kind)
+            retry_after = await openai_guard.observe_headers(response.headers)
+            await openai_guard.breaker_record(response.status_code >= 500, probe)
 
             if response.status_code == 200:
                 data = response.json()
+                usage = data.get("usage") or {}
+                record_usage(usage)
+                if usage_out is not None:
+                    usage_out.update(usage)
+                await openai_guard.settle(cost, usage.get("total_tokens"))
+                openai_guard.latency[kind].add(time.perf_counter() - started)
 
                 if "choices" in data and len(data["choices"]) > 0:
                     message = data["choices"][0]["message"]
@@ -221,19 +270,15 @@ async def ai_request(
                         if refusal:
                             return 279, refusal
                         # Иначе попробуем ещё раз
-                        if attempt < MAX_RETRIES - 1:
-                            await asyncio.sleep(RETRY_DELAYS[attempt])
-                            continue
-                        return 500, ""
-
-                    tokens = data.get("usage", {}).get("total_tokens", 0)
-                    logger.info(f"[GPT API] Success for user {user_id}, tokens: {tokens}")
-                    return 200, result
+                        last_error = 500
+                    else:
+                        logger.info(f"[GPT API] Success for {label}, tokens: {usage.get('total_tokens', 0)}")
+                        return 200, result
                 else:
                     logger.error(f"[GPT API] No choices: {data}")
                     return 500, ""
 
-            if response.status_code == 429:
+            elif response.status_code == 429:
                 error_data = response.json()
                 error_msg = error_data.get("error", {}).get("message", "")
 
@@ -241,27 +286,346 @@ async def ai_request(
                     logger.error(f"[GPT API] Quota exceeded")
                     return 429, "QUOTA_EXCEEDED"
 
-                delay = RETRY_DELAYS[min(attempt, len(RETRY_DELAYS) - 1)]
-                logger.warning(f"[GPT API] Rate limited, waiting {delay}s")
-                await asyncio.sleep(delay)
-                continue
+                logger.warning(f"[GPT API] Rate limited by OpenAI")
+                last_error = 429
 
-            logger.error(f"[GPT API] Error {response.status_code}: {response.text[:500]}")
-            last_error = response.status_code
+            else:
+                logger.error(f"[GPT API] Error {response.status_code}: {response.text[:500]}")
+                last_error = response.status_code
+                if response.status_code < 500 and response.status_code not in (408, 409):
+                    return last_error, ""  # Ошибка запроса — повтор не поможет
 
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(RETRY_DELAYS[attempt])
-                    
         except httpx.TimeoutException:
             logger.error(f"[GPT API] Timeout")
+            await openai_guard.breaker_record(True, probe)
             last_error = 504
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(RETRY_DELAYS[attempt])
-                
+
+        except httpx.TransportError as e:
+            logger.error(f"[GPT API] Network error: {e}")
+            await openai_guard.breaker_record(True, probe)
+            last_error = 502
+
         except Exception as e:
             logger.exception(f"[GPT API] Error: {e}")
+            await openai_guard.breaker_release(probe)
             last_error = 500
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(RETRY_DELAYS[attempt])
-    
-    return last_error or 500, ""
\ No newline at end of file
+
+        if attempt < MAX_RETRIES - 1:
+            delay = openai_guard.backoff(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+
+    return last_error or 500, ""
+
+
+# ============================================
+# БАТЧИ (несколько пользователей в одном запросе)
+# ============================================
+
+def _batch_route() -> model_router.Route | None:
+    # В батч попадают только тексты без истории — маршрут длинного текста
+    return model_router.get_route(model_router.LONG_TEXT) if settings.openai_routing_enabled else None
+
+
+def batch_model() -> str:
+    """Модель пакетных запросов (промпт — всегда полный)"""
+    route = _batch_route()
+    return route.model if route else settings.openai_default_model
+
+
+async def ai_batch_request(requests: list[dict]) -> dict[str, str]:
+    """
+    Отправляет несколько текстовых запросов одним вызовом.
+
+    Модель видит вместо id запросов их порядковые номера, а каждый результат
+    сверяется со своим запросом (см. _batch_result_error).
+
+    Args:
+        requests: [{"id": str, "text": str, "context": str | None}]
+
+    Returns:
+        {id: JSON-строка ответа в обычном формате}. Запросы, для которых
+        ответ не пришёл или не прошёл проверку, в словаре отсутствуют —
+        вызывающий повторяет их по одному.
+    """
+    by_label = {str(i): r for i, r in enumerate(requests, 1)}
+    batch = [
+        {"id": label, "context": r.get("context") or "", "text": r["text"]}
+        for label, r in by_label.items()
+    ]
+    route = _batch_route()
+    model = batch_model()
+    per_request_tokens = route.max_tokens if route else settings.openai_max_tokens
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": prompts.SYSTEM_PROMPT + prompts.BATCH_PROMPT_SUFFIX},
+            {"role": "user", "content": json.dumps(batch, ensure_ascii=False)},
+        ],
+        "temperature": settings.openai_temperature,
+        "max_tokens": min(per_request_tokens * len(batch), settings.gpt_batch_max_tokens),
+        "response_format": {"type": "json_object"},
+    }
+    _set_cache_key(payload, prompts.FULL)  # Префикс общий с полным промптом
+
+    usage = {}
+    started = time.perf_counter()
+    code, content = await _send_payload(payload, f"batch of {len(batch)}", usage)
+    model_router.record("batch", model, time.perf_counter() - started, usage)
+    if code != 200 or not content:
+        return {}
+
+    try:
+        results = json.loads(content).get("results", [])
+    except (json.JSONDecodeError, AttributeError):
+        logger.error(f"[GPT API] Invalid batch response: {content[:300]}")
+        return {}
+    if not isinstance(results, list):
+        return {}
+
+    labels = [str(r.get("id", "")) for r in results if isinstance(r, dict)]
+    answers = {}
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        label = str(result.pop("id", ""))
+        request = by_label.get(label)
+        if request is None:
+            continue
+        # Два ответа на один номер — не знаем, какой чей; оба в повтор
+        error = "duplicate_id" if labels.count(label) > 1 else _batch_result_error(result, request)
+        if error:
+            logger.warning(f"[GPT API] Batch result {label} rejected: {error}")
+            continue
+        result.pop("echo", None)
+        answers[request["id"]] = json.dumps(result, ensure_ascii=False)
+    return answers
+
+
+BATCH_INTENTS = ("add", "calculate", "edit", "delete", "add_previous", "unknown")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _batch_result_error(result: dict, request: dict) -> str | None:
+    """
+    Причина не доверять результату пакета для этого запроса или None.
+
+    Кроме формата проверяем echo — начало text запроса: ответ, собранный
+    по чужому элементу массива, с ним не совпадёт.
+
+    >>> _batch_result_error({"intent": "add", "echo": "Гречка  200г"}, {"text": "гречка 200г и котлета"})
+    >>> _batch_result_error({"intent": "add", "echo": "суп 300"}, {"text": "гречка 200г"})
+    'echo_mismatch'
+    >>> _batch_result_error({"intent": "drop_table", "echo": "гречка"}, {"text": "гречка"})
+    'invalid_intent'
+    """
+    if result.get("intent", "add") not in BATCH_INTENTS:
+        return "invalid_intent"
+    if not isinstance(result.get("items", []), list):
+        return "invalid_items"
+    echo = _SPACE_RE.sub(" ", str(result.get("echo") or "")).strip().lower()
+    text = _SPACE_RE.sub(" ", str(request.get("text") or "")).strip().lower()
+    if not echo or not text.startswith(echo[:20]):
+        return "echo_mismatch"
+    return None
+
+
+# ============================================
+# СТРИМИНГ (SSE)
+# ============================================
+
+_ITEMS_KEY_RE = re.compile(r'"items"\s*:\s*\[')
+
+
+class StreamingItemParser:
+    """
+    Инкрементальный парсер массива "items" из потокового JSON-ответа.
+
+    feed() принимает очередной кусок текста и возвращает блюда,
+    JSON-объекты которых полностью пришли к этому моменту.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0            # Позиция, до которой буфер уже просканирован
+        self._in_items = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = None
+
+    def feed(self, chunk: str) -> list[dict]:
+        self._buf += chunk
+        if self._done:
+            return []
+
+        if not self._in_items:
+            match = _ITEMS_KEY_RE.search(self._buf)
+            if not match:
+                return []
+            self._in_items = True
+            self._pos = match.end()
+
+        items = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start is not None:
+                    try:
+                        item = json.loads(buf[self._obj_start:i + 1])
+                        if isinstance(item, dict):
+                            items.append(item)
+                    except json.JSONDecodeError:
+                        pass
+                    self._obj_start = None
+            elif ch == "]" and self._depth == 0:
+                self._done = True
+                i += 1
+                break
+            i += 1
+
+        self._pos = i
+        return items
+
+
+@traced("openai.chat_stream")
+async def ai_request_stream(
+    user_id: int,
+    text: str,
+    image_link: str = None,
+    context: str = None,
+    history: list[dict] = None,
+    on_items: Callable[[list[dict]], Awaitable[None]] = None,
+) -> Tuple[int, str]:
+    """
+    Потоковый запрос к OpenAI (stream=True).
+
+    По мере прихода ответа вызывает on_items с новыми распознанными блюдами.
+    Возвращает то же, что ai_request. Если поток не удалось начать или он
+    оборвался — делает обычный ai_request с ретраями.
+    """
+    route = model_router.pick_route(text, image_link, history)
+    payload = _build_payload(text, image_link, context, history, route)
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+
+    parser = StreamingItemParser()
+    parts: list[str] = []
+    refusal_parts: list[str] = []
+    tokens = 0
+    usage = {}
+
+    # Breaker открыт или квота занята — обычный запрос решит, ждать или отказать
+    cost = openai_guard.estimate_tokens(payload)
+    allowed = await openai_guard.breaker_allow()
+    if not allowed:
+        return await ai_request(user_id, text, image_link, context, history)
+    probe = openai_guard.probe_token(allowed)
+    if not await openai_guard.acquire(cost, max_wait=0):
+        await openai_guard.breaker_release(probe)
+        return await ai_request(user_id, text, image_link, context, history)
+    settled = False
+
+    async def _fallback() -> Tuple[int, str]:
+        # Обычный запрос спишет квоту сам — токены потока без usage возвращаем
+        if not settled:
+            await openai_guard.refund(cost)
+        return await ai_request(user_id, text, image_link, context, history)
+
+    try:
+        logger.info(f"[GPT API] Stream request for user {user_id}")
+        client = _get_client()
+        started = time.perf_counter()
+        async with client.stream(
+            "POST",
+            settings.openai_api_url,
+            headers=_auth_headers(),
+            json=payload,
+        ) as response:
+            AI_REQUEST.labels(status=str(response.status_code), attempt="stream").observe(
+                time.perf_counter() - started
+            )
+            await openai_guard.observe_headers(response.headers)
+            await openai_guard.breaker_record(response.status_code >= 500, probe)
+            probe = None  # Исход пробы уже учтён
+            if response.status_code != 200:
+                body = await response.aread()
+                logger.warning(
+                    f"[GPT API] Stream error {response.status_code}: {body[:300]!r}, "
+                    f"falling back to regular request"
+                )
+                return await _fallback()
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                    tokens = usage.get("total_tokens", 0)
+                    record_usage(usage)
+                    await openai_guard.settle(cost, tokens)
+                    settled = True
+
+                for choice in chunk.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    if delta.get("refusal"):
+                        refusal_parts.append(delta["refusal"])
+                    piece = delta.get("content")
+                    if not piece:
+                        continue
+                    parts.append(piece)
+                    new_items = parser.feed(piece)
+                    if new_items and on_items:
+                        try:
+                            await on_items(new_items)
+                        except Exception as e:
+                            logger.warning(f"[GPT API] on_items callback error: {e}")
+
+    except Exception as e:
+        if isinstance(e, httpx.TransportError):
+            await openai_guard.breaker_record(True, probe)
+        else:
+            await openai_guard.breaker_release(probe)
+        logger.warning(f"[GPT API] Stream failed for user {user_id}: {e}, falling back")
+        return await _fallback()
+
+    model_router.record(route.name, route.model, time.perf_counter() - started, usage)
+
+    if refusal_parts and not parts:
+        return 279, "".join(refusal_parts)
+
+    result = "".join(parts)
+    if not result:
+        logger.warning(f"[GPT API] Empty stream for user {user_id}, falling back")
+        return await _fallback()
+
+    fallback = model_router.fallback_for(route, 200, result)
+    if fallback:
+        # Уже показанные блюда заменит итоговое сообщение по ответу резервной модели
+        return await _send_routed(fallback, user_id, text, image_link, context, history)
+
+    logger.info(f"[GPT API] Stream success for user {user_id}, tokens: {tokens}")
+    return 200, result
@@ -0,0 +1,182 @@
+# app/api/model_router.py
+"""
+Выбор модели под класс запроса.
+
+Раньше любой запрос — и «кофе», и сложное фото — уходил в OPENAI_DEFAULT_MODEL
+с max_tokens=2048. Теперь запрос относится к одному из маршрутов:
+    - photo      — есть фото: vision-модель, detail из OPENAI_IMAGE_DETAIL;
+    - command    — удалить/изменить/«то же, что вчера»: ответ короткий;
+    - short_text — короткое описание еды;
+    - long_text  — длинное описание или продолжение диалога.
+Маршрут задаётся строкой "модель:max_tokens[:detail]" (OPENAI_ROUTE_*),
+маршруты из OPENAI_COMPACT_PROMPT_ROUTES получают компактный промпт (app.api.prompts).
+Ответ, не прошедший проверку (не JSON, нет блюд, все нули у заметной порции
+не «нулевого» продукта — вода, чай, чёрный кофе не в счёт), повторяется
+на OPENAI_FALLBACK_MODEL с полным промптом и полным бюджетом токенов.
+Задержка, стоимость (по OPENAI_PRICES) и эскалации пишутся в метрики по маршруту.
+"""
+import json
+import logging
+import re
+
+from app.api import prompts
+from app.config import settings
+from app.utils.metrics import AI_ROUTE_COST, AI_ROUTE_FALLBACKS, AI_ROUTE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PHOTO, COMMAND, SHORT_TEXT, LONG_TEXT = "photo", "command", "short_text", "long_text"
+
+COMMAND_RE = re.compile(
+    r"(удали|убери|отмени|исправ|поправ|помен|измени|обнови|замени|вместо|"
+    r"не ел|то же|как вчера|повтори)",
+    re.IGNORECASE,
+)
+
+# Ответы с этими intent обязаны содержать блюда с ненулевым КБЖУ
+ITEM_INTENTS = ("add", "calculate")
+
+# Нулевое КБЖУ — честный ответ для воды, чая, чёрного кофе, специй;
+# подозрительно только для заметной порции чего-то другого
+ZERO_KCAL_RE = re.compile(
+    r"(вод[аыуе]|минерал|чай|ча[яюе]|кофе|американо|эспрессо|зеро|zero|диет|"
+    r"без сахара|электролит|лед|лёд|соль|перец|специ|пряност)",
+    re.IGNORECASE,
+)
+MIN_ZERO_CHECK_GRAMS = 30
+
+# Закэшированный провайдером префикс стоит ~10% обычной цены входных токенов
+CACHED_PROMPT_PRICE = 0.1
+
+
+class Route:
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        max_tokens: int,
+        detail: str | None = None,
+        prompt: str = prompts.FULL,
+    ):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.detail = detail
+        self.prompt = prompt
+
+    def __repr__(self) -> str:
+        return f"Route({self.name}, {self.model}, {self.max_tokens}, {self.prompt})"
+
+
+def _parse_route(name: str, spec: str) -> Route:
+    parts = spec.split(":")
+    model = parts[0] or settings.openai_default_model
+    max_tokens = int(parts[1]) if len(parts) > 1 and parts[1] else settings.openai_max_tokens
+    detail = parts[2] if len(parts) > 2 and parts[2] else settings.openai_image_detail
+    compact = name in {r.strip() for r in settings.openai_compact_prompt_routes.split(",")}
+    return Route(name, model, max_tokens, detail, prompts.COMPACT if compact else prompts.FULL)
+
+
+def _parse_prices(spec: str) -> dict[str, tuple[float, float]]:
+    """'gpt-5.2=1.75/14,gpt-5-mini=0.25/2' → {model: (вход, выход)} в $ за 1M токенов"""
+    prices = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        try:
+            model, rates = entry.split("=")
+            prompt, completion = rates.split("/")
+            prices[model.strip()] = (float(prompt), float(completion))
+        except ValueError:
+            logger.warning(f"[ModelRouter] Bad OPENAI_PRICES entry: {entry!r}")
+    return prices
+
+
+_routes: dict[str, Route] | None = None
+_prices: dict[str, tuple[float, float]] | None = None
+
+
+def get_route(name: str) -> Route:
+    global _routes
+    if _routes is None:
+        _routes = {
+            PHOTO: _parse_route(PHOTO, settings.openai_route_photo),
+            COMMAND: _parse_route(COMMAND, settings.openai_route_command),
+            SHORT_TEXT: _parse_route(SHORT_TEXT, settings.openai_route_short_text),
+            LONG_TEXT: _parse_route(LONG_TEXT, settings.openai_route_long_text),
+        }
+    return _routes[name]
+
+
+def pick_route(text: str, image_link: str | None = None, history: list[dict] | None = None) -> Route:
+    """Маршрут для запроса; при выключенной маршрутизации — прежние модель и бюджет"""
+    if not settings.openai_routing_enabled:
+        return Route(PHOTO if image_link else LONG_TEXT, settings.openai_default_model,
+                     settings.openai_max_tokens, settings.openai_image_detail)
+    if image_link:
+        return get_route(PHOTO)
+    if text and COMMAND_RE.search(text):
+        return get_route(COMMAND)
+    if history or len(text or "") > settings.openai_short_text_chars:
+        return get_route(LONG_TEXT)
+    return get_route(SHORT_TEXT)
+
+
+def check_response(content: str | None) -> str | None:
+    """Причина забраковать ответ модели или None, если ответ годится"""
+    try:
+        data = json.loads(content or "")
+    except (json.JSONDecodeError, TypeError):
+        return "invalid_json"
+    if not isinstance(data, dict):
+        return "invalid_json"
+    if data.get("intent", "add") not in ITEM_INTENTS:
+        return None
+    items = [it for it in data.get("items") or [] if isinstance(it, dict)]
+    if not items:
+        # «Не распознал еду» с пояснением — честный ответ, а не сбой модели
+        return None if data.get("notes") else "no_items"
+    try:
+        zero_items = [
+            it for it in items
+            if all(float(it.get(key) or 0) <= 0 for key in ("calories", "protein", "fat", "carbs"))
+        ]
+        if len(zero_items) == len(items) and any(
+            float(it.get("weight_grams") or 0) >= MIN_ZERO_CHECK_GRAMS
+            and not ZERO_KCAL_RE.search(str(it.get("name") or ""))
+            for it in zero_items
+        ):
+            return "zeros"
+    except (TypeError, ValueError):
+        return "invalid_items"
+    return None
+
+
+def fallback_for(route: Route, code: int, content: str | None) -> Route | None:
+    """Более сильный маршрут, если успешный ответ не прошёл проверку"""
+    if code != 200 or (route.model == settings.openai_fallback_model and route.prompt == prompts.FULL):
+        return None
+    reason = check_response(content)
+    if reason is None:
+        return None
+    AI_ROUTE_FALLBACKS.labels(route=route.name, reason=reason).inc()
+    logger.warning(f"[ModelRouter] {route.name} response rejected ({reason}), retrying on {settings.openai_fallback_model}")
+    return Route(route.name, settings.openai_fallback_model, settings.openai_max_tokens, route.detail)
+
+
+def estimate_cost(model: str, usage: dict) -> float:
+    """Стоимость запроса в $ по usage; 0 — цены модели неизвестны"""
+    global _prices
+    if _prices is None:
+        _prices = _parse_prices(settings.openai_prices)
+    prompt, completion = _prices.get(model, (0.0, 0.0))
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return (
+        ((usage.get("prompt_tokens") or 0) - cached) * prompt
+        + cached * prompt * CACHED_PROMPT_PRICE
+        + (usage.get("completion_tokens") or 0) * completion
+    ) / 1_000_000
+
+
+def record(route_name: str, model: str, seconds: float, usage: dict | None) -> None:
+    AI_ROUTE_SECONDS.labels(route=route_name, model=model).observe(seconds)
+    if usage:
+        AI_ROUTE_COST.labels(route=route_name, model=model).inc(estimate_cost(model, usage))
@@ -0,0 +1,341 @@
+# app/api/openai_guard.py
+"""
+Защита клиента OpenAI от перегрузки и «штормов» ретраев.
+
+Всё состояние общее для вебхука и всех воркеров (Redis, Lua):
+    - circuit breaker: доля ошибок (5xx, таймауты, сетевые) за окно
+      OPENAI_BREAKER_WINDOW секунд; при превышении запросы сразу отклоняются
+      на OPENAI_BREAKER_COOLDOWN секунд, затем один пробный запрос
+      (half-open) решает, закрыть breaker или снова открыть — учитывается
+      только ответ того запроса, что держит пробу;
+    - token bucket по RPM и TPM ключа API (openai:rl:{key}). Запрос ждёт
+      токены не дольше OPENAI_RATE_MAX_WAIT секунд, потом отказ без запроса;
+    - пауза по Retry-After и x-ratelimit-* из ответов — для всех процессов.
+В процессе: окно задержек успешных ответов для порога hedged-запроса (p95).
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import re
+import secrets
+import time
+from collections import deque
+
+from app.config import settings
+from app.db.redis_client import redis
+
+logger = logging.getLogger(__name__)
+
+BREAKER_OPEN_KEY = "openai:cb:open"
+BREAKER_HALF_OPEN_KEY = "openai:cb:half_open"
+BREAKER_PROBE_KEY = "openai:cb:probe"
+BREAKER_BUCKET_KEY = "openai:cb:{kind}:{bucket}"
+BREAKER_BUCKET_SECONDS = 5
+
+IMAGE_TOKENS_ESTIMATE = 1100   # Фото 768px при detail=high, с запасом
+OUTPUT_TOKENS_ESTIMATE = 500   # Обычный ответ; max_tokens — только потолок
+
+# ============================================
+# CIRCUIT BREAKER
+# ============================================
+
+# KEYS: total bucket, fail bucket, open, half_open, probe, затем прошлые бакеты парами
+# ARGV: failed (0/1), bucket ttl, min requests, failure ratio, cooldown, probe token, half_open ttl
+_RECORD = redis.register_script("""
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if ARGV[1] == '1' then
+    redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    -- half-open: решает только исход пробного запроса, ответы запросов,
+    -- отправленных до открытия breaker, на него не влияют
+    if ARGV[6] == '' or redis.call('GET', KEYS[5]) ~= ARGV[6] then
+        return 0
+    end
+    redis.call('DEL', KEYS[5])
+    if ARGV[1] == '1' then
+        redis.call('SET', KEYS[3], '1', 'EX', ARGV[5])
+        redis.call('SET', KEYS[4], '1', 'EX', ARGV[7])
+        return 1
+    end
+    -- Пробный запрос успешен: закрываем и забываем ошибки окна
+    for i = 1, #KEYS do
+        if i ~= 3 and i ~= 5 then redis.call('DEL', KEYS[i]) end
+    end
+    return 0
+end
+local total = tonumber(redis.call('GET', KEYS[1]) or '0')
+local failed = tonumber(redis.call('GET', KEYS[2]) or '0')
+for i = 6, #KEYS, 2 do
+    total = total + tonumber(redis.call('GET', KEYS[i]) or '0')
+    failed = failed + tonumber(redis.call('GET', KEYS[i + 1]) or '0')
+end
+if ARGV[1] == '1' and total >= tonumber(ARGV[3]) and failed / total >= tonumber(ARGV[4]) then
+    redis.call('SET', KEYS[3], '1', 'EX', ARGV[5])
+    -- half_open с TTL: если пробный запрос так и не придёт, breaker не застрянет
+    redis.call('SET', KEYS[4], '1', 'EX', ARGV[7])
+    return 1
+end
+return 0
+""")
+
+# KEYS: probe. ARGV: probe token — снять, только если проба наша
+_RELEASE_PROBE = redis.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+async def breaker_allow() -> bool | str:
+    """
+    False — breaker открыт (или уже идёт пробный запрос), запрос не отправлять.
+    В half-open возвращает токен пробного запроса: его нужно передать
+    в breaker_record / breaker_release, остальным запросам — True.
+    """
+    if not settings.openai_breaker_enabled:
+        return True
+    try:
+        opened, half_open = await redis.mget(BREAKER_OPEN_KEY, BREAKER_HALF_OPEN_KEY)
+        if opened:
+            return False
+        if half_open:
+            # Пропускаем один пробный запрос на всех
+            probe = secrets.token_hex(8)
+            if await redis.set(BREAKER_PROBE_KEY, probe, nx=True, ex=settings.openai_timeout + 5):
+                return probe
+            return False
+        return True
+    except Exception as e:
+        logger.warning(f"[OpenAI] Breaker check failed: {e}")
+        return True
+
+
+def probe_token(allowed: bool | str) -> str | None:
+    """Токен пробного запроса из ответа breaker_allow"""
+    return allowed if isinstance(allowed, str) else None
+
+
+async def breaker_release(probe: str | None) -> None:
+    """Пробный запрос так и не отправлен (отказ лимитера) — освобождаем место пробы"""
+    if not probe:
+        return
+    try:
+        await _RELEASE_PROBE(keys=[BREAKER_PROBE_KEY], args=[probe])
+    except Exception as e:
+        logger.warning(f"[OpenAI] Breaker probe release failed: {e}")
+
+
+async def breaker_record(failed: bool, probe: str | None = None) -> None:
+    if not settings.openai_breaker_enabled:
+        return
+    now_bucket = int(time.time()) // BREAKER_BUCKET_SECONDS
+    buckets = max(1, settings.openai_breaker_window // BREAKER_BUCKET_SECONDS)
+    keys = [
+        BREAKER_BUCKET_KEY.format(kind="total", bucket=now_bucket),
+        BREAKER_BUCKET_KEY.format(kind="fail", bucket=now_bucket),
+        BREAKER_OPEN_KEY,
+        BREAKER_HALF_OPEN_KEY,
+        BREAKER_PROBE_KEY,
+    ]
+    for b in range(now_bucket - buckets + 1, now_bucket):
+        keys += [
+            BREAKER_BUCKET_KEY.format(kind="total", bucket=b),
+            BREAKER_BUCKET_KEY.format(kind="fail", bucket=b),
+        ]
+    try:
+        opened = await _RECORD(keys=keys, args=[
+            int(failed),
+            settings.openai_breaker_window + BREAKER_BUCKET_SECONDS,
+            settings.openai_breaker_min_requests,
+            settings.openai_breaker_failure_ratio,
+            settings.openai_breaker_cooldown,
+            probe or "",
+            settings.openai_breaker_cooldown + 2 * (settings.openai_timeout + 5),
+        ])
+        if opened:
+            logger.error(f"[OpenAI] Circuit breaker OPEN for {settings.openai_breaker_cooldown}s")
+    except Exception as e:
+        logger.warning(f"[OpenAI] Breaker record failed: {e}")
+
+
+# ============================================
+# RATE LIMIT (RPM / TPM)
+# ============================================
+
+# KEYS: bucket hash, pause key
+# ARGV: rpm, tpm, cost requests, cost tokens, force (1 — списать без ожидания)
+# Возвращает 0 или сколько миллисекунд подождать
+_TAKE = redis.register_script("""
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local force = ARGV[5] == '1'
+local pause = tonumber(redis.call('GET', KEYS[2]) or '0')
+if pause > now and not force then return pause - now end
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts')
+local req = tonumber(state[1] or rpm)
+local tok = tonumber(state[2] or tpm)
+local ts = tonumber(state[3] or now)
+local elapsed = math.max(0, now - ts)
+req = math.min(rpm, req + elapsed * rpm / 60000)
+tok = math.min(tpm, tok + elapsed * tpm / 60000)
+local need_req, need_tok = tonumber(ARGV[3]), math.min(tonumber(ARGV[4]), tpm)
+local wait = 0
+if not force then
+    if req < need_req then wait = math.max(wait, (need_req - req) * 60000 / rpm) end
+    if tok < need_tok then wait = math.max(wait, (need_tok - tok) * 60000 / tpm) end
+end
+if wait == 0 then
+    req = req - need_req
+    tok = tok - need_tok
+end
+redis.call('HSET', KEYS[1], 'req', req, 'tok', tok, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return math.ceil(wait)
+""")
+
+
+def _key_id() -> str:
+    return hashlib.sha1((settings.openai_api_key or "").encode()).hexdigest()[:10]
+
+
+def _rl_keys() -> list[str]:
+    key_id = _key_id()
+    return [f"openai:rl:{key_id}", f"openai:rl:{key_id}:pause"]
+
+
+def estimate_tokens(payload: dict) -> int:
+    """Грубая оценка токенов запроса для TPM (кириллица — ~3 символа на токен)"""
+    chars, images = 0, 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += 1
+    output = min(payload.get("max_tokens") or OUTPUT_TOKENS_ESTIMATE, OUTPUT_TOKENS_ESTIMATE)
+    return chars // 3 + images * IMAGE_TOKENS_ESTIMATE + output
+
+
+async def _take(cost_tokens: int, cost_requests: int = 1, force: bool = False) -> int:
+    return int(await _TAKE(keys=_rl_keys(), args=[
+        settings.openai_rpm_limit, settings.openai_tpm_limit,
+        cost_requests, cost_tokens, int(force),
+    ]))
+
+
+async def acquire(cost_tokens: int, max_wait: float | None = None) -> bool:
+    """Ждёт токены RPM/TPM. False — ждать пришлось бы дольше max_wait"""
+    if not settings.openai_rpm_limit or not settings.openai_tpm_limit:
+        return True
+    max_wait = settings.openai_rate_max_wait if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    while True:
+        try:
+            wait_ms = await _take(cost_tokens)
+        except Exception as e:
+            logger.warning(f"[OpenAI] Rate limiter unavailable: {e}")
+            return True
+        if not wait_ms:
+            return True
+        wait = wait_ms / 1000
+        if time.monotonic() + wait > deadline:
+            return False
+        await asyncio.sleep(wait + random.uniform(0, 0.05))
+
+
+async def settle(estimated: int, actual: int | None) -> None:
+    """Поправка TPM по фактическому usage (возврат или доплата токенов)"""
+    if not actual or not settings.openai_rpm_limit or not settings.openai_tpm_limit:
+        return
+    try:
+        await _take(actual - estimated, cost_requests=0, force=True)
+    except Exception:
+        pass
+
+
+async def refund(estimated: int) -> None:
+    """Возврат токенов TPM запроса, usage которого так и не будет учтён (проигравший hedge, оборванный поток)"""
+    if not settings.openai_rpm_limit or not settings.openai_tpm_limit:
+        return
+    try:
+        await _take(-estimated, cost_requests=0, force=True)
+    except Exception:
+        pass
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value: str | None) -> float:
+    """'6m0s', '1.5s', '20ms' → секунды"""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(n) * _UNITS[unit] for n, unit in _DURATION_RE.findall(value))
+
+
+async def observe_headers(headers) -> float:
+    """
+    Retry-After и x-ratelimit-*: если квота исчерпана — общая пауза
+    для всех процессов. Возвращает длительность паузы (0 — не нужна)
+    """
+    pause = parse_reset(headers.get("retry-after"))
+    if headers.get("x-ratelimit-remaining-requests") == "0":
+        pause = max(pause, parse_reset(headers.get("x-ratelimit-reset-requests")))
+    remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+    if remaining_tokens is not None and remaining_tokens.isdigit() and int(remaining_tokens) < OUTPUT_TOKENS_ESTIMATE:
+        pause = max(pause, parse_reset(headers.get("x-ratelimit-reset-tokens")))
+    if pause > 0:
+        pause = min(pause, 60)
+        try:
+            until = int((time.time() + pause) * 1000)
+            await redis.set(_rl_keys()[1], until, px=int(pause * 1000) + 1000)
+        except Exception:
+            pass
+        logger.warning(f"[OpenAI] Rate limit reached, pausing all requests for {pause:.1f}s")
+    return pause
+
+
+def backoff(attempt: int, retry_after: float = 0) -> float:
+    """Экспоненциальная задержка с полным jitter, не меньше Retry-After"""
+    delay = random.uniform(0, min(settings.openai_backoff_max, settings.openai_backoff_base * 2 ** attempt))
+    return max(delay, retry_after)
+
+
+# ============================================
+# ЗАДЕРЖКИ ДЛЯ HEDGED-ЗАПРОСОВ
+# ============================================
+
+class LatencyWindow:
+    """Последние задержки успешных ответов (секунды) для оценки p95"""
+
+    def __init__(self, size: int = 200):
+        self._values: deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._values.append(seconds)
+
+    def hedge_delay(self) -> float:
+        floor = settings.openai_hedge_min_ms / 1000
+        if len(self._values) < 20:
+            return max(floor, settings.openai_timeout / 2)
+        ordered = sorted(self._values)
+        p = ordered[min(len(ordered) - 1, int(len(ordered) * settings.openai_hedge_percentile))]
+        return max(floor, p)
+
+
+# Фото и текст отвечают с очень разной задержкой — окна раздельные
+latency = {"vision": LatencyWindow(), "text": LatencyWindow()}
@@ -2,8 +2,8 @@ from fastapi import APIRouter, Request, Header, HTTPException
 from aiogram import Dispatcher, Bot
 from app.bot.bot import dp, bot
 from app.config import settings
+from app.bot.update_queue import update_queue
 import logging
-import asyncio
 import hmac
 
 logger = logging.getLogger(__name__)
@@ -38,28 +38,16 @@ async def telegram_webhook(
         logger.error(f"❌ Failed to parse update JSON: {e}")
         raise HTTPException(status_code=400, detail="Invalid JSON")
     
-    # ✅ ИСПРАВЛЕНИЕ: Запускаем обработку в фоне (неблокирующая)
-    # Сразу отвечаем Telegram "OK", чтобы не было подвисаний
-    asyncio.create_task(_process_update(update_data))
+    # Обработка в фоне через ограниченную очередь; сразу отвечаем Telegram "OK".
+    # Если очередь полна — 503, Telegram повторит доставку позже
+    if not update_queue.submit(update_data):
+        logger.warning(f"⚠️ Update queue full ({update_queue.size}), shedding {update_data.get('update_id')}")
+        raise HTTPException(status_code=503, detail="Busy", headers={"Retry-After": "5"})
     
     # Возвращаем успех сразу
     return {"ok": True}
 
 
-async def _process_update(update_data: dict):
-    """
-    Фоновая обработка обновления от Telegram
-    
-    Вызывается асинхронно, не блокирует webhook endpoint
-    """
-    try:
-        await dp.feed_raw_update(bot, update_data)
-        logger.debug(f"✅ Update {update_data.get('update_id')} processed")
-    except Exception as e:
-        logger.exception(f"❌ Error processing Telegram update {update_data.get('update_id')}: {e}")
-        # Не возвращаем 500, чтобы Telegram не ретраил
-
-
 @telegram_router.get("/telegram/status")
 async def telegram_status():
     """Проверка статуса Telegram бота"""
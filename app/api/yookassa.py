@@ -9,7 +9,8 @@ import pytz
 
 from app.db.mysql import mysql
 from app.bot.bot import bot
-from app.services.user import SUBSCRIBED_TOKENS_COUNT, get_user_by_id
+from app.services.user import SUBSCRIBED_TOKENS_COUNT, get_user_by_id, reset_token_balance
+from app.services.user_cache import invalidate_user
 
 logger = logging.getLogger(__name__)
 yookassa_router = APIRouter()
@@ -182,6 +183,9 @@ async def yookassa_webhook(request: Request):
                 logger.exception(f"[Webhook] TX error for {payment_id}: {e}")
                 return Response(status_code=500)
 
+        await invalidate_user(user_id)
+        await reset_token_balance(user_id)
+
         # уведомляем ПОСЛЕ коммита
         try:
             if saved_method_id:
@@ -16,6 +16,8 @@ asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 # Теперь безопасно импортировать остальное
 # ========================================
 import logging
+import time
+from datetime import datetime, timezone
 from fastapi import FastAPI
 from arq import run_worker, cron
 from arq.connections import RedisSettings
@@ -23,13 +25,21 @@ from arq.connections import RedisSettings
 from app.config import settings
 from app.db.mysql import init_db, close_db
 from app.tasks.subscriptions import try_all_autopays
-from app.tasks.daily_reset import reset_tokens
+from app.tasks.token_writeback import flush_token_balances
 from app.tasks.daily_food_reset import reset_daily_food
-from app.tasks.broadcast import send_broadcast
-from app.tasks.gpt_queue import process_universal_request
+from app.tasks.broadcast import send_broadcast, resume_broadcasts
+from app.tasks.gpt_queue import process_universal_request, recover_waiting_jobs
+from app.tasks.gpt_batcher import create_batcher
 from app.tasks.db_backup import backup_database
-from app.db.redis_client import init_arq_redis
+from app.tasks.blob_cleanup import cleanup_blobs
+from app.tasks.daily_totals_reconcile import reconcile_totals
+from app.db.redis_client import init_arq_redis, redis
+from app.services.food_parser import get_nutrition_index
+from app.services.gpt_cache import flush_cache_stats
+from app.services.user_cache import start_user_cache_listener, stop_user_cache_listener
 from app.utils.logger import setup_logger
+from app.utils.metrics import QUEUE_DEPTH, QUEUE_WAIT, start_worker_exporter
+from app.utils.tracing import start_tracing, stop_tracing
 
 setup_logger()
 logger = logging.getLogger(__name__)
@@ -42,42 +52,143 @@ async def startup(ctx):
     logger.info("🚀 ARQ Worker: инициализация MySQL и Redis")
     await init_db(app)
     await init_arq_redis()
+    await start_user_cache_listener()
+    start_worker_exporter()
+    await start_tracing("calorie-bot-worker")
     ctx["app"] = app
+    ctx["queue_depth_task"] = asyncio.create_task(_report_queue_depth())
     logger.info("✅ ARQ Worker: готов к работе")
 
 
+async def interactive_startup(ctx):
+    """Воркер запросов пользователей: справочник КБЖУ и батчер GPT"""
+    await startup(ctx)
+    get_nutrition_index()  # Справочник КБЖУ загружается один раз на воркер
+
+    if settings.gpt_batch_enabled:
+        batcher = create_batcher()
+        await batcher.start()
+        ctx["gpt_batcher"] = batcher
+
+
+async def bulk_startup(ctx):
+    """Воркер рассылок: продолжает рассылки, прерванные перезапуском"""
+    await startup(ctx)
+    try:
+        await resume_broadcasts(ctx)
+    except Exception as e:
+        logger.warning(f"[Broadcast] Resume check failed: {e}")
+
+
 async def shutdown(ctx):
     """Завершение работы воркера"""
     logger.info("🔻 ARQ Worker: закрытие соединений")
+    depth_task = ctx.get("queue_depth_task")
+    if depth_task:
+        depth_task.cancel()
+    batcher = ctx.get("gpt_batcher")
+    if batcher:
+        await batcher.stop()
+    await flush_cache_stats()
+    await stop_user_cache_listener()
+    await stop_tracing()
     await close_db(app)
     logger.info("👋 ARQ Worker: остановлен")
 
 
+async def _report_queue_depth():
+    """Глубина всех очередей → bot_arq_queue_depth (видна из любого воркера)"""
+    queues = (settings.queue_interactive, settings.queue_bulk, settings.queue_cron)
+    while True:
+        try:
+            now_ms = int(time.time() * 1000)
+            for queue in queues:
+                total = await redis.zcard(queue)
+                ready = await redis.zcount(queue, "-inf", now_ms)
+                QUEUE_DEPTH.labels(queue=queue, state="ready").set(ready)
+                QUEUE_DEPTH.labels(queue=queue, state="deferred").set(total - ready)
+        except Exception as e:
+            logger.warning(f"[Queues] Depth check failed: {e}")
+        await asyncio.sleep(settings.queue_depth_interval)
+
+
+def _job_start_hook(queue: str):
+    async def on_job_start(ctx):
+        """Время ожидания задачи в очереди"""
+        enqueue_time = ctx.get("enqueue_time")
+        if enqueue_time:
+            wait = (datetime.now(timezone.utc) - enqueue_time).total_seconds()
+            QUEUE_WAIT.labels(queue=queue).observe(max(wait, 0))
+    return on_job_start
+
+
+# ARQ читает настройки из __dict__ класса, поэтому общие поля повторяются в каждом
+
 class WorkerSettings:
-    """Настройки ARQ воркера"""
-    
+    """
+    Запросы пользователей (текст, фото, голос) — самый высокий приоритет:
+    в этой очереди нет долгих задач, слоты не занимают рассылки и cron.
+    """
+
+    queue_name = settings.queue_interactive
     functions = [
-        try_all_autopays,
-        send_broadcast,
         process_universal_request,  # ✅ ОДНА ФУНКЦИЯ ВМЕСТО 4-х
     ]
-    
+    on_startup = interactive_startup
+    on_job_start = _job_start_hook(settings.queue_interactive)
+    max_jobs = settings.worker_interactive_max_jobs
+    redis_settings = RedisSettings.from_dsn(settings.redis_url)
+    on_shutdown = shutdown
+    job_timeout = 120000
+    keep_result = 3600
+    max_tries = 1
+    retry_jobs = False
+
+
+class BulkWorkerSettings:
+    """Рассылки: долгие задачи с малым лимитом параллельности"""
+
+    queue_name = settings.queue_bulk
+    functions = [
+        send_broadcast,
+    ]
+    cron_jobs = [
+        cron(resume_broadcasts, minute=set(range(0, 60, 5))),
+    ]
+    on_startup = bulk_startup
+    on_job_start = _job_start_hook(settings.queue_bulk)
+    max_jobs = settings.worker_bulk_max_jobs
+    redis_settings = RedisSettings.from_dsn(settings.redis_url)
+    on_shutdown = shutdown
+    job_timeout = 120000
+    keep_result = 3600
+    max_tries = 1
+    retry_jobs = False
+
+
+class CronWorkerSettings:
+    """Платежи и периодические задачи"""
+
+    queue_name = settings.queue_cron
+    functions = [
+        try_all_autopays,
+    ]
     cron_jobs = [
         cron(reset_daily_food, hour=0, minute=0),
-        cron(reset_tokens, hour=3, minute=5),
+        cron(flush_token_balances, second=0),  # Каждую минуту
         cron(try_all_autopays, hour=3, minute=10),
         cron(backup_database, hour={0, 6, 12, 18}, minute=30),
+        cron(cleanup_blobs, minute={0, 15, 30, 45}),
+        cron(reconcile_totals, minute=40),  # Каждый час
+        cron(recover_waiting_jobs, second=30),  # Каждую минуту
     ]
-    
-    redis_settings = RedisSettings.from_dsn(settings.redis_url)
-    
     on_startup = startup
+    on_job_start = _job_start_hook(settings.queue_cron)
+    max_jobs = settings.worker_cron_max_jobs
+    redis_settings = RedisSettings.from_dsn(settings.redis_url)
     on_shutdown = shutdown
-    
     job_timeout = 120000
     keep_result = 3600
-    max_jobs = 20
-    
     max_tries = 1
     retry_jobs = False
 
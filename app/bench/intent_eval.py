@@ -0,0 +1,144 @@
+# app/bench/intent_eval.py
+"""
+Точность локальных правил intent по ответам GPT.
+
+    python -m app.bench.intent_eval                 # отчёт по выборке
+    python -m app.bench.intent_eval --train model.json
+
+Выборка — intent_rules:samples в Redis: сверки сработавших правил
+(INTENT_RULES_AUDIT_RATE) и случайные текстовые запросы (INTENT_RULES_SAMPLE_RATE),
+у каждого — intent, который вернул GPT. Отчёт:
+    - по записанным сверкам: precision каждого правила на момент срабатывания;
+    - текущие правила, прогнанные заново по всем текстам выборки:
+      precision по правилам и доля команд GPT, которые правила ловят
+      (оценка по случайной части выборки);
+    - с --train: наивный Байес по выборке, точность на отложенных 20%,
+      модель сохраняется в JSON для INTENT_MODEL_PATH.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+from collections import Counter
+
+from app.db.redis_client import redis
+from app.services.intent_rules import SAMPLES_KEY, IntentModel, agrees, match_rules
+from app.utils.logger import setup_logger
+
+setup_logger()
+logger = logging.getLogger(__name__)
+
+COMMAND_INTENTS = ("delete", "edit", "add_previous")
+
+
+def _gpt_answer(sample: dict) -> dict:
+    """Ответ GPT в объёме, сохранённом в выборке"""
+    answer = {"intent": sample["gpt"]}
+    if sample.get("gpt_target") is not None:
+        answer["delete_target"] = sample["gpt_target"]
+    return answer
+
+
+def _agrees(local: dict, sample: dict) -> bool:
+    # Вес для edit в выборке не хранится — сравниваем только intent
+    if local["intent"] == "edit":
+        return sample["gpt"] == "edit"
+    return agrees(local, _gpt_answer(sample))
+
+
+def _print_precision(title: str, fired: Counter, matched: Counter) -> None:
+    print(title)
+    if not fired:
+        print("  нет данных\n")
+        return
+    for rule, total in fired.most_common():
+        print(f"  {rule:<18} {matched[rule]:>5}/{total:<5} precision {matched[rule] / total:.3f}")
+    total = sum(fired.values())
+    print(f"  {'всего':<18} {sum(matched.values()):>5}/{total:<5} precision {sum(matched.values()) / total:.3f}\n")
+
+
+def report(samples: list[dict]) -> None:
+    print(f"Выборка: {len(samples)} сообщений\n")
+
+    fired, matched = Counter(), Counter()
+    for sample in samples:
+        if sample.get("rule"):
+            fired[sample["rule"]] += 1
+            matched[sample["rule"]] += sample.get("result") == "match"
+    _print_precision("Сверки при срабатывании (audit):", fired, matched)
+
+    fired, matched = Counter(), Counter()
+    commands, caught = Counter(), Counter()
+    mismatches = []
+    for sample in samples:
+        found = match_rules(sample["text"])
+        if found:
+            rule, local = found
+            fired[rule] += 1
+            if _agrees(local, sample):
+                matched[rule] += 1
+            else:
+                mismatches.append((rule, local["intent"], sample["gpt"], sample["text"]))
+        # Полнота — только по случайной части выборки, сверки её завысили бы
+        if not sample.get("rule") and sample["gpt"] in COMMAND_INTENTS:
+            commands[sample["gpt"]] += 1
+            caught[sample["gpt"]] += bool(found)
+    _print_precision("Текущие правила по всей выборке:", fired, matched)
+
+    print("Команды GPT, пойманные правилами (случайная выборка):")
+    for intent in COMMAND_INTENTS:
+        if commands[intent]:
+            print(f"  {intent:<18} {caught[intent]:>5}/{commands[intent]:<5} {caught[intent] / commands[intent]:.3f}")
+    print()
+
+    if mismatches:
+        print("Расхождения с GPT (до 20):")
+        for rule, local, gpt, text in mismatches[:20]:
+            print(f"  {rule:<18} {local} ≠ {gpt}: {text!r}")
+        print()
+
+
+def train(samples: list[dict], path: str) -> None:
+    data = [(s["text"], s["gpt"]) for s in samples]
+    random.Random(42).shuffle(data)
+    split = max(1, len(data) // 5)
+    holdout, train_set = data[:split], data[split:]
+    if not train_set:
+        print("Слишком мало данных для обучения")
+        return
+
+    model = IntentModel.fit(train_set)
+    correct = sum(model.predict(text)[0] == intent for text, intent in holdout)
+    print(f"Модель: обучение {len(train_set)}, проверка {len(holdout)}, accuracy {correct / len(holdout):.3f}")
+
+    # В файл — модель на всей выборке
+    model = IntentModel.fit(data)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(model.to_dict(), f, ensure_ascii=False)
+    print(f"Сохранено: {path} (INTENT_MODEL_PATH)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Точность локальных правил intent по ответам GPT")
+    parser.add_argument("--train", metavar="PATH", help="Обучить модель и сохранить в JSON")
+    args = parser.parse_args()
+
+    try:
+        raw = await redis.lrange(SAMPLES_KEY, 0, -1)
+    finally:
+        await redis.close()
+    samples = []
+    for item in raw:
+        try:
+            samples.append(json.loads(item))
+        except (TypeError, ValueError):
+            continue
+
+    report(samples)
+    if args.train:
+        train(samples, args.train)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+# app/bench/prompt_cache.py
+"""
+Замер кэша префикса и вариантов промпта на живом OpenAI API.
+
+    python -m app.bench.prompt_cache --runs 3 --variants full,compact
+
+Для каждого варианта промпта (app.api.prompts) прогоняет набор запросов —
+встроенный или из --file (один текст на строку) — и печатает по маршрутам:
+средние prompt/cached/completion токены из usage, долю закэшированных токенов
+промпта, p50/p95 задержки, стоимость по OPENAI_PRICES и долю ответов,
+прошедших model_router.check_response.
+Первый прогон «прогревает» кэш провайдера, поэтому --runs меньше 2 мало что покажет.
+Нужен OPENAI_API_KEY: каждый прогон — настоящие платные запросы.
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from app.api import model_router, prompts
+from app.api.gpt import _build_payload, _send_payload, close_client
+from app.utils.logger import setup_logger
+
+setup_logger()
+logger = logging.getLogger(__name__)
+
+SAMPLES = [
+    "кофе",
+    "гречка 200г",
+    "банан и йогурт",
+    "латте 300мл",
+    "сколько калорий в авокадо?",
+    "на завтрак овсянка на молоке 250г с бананом и ложкой мёда, кофе с молоком без сахара",
+    "обед: борщ со сметаной, два куска чёрного хлеба, котлета с пюре и компот",
+    "удали последнее",
+    "исправь гречку, было 150г а не 200",
+]
+CONTEXT = "Сегодня съедено:\n- Овсянка на молоке 250г: 280 ккал\n- Кофе с молоком 200мл: 60 ккал"
+
+
+def _percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def _run_one(text: str, variant: str, image: str | None) -> tuple:
+    route = model_router.pick_route(text, image)
+    route = model_router.Route(route.name, route.model, route.max_tokens, route.detail, variant)
+    payload = _build_payload(text, image, CONTEXT, None, route)
+    usage = {}
+    started = time.perf_counter()
+    code, content = await _send_payload(payload, f"bench {variant}/{route.name}", usage)
+    return route, code, content, usage, time.perf_counter() - started
+
+
+def _report(rows: dict) -> None:
+    header = (
+        f"{'variant':<8} {'route':<11} {'model':<14} {'n':>3} {'prompt':>7} {'cached':>7} "
+        f"{'cache%':>6} {'compl':>6} {'p50,s':>6} {'p95,s':>6} {'$/1k req':>9} {'valid%':>6} {'err':>4}"
+    )
+    print(header)
+    print("-" * len(header))
+    for (variant, route, model), results in sorted(rows.items()):
+        ok = [r for r in results if r["code"] == 200]
+        n = len(ok) or 1
+        prompt = sum(r["usage"].get("prompt_tokens") or 0 for r in ok) / n
+        cached = sum(
+            (r["usage"].get("prompt_tokens_details") or {}).get("cached_tokens") or 0 for r in ok
+        ) / n
+        completion = sum(r["usage"].get("completion_tokens") or 0 for r in ok) / n
+        cost = sum(model_router.estimate_cost(model, r["usage"]) for r in ok) / n * 1000
+        valid = sum(1 for r in ok if model_router.check_response(r["content"]) is None)
+        latencies = [r["seconds"] for r in ok] or [0.0]
+        print(
+            f"{variant:<8} {route:<11} {model:<14} {len(results):>3} {prompt:>7.0f} {cached:>7.0f} "
+            f"{(cached / prompt * 100 if prompt else 0):>5.0f}% {completion:>6.0f} "
+            f"{_percentile(latencies, 0.5):>6.2f} {_percentile(latencies, 0.95):>6.2f} "
+            f"{cost:>9.3f} {valid / n * 100:>5.0f}% {len(results) - len(ok):>4}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Замер кэша префикса и вариантов промпта")
+    parser.add_argument("--runs", type=int, default=3, help="Повторов всего набора на вариант")
+    parser.add_argument("--variants", default=",".join(prompts.PROMPTS), help="Через запятую")
+    parser.add_argument("--file", help="Тексты запросов, по одному на строку")
+    parser.add_argument("--image", help="URL фото: добавить запрос с фото")
+    args = parser.parse_args()
+
+    samples = SAMPLES
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            samples = [line.strip() for line in f if line.strip()]
+    variants = [v.strip() for v in args.variants.split(",") if v.strip() in prompts.PROMPTS]
+
+    for variant in variants:
+        size = len(prompts.get_prompt(variant))
+        print(f"{variant}: system prompt {size} символов (~{size // 3} токенов), версия {prompts.prompt_version(variant)}")
+    print()
+
+    cases = [(text, None) for text in samples]
+    if args.image:
+        cases.append(("[ФОТО ЕДЫ]", args.image))
+
+    rows = defaultdict(list)
+    try:
+        for variant in variants:
+            for run in range(args.runs):
+                for text, image in cases:
+                    route, code, content, usage, seconds = await _run_one(text, variant, image)
+                    rows[(variant, route.name, route.model)].append(
+                        {"code": code, "content": content, "usage": usage, "seconds": seconds}
+                    )
+                logger.info(f"[Bench] {variant}: run {run + 1}/{args.runs} done")
+    finally:
+        await close_client()
+
+    _report(rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,546 @@
+# app/bench/replay.py
+"""
+Нагрузочный прогон конвейера process_universal_request без внешних сервисов.
+
+    python -m app.bench.replay --init-schema --jobs 500 --concurrency 20
+    python -m app.bench.replay --corpus messages.jsonl --output result.json --baseline baseline.json
+
+Вместо OpenAI и Telegram Bot API поднимаются локальные HTTP-заглушки
+с настраиваемой задержкой (логнормальной, медиана — --openai-latency-ms и т.д.);
+MySQL и Redis — настоящие, но одноразовые (docker-compose.bench.yml).
+Стенд пишет только пользователей из диапазона BENCH_USER_BASE и перед прогоном
+удаляет их записи и ключи — всё равно не запускать против боевых баз.
+
+Корпус: JSON lines {"text": "...", "photo": false} (например, выгрузка реальных
+сообщений) или встроенный синтетический набор с долей фото --photo-ratio.
+Сообщения раздаются пользователям так, что пара «пользователь + текст»
+не повторяется (иначе сработает антидубликат).
+
+Отчёт: задач/с, p50/p95/p99 по всей задаче и по каждому спану
+(app.utils.tracing), запросы к MySQL, команды Redis, вызовы OpenAI и Telegram
+на задачу, число задач, закончившихся сообщением об ошибке.
+--output сохраняет отчёт в JSON; с --baseline прогон сравнивается с прошлым
+и завершается с кодом 1 при регрессии больше --tolerance (для CI).
+"""
+import os
+
+# Bot() проверяет формат токена при импорте app.bot.bot
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import base64  # noqa: E402
+import hashlib  # noqa: E402
+import itertools  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import math  # noqa: E402
+import random  # noqa: E402
+import re  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+import uuid  # noqa: E402
+from collections import Counter, defaultdict  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from pathlib import Path  # noqa: E402
+
+import aiomysql  # noqa: E402
+import pytz  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiohttp import web  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from prometheus_client import REGISTRY  # noqa: E402
+
+from app.api.gpt import close_client  # noqa: E402
+from app.bot.bot import bot  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.db.mysql import close_db, init_db, mysql  # noqa: E402
+from app.db.redis_client import redis  # noqa: E402
+from app.services.food_parser import get_nutrition_index  # noqa: E402
+from app.tasks.gpt_batcher import create_batcher  # noqa: E402
+from app.tasks.gpt_queue import process_universal_request  # noqa: E402
+from app.utils.logger import setup_logger  # noqa: E402
+from app.utils.tracing import start_tracing, stop_tracing  # noqa: E402
+
+setup_logger()
+logger = logging.getLogger(__name__)
+
+BENCH_USER_BASE = 990_000_000_000
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "db" / "schema.sql"
+
+# Начало ответов бота, которые означают, что задача не удалась
+FAILURE_MARKERS = (
+    "Не удалось", "Ошибка", "Сервис временно", "Пользователь не найден",
+    "Фото устарело", "⏳ Дождитесь", "⏳ Это сообщение уже",
+)
+
+SYNTHETIC_TEXTS = [
+    "кофе", "гречка 200г", "банан", "латте 300мл", "творог 5% 200г", "яблоко и груша",
+    "куриная грудка 150г с рисом 200г", "овсянка на молоке 250г", "два яйца и тост с маслом",
+    "на завтрак сырники со сметаной и чай с сахаром",
+    "обед: борщ со сметаной, два куска чёрного хлеба, котлета с пюре и компот",
+    "перекусил протеиновым батончиком, на упаковке 200 ккал на 60г",
+    "сколько калорий в авокадо?", "пицца маргарита 2 куска", "пиво 500мл",
+    "удали последнее", "добавь", "исправь гречку на 150г",
+]
+
+# Минимальный JPEG 1×1: заглушке содержимое фото не важно
+_PIXEL = base64.b64encode(bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c19"
+    "120f1f1f1f141f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1f1"
+    "fffc0000b080001000101011100ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc4"
+    "00b5100002010303020403050504040000017d01020300041105122131410613516107227114328191a1082342b1c115"
+    "52d1f02433627282090a161718191a25262728292a3435363738393a434445464748494a535455565758595a636465666"
+    "768696a737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3"
+    "c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ff"
+    "d9"
+)).decode()
+PHOTO_URL = f"data:image/jpeg;base64,{_PIXEL}"
+
+
+def _lognormal(rng: random.Random, median_ms: float) -> float:
+    """Задержка в секундах: логнормальная с заданной медианой"""
+    if median_ms <= 0:
+        return 0.0
+    return rng.lognormvariate(math.log(median_ms / 1000), 0.35)
+
+
+# ============================================
+# ЗАГЛУШКА OPENAI
+# ============================================
+
+def _fake_answer(text: str) -> dict:
+    """Правдоподобный ответ в формате SYSTEM_PROMPT, детерминированный по тексту"""
+    lowered = text.lower()
+    if re.search(r"удали|убери|отмени", lowered):
+        return {"intent": "delete", "delete_target": "last", "items": [], "notes": ""}
+    if re.search(r"исправь|поправь|поменяй|измени", lowered):
+        m = re.search(r"(\d+)\s*(?:г|мл)", lowered)
+        weight = int(m.group(1)) if m else 150
+        return {"intent": "edit", "edit_target": "last", "notes": "",
+                "items": [{"name": "Блюдо", "weight_grams": weight,
+                           "calories": 180, "protein": 8, "fat": 6, "carbs": 22}]}
+    if lowered.strip(" .!") in ("добавь", "добавь это", "запиши"):
+        return {"intent": "add_previous", "items": [], "notes": ""}
+
+    parts = [p.strip() for p in re.split(r",|\sи\s|\n|:", text) if p.strip()][-4:] or ["Блюдо"]
+    items = []
+    for part in parts:
+        seed = int(hashlib.md5(part.encode()).hexdigest()[:6], 16)
+        protein, fat, carbs = 2 + seed % 25, 1 + seed % 17, 5 + seed % 40
+        items.append({
+            "name": part[:60].capitalize(),
+            "weight_grams": 100 + seed % 200,
+            "calories": protein * 4 + fat * 9 + carbs * 4,
+            "protein": protein, "fat": fat, "carbs": carbs,
+        })
+    intent = "calculate" if "сколько" in lowered else "add"
+    return {"intent": intent, "items": items, "notes": ""}
+
+
+def _request_text(payload: dict) -> str:
+    content = payload["messages"][-1]["content"]
+    if isinstance(content, list):
+        content = next((p.get("text", "") for p in content if p.get("type") == "text"), "")
+    return content.rsplit("ЗАПРОС: ", 1)[-1]
+
+
+class FakeOpenAI:
+    """POST /v1/chat/completions: обычный ответ, SSE (stream=True) и пакетный режим"""
+
+    def __init__(self, rng: random.Random, latency_ms: float, photo_latency_ms: float):
+        self.rng = rng
+        self.latency_ms = latency_ms
+        self.photo_latency_ms = photo_latency_ms
+        self.calls = Counter()
+
+    @staticmethod
+    def _usage(payload: dict, completion: str) -> dict:
+        prompt_chars = sum(len(json.dumps(m.get("content"), ensure_ascii=False)) for m in payload["messages"])
+        prompt_tokens = prompt_chars // 3
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(completion) // 3,
+            "total_tokens": prompt_tokens + len(completion) // 3,
+            "prompt_tokens_details": {"cached_tokens": prompt_tokens // 128 * 128 if prompt_tokens >= 1024 else 0},
+        }
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        has_image = any(
+            isinstance(m.get("content"), list) and any(p.get("type") == "image_url" for p in m["content"])
+            for m in payload["messages"]
+        )
+        batch = "ПАКЕТНЫЙ РЕЖИМ" in payload["messages"][0]["content"]
+        kind = "batch" if batch else "photo" if has_image else "text"
+        self.calls[kind] += 1
+        delay = _lognormal(self.rng, self.photo_latency_ms if has_image else self.latency_ms)
+
+        if batch:
+            requests = json.loads(payload["messages"][-1]["content"])
+            answer = {"results": [{"id": r["id"], **_fake_answer(r["text"])} for r in requests]}
+        else:
+            answer = _fake_answer(_request_text(payload))
+        content = json.dumps(answer, ensure_ascii=False)
+        usage = self._usage(payload, content)
+
+        if not payload.get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(delay * 0.3)  # Время до первого токена
+        pieces = [content[i:i + 40] for i in range(0, len(content), 40)]
+        for piece in pieces:
+            chunk = {"choices": [{"delta": {"content": piece}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(delay * 0.7 / len(pieces))
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+# ============================================
+# ЗАГЛУШКА TELEGRAM BOT API
+# ============================================
+
+class FakeTelegram:
+    """POST /bot{token}/{method}: отвечает как Bot API, считает вызовы и ответы-ошибки"""
+
+    MESSAGE_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "editMessageCaption"}
+
+    def __init__(self, rng: random.Random, latency_ms: float):
+        self.rng = rng
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self.failures = 0
+        self._ids = itertools.count(1_000_000)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.calls[method] += 1
+        await asyncio.sleep(_lognormal(self.rng, self.latency_ms))
+
+        if method not in self.MESSAGE_METHODS:
+            return web.json_response({"ok": True, "result": True})
+
+        text = str(form.get("text") or form.get("caption") or "")
+        if method == "sendMessage" and text.startswith(FAILURE_MARKERS):
+            self.failures += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": int(form.get("chat_id") or 0), "type": "private"},
+            "text": text,
+        }})
+
+
+async def _serve(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+# ============================================
+# СБОР ИЗМЕРЕНИЙ
+# ============================================
+
+class SpanCollector:
+    """Экспортёр для app.utils.tracing: длительности спанов в памяти, по имени"""
+
+    def __init__(self):
+        self.durations: dict[str, list[float]] = defaultdict(list)
+
+    async def export(self, spans) -> None:
+        for s in spans:
+            self.durations[s.name].append((s.end_ns - s.start_ns) / 1e6)
+
+    async def close(self) -> None:
+        pass
+
+
+class QueryCounter:
+    """Считает все запросы aiomysql, включая транзакции через pool.acquire()"""
+
+    def __init__(self):
+        self.count = 0
+        original = aiomysql.Cursor.execute
+        counter = self
+
+        async def execute(cursor, query, args=None):
+            counter.count += 1
+            return await original(cursor, query, args)
+
+        aiomysql.Cursor.execute = execute
+
+
+def _redis_commands() -> float:
+    return sum(
+        sample.value
+        for family in REGISTRY.collect() if family.name == "bot_redis_command_seconds"
+        for sample in family.samples if sample.name.endswith("_count")
+    )
+
+
+def _percentiles(values: list[float]) -> dict:
+    ordered = sorted(values)
+
+    def pick(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+# ============================================
+# ПОДГОТОВКА ДАННЫХ
+# ============================================
+
+def _load_corpus(path: str | None, photo_ratio: float, rng: random.Random) -> list[dict]:
+    if path:
+        with open(path, encoding="utf-8") as f:
+            corpus = [json.loads(line) for line in f if line.strip()]
+        return [{"text": m.get("text") or "", "photo": bool(m.get("photo"))} for m in corpus]
+    corpus = [{"text": text, "photo": False} for text in SYNTHETIC_TEXTS]
+    photos = round(len(corpus) * photo_ratio / max(1e-9, 1 - photo_ratio))
+    corpus += [{"text": rng.choice(["", "", "обед", "это мой завтрак"]), "photo": True} for _ in range(photos)]
+    return corpus
+
+
+async def _init_schema() -> None:
+    statements = SCHEMA_PATH.read_text(encoding="utf-8").split(";")
+    for statement in statements:
+        sql = "\n".join(line for line in statement.splitlines() if not line.strip().startswith("--")).strip()
+        if sql:
+            await mysql.execute(sql)
+
+
+async def _prepare_users(users: int) -> None:
+    last = BENCH_USER_BASE + users - 1
+    await mysql.execute("DELETE FROM meals_history WHERE tg_id BETWEEN %s AND %s", (BENCH_USER_BASE, last))
+    await mysql.execute("DELETE FROM daily_totals WHERE tg_id BETWEEN %s AND %s", (BENCH_USER_BASE, last))
+    expiration = (datetime.now() + timedelta(days=30)).date()
+    for start in range(0, users, 500):
+        rows = [
+            (BENCH_USER_BASE + i, f"bench{i}", 1000, expiration, "Europe/Moscow", 2000)
+            for i in range(start, min(users, start + 500))
+        ]
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))
+        await mysql.execute(
+            f"""INSERT INTO users_tbl (tg_id, tg_name, free_tokens, expiration_date, timezone, calorie_goal)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE free_tokens = VALUES(free_tokens), expiration_date = VALUES(expiration_date)""",
+            tuple(value for row in rows for value in row),
+        )
+
+    # Ключи прошлых прогонов: история диалога, антидубликат, today-view, блокировки
+    prefix = str(BENCH_USER_BASE)[:6]
+    keys = [key async for key in redis.scan_iter(match=f"*{prefix}*", count=1000)]
+    for i in range(0, len(keys), 500):
+        await redis.delete(*keys[i:i + 500])
+
+
+def _build_jobs(corpus: list[dict], users: int, count: int) -> list[dict]:
+    if count > users * len(corpus):
+        logger.warning(f"[Bench] {count} задач больше уникальных пар пользователь+текст ({users * len(corpus)})")
+    jobs = []
+    for i in range(count):
+        message = corpus[(i // users) % len(corpus)]
+        user_id = BENCH_USER_BASE + i % users
+        jobs.append({
+            "user_id": user_id,
+            "chat_id": user_id,
+            "message_id": 10_000 + i,
+            "text": message["text"],
+            "image_url": PHOTO_URL if message["photo"] else None,
+        })
+    return jobs
+
+
+# ============================================
+# ПРОГОН
+# ============================================
+
+async def _run_jobs(jobs: list[dict], concurrency: int, ctx: dict, timings: list[float] | None) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(job: dict) -> None:
+        async with semaphore:
+            job_ctx = {**ctx, "job_id": uuid.uuid4().hex, "enqueue_time": datetime.now(pytz.utc)}
+            started = time.perf_counter()
+            try:
+                await process_universal_request(job_ctx, **job)
+            except Exception as e:
+                logger.exception(f"[Bench] Job failed: {e}")
+            if timings is not None:
+                timings.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one(job) for job in jobs))
+
+
+def _compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Регрессии относительно baseline: пропускная способность, p95 задачи, запросы на задачу"""
+    problems = []
+    if result["jobs_per_s"] < baseline["jobs_per_s"] * (1 - tolerance):
+        problems.append(f"jobs/s {result['jobs_per_s']} < {baseline['jobs_per_s']} (−{tolerance:.0%})")
+    p95, base_p95 = result["stages"]["job"]["p95_ms"], baseline["stages"]["job"]["p95_ms"]
+    if p95 > base_p95 * (1 + tolerance):
+        problems.append(f"job p95 {p95}ms > {base_p95}ms (+{tolerance:.0%})")
+    for key in ("db_queries", "redis_commands", "openai_calls", "telegram_calls"):
+        value, base = result["per_job"][key], baseline["per_job"][key]
+        if value > base * (1 + tolerance) + 0.05:
+            problems.append(f"{key}/job {value} > {base}")
+    return problems
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон process_universal_request")
+    parser.add_argument("--jobs", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50, help="Задачи до начала замера")
+    parser.add_argument("--concurrency", type=int, default=settings.worker_interactive_max_jobs)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--corpus", help="JSON lines: {\"text\": ..., \"photo\": bool}")
+    parser.add_argument("--photo-ratio", type=float, default=0.2)
+    parser.add_argument("--openai-latency-ms", type=float, default=800)
+    parser.add_argument("--openai-photo-latency-ms", type=float, default=2500)
+    parser.add_argument("--telegram-latency-ms", type=float, default=40)
+    parser.add_argument("--no-batcher", action="store_true", help="Без микробатчинга GPT")
+    parser.add_argument("--init-schema", action="store_true", help="Создать таблицы из app/db/schema.sql")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    parser.add_argument("--baseline", help="Отчёт прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    openai = FakeOpenAI(rng, args.openai_latency_ms, args.openai_photo_latency_ms)
+    telegram = FakeTelegram(rng, args.telegram_latency_ms)
+
+    openai_app = web.Application(client_max_size=32 * 1024 * 1024)
+    openai_app.router.add_post("/v1/chat/completions", openai.handle)
+    telegram_app = web.Application()
+    telegram_app.router.add_post("/bot{token}/{method}", telegram.handle)
+    openai_runner, openai_url = await _serve(openai_app)
+    telegram_runner, telegram_url = await _serve(telegram_app)
+
+    settings.openai_api_url = f"{openai_url}/v1/chat/completions"
+    settings.openai_api_key = settings.openai_api_key or "bench"
+    settings.openai_rpm_limit = 0  # Замеряем конвейер, а не лимитер ключа
+    settings.tracing_enabled = True
+    settings.tracing_sample_rate = 1.0
+    settings.tracing_flush_interval = 0.5
+    bot.session.api = TelegramAPIServer.from_base(telegram_url)
+
+    collector = SpanCollector()
+    queries = QueryCounter()
+    app = FastAPI()
+    await init_db(app)
+    await start_tracing("calorie-bot-bench", exporter=collector)
+    get_nutrition_index()
+
+    ctx = {"app": app}
+    batcher = None
+    if settings.gpt_batch_enabled and not args.no_batcher:
+        batcher = create_batcher()
+        await batcher.start()
+        ctx["gpt_batcher"] = batcher
+
+    try:
+        if args.init_schema:
+            await _init_schema()
+        corpus = _load_corpus(args.corpus, args.photo_ratio, rng)
+        await _prepare_users(args.users)
+        jobs = _build_jobs(corpus, args.users, args.warmup + args.jobs)
+        warmup, measured = jobs[:args.warmup], jobs[args.warmup:]
+
+        logger.info(f"[Bench] Warmup: {len(warmup)} jobs")
+        await _run_jobs(warmup, args.concurrency, ctx, None)
+        await stop_tracing()
+        collector.durations.clear()
+        await start_tracing("calorie-bot-bench", exporter=collector)
+
+        openai.calls.clear()
+        telegram.calls.clear()
+        telegram.failures = 0
+        queries_before, redis_before = queries.count, _redis_commands()
+        timings: list[float] = []
+
+        logger.info(f"[Bench] Measuring: {len(measured)} jobs, concurrency {args.concurrency}")
+        started = time.perf_counter()
+        await _run_jobs(measured, args.concurrency, ctx, timings)
+        if batcher:
+            await batcher.stop()
+            batcher = None
+        wall = time.perf_counter() - started
+        await stop_tracing()
+    finally:
+        if batcher:
+            await batcher.stop()
+        await stop_tracing()
+        await close_client()
+        await bot.session.close()
+        await close_db(app)
+        await redis.close()
+        await openai_runner.cleanup()
+        await telegram_runner.cleanup()
+
+    n = len(measured) or 1
+    result = {
+        "jobs": len(measured),
+        "concurrency": args.concurrency,
+        "wall_s": round(wall, 2),
+        "jobs_per_s": round(len(measured) / wall, 2),
+        "failed": telegram.failures,
+        "per_job": {
+            "db_queries": round((queries.count - queries_before) / n, 2),
+            "redis_commands": round((_redis_commands() - redis_before) / n, 2),
+            "openai_calls": round(sum(openai.calls.values()) / n, 3),
+            "telegram_calls": round(sum(telegram.calls.values()) / n, 2),
+        },
+        "openai_calls": dict(openai.calls),
+        "telegram_calls": dict(telegram.calls),
+        "stages": {"job": _percentiles(timings)},
+    }
+    for name, values in sorted(collector.durations.items()):
+        result["stages"][name] = _percentiles(values)
+
+    print(f"\nЗадач: {result['jobs']} за {result['wall_s']}s — {result['jobs_per_s']} задач/с, "
+          f"с ошибкой: {result['failed']}")
+    print("На задачу: " + ", ".join(f"{k} {v}" for k, v in result["per_job"].items()))
+    print(f"\n{'этап':<32} {'n':>6} {'p50,ms':>9} {'p95,ms':>9} {'p99,ms':>9}")
+    for name, stage in result["stages"].items():
+        print(f"{name:<32} {stage['count']:>6} {stage['p50_ms']:>9} {stage['p95_ms']:>9} {stage['p99_ms']:>9}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    exit_code = 0
+    if result["failed"]:
+        print(f"\n❌ {result['failed']} задач закончились сообщением об ошибке")
+        exit_code = 1
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            print(f"\nBaseline {args.baseline} не найден — сравнение пропущено")
+        else:
+            with open(args.baseline, encoding="utf-8") as f:
+                problems = _compare(result, json.load(f), args.tolerance)
+            for problem in problems:
+                print(f"❌ Регрессия: {problem}")
+            if problems:
+                exit_code = 1
+            else:
+                print("\n✅ Без регрессий относительно baseline")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
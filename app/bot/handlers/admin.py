@@ -134,7 +134,7 @@ async def receive_broadcast_message(message: Message, state: FSMContext):
         }
 
         arq = await get_arq_redis()
-        await arq.enqueue_job("send_broadcast", data)
+        await arq.enqueue_job("send_broadcast", data, _queue_name=settings.queue_bulk)
         
         await state.clear()
         
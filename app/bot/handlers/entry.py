@@ -5,12 +5,15 @@
 """
 from aiogram import Router, F
 from aiogram.types import Message
-from app.services.user import get_or_create_user, refund_token
+from app.services.user import get_or_create_user, deduct_token, refund_token
 from app.utils.audio import ogg_to_text
+from app.services.blob_store import put_blob
+from app.utils.image import pick_photo_size, prepare_image
 from app.utils.telegram_helpers import escape_html
-from app.db.mysql import mysql
+from app.utils.metrics import WEBHOOK_TO_ENQUEUE, observe_since
+from app.utils.tracing import current_traceparent, span
+from app.config import settings
 import logging
-import base64
 from io import BytesIO
 
 router = Router()
@@ -25,19 +28,6 @@ TEXT_PROCESSING = "⏳ Обрабатываю..."
 TEXT_VOICE_PROCESSING = "🎤 Распознаю речь..."
 
 
-async def deduct_token_atomic(user_id: int) -> bool:
-    """Атомарно списывает токен"""
-    async with mysql.pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                """UPDATE users_tbl 
-                   SET free_tokens = free_tokens - 1 
-                   WHERE tg_id = %s AND free_tokens > 0""",
-                (user_id,)
-            )
-            return cur.rowcount > 0
-
-
 @router.message(F.text)
 async def on_text(message: Message, **data):
     """
@@ -57,7 +47,7 @@ async def on_text(message: Message, **data):
         return
     
     # Списываем токен
-    if not await deduct_token_atomic(user_id):
+    if not await deduct_token(user_id):
         await message.answer(TEXT_LIMIT_EXCEEDED)
         return
     
@@ -73,8 +63,11 @@ async def on_text(message: Message, **data):
             message_id=msg.message_id,
             chat_id=message.chat.id,
             text=text,
-            image_url=None
+            image_url=None,
+            traceparent=current_traceparent(),
+            _queue_name=settings.queue_interactive
         )
+        observe_since(WEBHOOK_TO_ENQUEUE, data.get("webhook_received_at"), kind="text")
     except Exception as e:
         logger.error(f"[Entry:Text] Queue error for user {user_id}: {e}")
         await msg.edit_text("⚠️ Ошибка. Попробуйте позже.")
@@ -86,7 +79,7 @@ async def on_voice(message: Message, **data):
     """Обработка голосовых сообщений"""
     user_id = message.from_user.id
     
-    if not await deduct_token_atomic(user_id):
+    if not await deduct_token(user_id):
         await message.answer(TEXT_LIMIT_EXCEEDED)
         return
     
@@ -124,8 +117,11 @@ async def on_voice(message: Message, **data):
             message_id=status_msg.message_id,
             chat_id=message.chat.id,
             text=text,
-            image_url=None
+            image_url=None,
+            traceparent=current_traceparent(),
+            _queue_name=settings.queue_interactive
         )
+        observe_since(WEBHOOK_TO_ENQUEUE, data.get("webhook_received_at"), kind="voice")
         
     except Exception as e:
         logger.exception(f"[Entry:Voice] Error for user {user_id}: {e}")
@@ -141,14 +137,14 @@ async def on_photo(message: Message, **data):
     """Обработка фотографий еды"""
     user_id = message.from_user.id
     
-    if not await deduct_token_atomic(user_id):
+    if not await deduct_token(user_id):
         await message.answer(TEXT_LIMIT_EXCEEDED)
         return
     
     try:
         logger.info(f"[Entry:Photo] User {user_id}: processing photo")
         
-        photo = message.photo[-1]
+        photo = pick_photo_size(message.photo)
         file_size_mb = photo.file_size / (1024 * 1024) if photo.file_size else 0
         
         if file_size_mb > 10:
@@ -159,9 +155,12 @@ async def on_photo(message: Message, **data):
         file = await message.bot.get_file(photo.file_id)
 
         buf = BytesIO()
-        await message.bot.download_file(file.file_path, destination=buf)
-        image_b64 = base64.b64encode(buf.getvalue()).decode()
-        url = f"data:image/jpeg;base64,{image_b64}"
+        with span("telegram.download_photo", file_size=photo.file_size or 0):
+            await message.bot.download_file(file.file_path, destination=buf)
+        # В очередь уходит только ключ файла, а не base64 в Redis
+        with span("image.prepare"):
+            image_bytes = await prepare_image(buf.getvalue())
+            image_key = await put_blob(image_bytes)
         caption = message.caption.strip() if message.caption else ""
         
         redis = data["redis"]
@@ -173,8 +172,12 @@ async def on_photo(message: Message, **data):
             message_id=msg.message_id,
             chat_id=message.chat.id,
             text=caption,
-            image_url=url
+            image_key=image_key,
+            image_file_id=photo.file_id,
+            traceparent=current_traceparent(),
+            _queue_name=settings.queue_interactive
         )
+        observe_since(WEBHOOK_TO_ENQUEUE, data.get("webhook_received_at"), kind="photo")
         
     except Exception as e:
         logger.exception(f"[Entry:Photo] Error for user {user_id}: {e}")
@@ -2,7 +2,7 @@ from aiogram import Router, types
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from app.services.user import get_user_by_id, block_autopay, FREE_TOKENS_COUNT, SUBSCRIBED_TOKENS_COUNT
+from app.services.user import get_user_by_id, block_autopay, get_token_balance, FREE_TOKENS_COUNT, SUBSCRIBED_TOKENS_COUNT
 from app.services.meals import get_week_stats
 from app.config import settings
 from datetime import datetime, date
@@ -42,7 +42,7 @@ async def handle_profile(message: types.Message):
 
         autopay_active = user.get("payment_method_id") is not None
 
-        free_tokens = user.get("free_tokens", 0)
+        free_tokens = await get_token_balance(user)
         max_tokens = SUBSCRIBED_TOKENS_COUNT if is_active else FREE_TOKENS_COUNT
         tokens_display = f"{free_tokens} из {max_tokens}"
 
@@ -3,7 +3,7 @@ from aiogram import Router
 from aiogram.filters import CommandStart
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BotCommand
 from aiogram.fsm.context import FSMContext
-from app.services.user import get_or_create_user, get_user_by_id, set_user_timezone, FREE_TOKENS_COUNT
+from app.services.user import get_or_create_user, get_user_by_id, set_user_timezone, get_token_balance
 from app.utils.telegram_helpers import escape_html, safe_send_message
 import logging
 
@@ -117,7 +117,7 @@ async def handle_start(message: Message, state: FSMContext):
                 parse_mode="HTML"
             )
         else:
-            tokens = user.get("free_tokens", FREE_TOKENS_COUNT)
+            tokens = await get_token_balance(user)
             await message.answer(
                 WELCOME_TEXT.format(name=user_name, tokens=tokens),
                 parse_mode="HTML",
@@ -153,7 +153,7 @@ async def handle_timezone_selection(callback: CallbackQuery, state: FSMContext):
             await callback.answer("Установлено")
 
         user = await get_user_by_id(user_id)
-        tokens = user.get("free_tokens", FREE_TOKENS_COUNT)
+        tokens = await get_token_balance(user)
 
         await callback.message.edit_text(
             WELCOME_TEXT.format(name=user_name, tokens=tokens),
@@ -0,0 +1,141 @@
+# app/bot/update_queue.py
+"""
+Ограниченная очередь обновлений Telegram внутри процесса вебхука.
+
+Вместо create_task на каждое обновление — фиксированный пул воркеров:
+    - не больше WEBHOOK_QUEUE_SIZE обновлений в ожидании, сверх — отказ (503),
+      Telegram повторит доставку позже;
+    - обновления одного пользователя обрабатываются строго по очереди
+      (в пределах процесса): у каждого пользователя свой deque, а в общей
+      очереди готовых — только его ключ, пока у него есть необработанные обновления;
+    - при остановке новые обновления не принимаются, очередь дорабатывается
+      за WEBHOOK_DRAIN_TIMEOUT секунд, после чего воркеры отменяются.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from app.bot.bot import bot, dp
+from app.config import settings
+from app.utils.metrics import UPDATE_QUEUE_DEPTH, UPDATE_QUEUE_WAIT, UPDATES
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def update_key(update: dict):
+    """Ключ упорядочивания: id отправителя, иначе чат, иначе само обновление"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return f"update:{update.get('update_id')}"
+
+
+class UpdateQueue:
+    def __init__(self):
+        self._pending: dict[object, deque] = {}  # Ключ → обновления, ждущие обработки
+        self._ready: asyncio.Queue | None = None  # Ключи, у которых есть что обрабатывать
+        self._workers: set[asyncio.Task] = set()
+        self._size = 0
+        self._accepting = False
+        self._idle = asyncio.Event()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def submit(self, update: dict) -> bool:
+        """Ставит обновление в очередь. False — очередь полна или остановлена"""
+        if not self._accepting or self._size >= settings.webhook_queue_size:
+            UPDATES.labels(result="shed").inc()
+            return False
+
+        key = update_key(update)
+        item = (update, time.perf_counter())
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            pending.append(item)  # Ключ уже в работе или в очереди готовых
+
+        self._size += 1
+        self._idle.clear()
+        UPDATE_QUEUE_DEPTH.inc()
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._pending[key]
+            update, received_at = pending.popleft()
+            try:
+                await self._process(update, received_at)
+            finally:
+                self._size -= 1
+                UPDATE_QUEUE_DEPTH.dec()
+                if pending:
+                    # В конец очереди готовых — остальные пользователи не ждут
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                    if not self._size:
+                        self._idle.set()
+
+    async def _process(self, update: dict, received_at: float) -> None:
+        update_id = update.get("update_id")
+        wait = time.perf_counter() - received_at
+        UPDATE_QUEUE_WAIT.observe(wait)
+        try:
+            with span("telegram.update", update_id=update_id) as s:
+                s.set("queue_wait_ms", round(wait * 1000, 1))
+                # received_at попадает в data хендлеров — для метрики webhook → очередь
+                await asyncio.wait_for(
+                    dp.feed_raw_update(bot, update, webhook_received_at=received_at),
+                    settings.webhook_update_timeout,
+                )
+            UPDATES.labels(result="processed").inc()
+            logger.debug(f"✅ Update {update_id} processed")
+        except asyncio.TimeoutError:
+            UPDATES.labels(result="timeout").inc()
+            logger.error(f"❌ Update {update_id} timed out after {settings.webhook_update_timeout}s")
+        except Exception as e:
+            UPDATES.labels(result="error").inc()
+            logger.exception(f"❌ Error processing Telegram update {update_id}: {e}")
+
+    async def start(self) -> None:
+        self._ready = asyncio.Queue()
+        self._idle.set()
+        self._accepting = True
+        for _ in range(settings.webhook_workers):
+            task = asyncio.create_task(self._worker())
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+        logger.info(
+            f"[UpdateQueue] Started {settings.webhook_workers} workers, "
+            f"capacity {settings.webhook_queue_size}"
+        )
+
+    async def stop(self) -> None:
+        """Перестаёт принимать обновления и дорабатывает очередь"""
+        self._accepting = False
+        if self._size:
+            logger.info(f"[UpdateQueue] Draining {self._size} updates...")
+            try:
+                await asyncio.wait_for(self._idle.wait(), settings.webhook_drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"[UpdateQueue] Drain timeout, {self._size} updates dropped")
+        workers = list(self._workers)
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+update_queue = UpdateQueue()
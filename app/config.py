@@ -18,6 +18,123 @@ class Settings:
         self.openai_timeout = int(os.getenv("OPENAI_TIMEOUT_SECONDS", 25))
         self.openai_max_tokens = int(os.getenv("OPENAI_MAX_TOKENS", 2048))
         self.openai_temperature = float(os.getenv("OPENAI_TEMPERATURE", 0.5))
+        self.openai_stream_enabled = os.getenv("OPENAI_STREAM_ENABLED", "1") == "1"
+        self.stream_edit_interval = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", 1.5))
+
+        # Устойчивость клиента OpenAI: квоты ключа, circuit breaker, hedged-запросы
+        self.openai_rpm_limit = int(os.getenv("OPENAI_RPM_LIMIT", 500))  # 0 — без ограничения
+        self.openai_tpm_limit = int(os.getenv("OPENAI_TPM_LIMIT", 200000))
+        self.openai_rate_max_wait = float(os.getenv("OPENAI_RATE_MAX_WAIT_SECONDS", 10))
+        self.openai_breaker_enabled = os.getenv("OPENAI_BREAKER_ENABLED", "1") == "1"
+        self.openai_breaker_window = int(os.getenv("OPENAI_BREAKER_WINDOW_SECONDS", 30))
+        self.openai_breaker_min_requests = int(os.getenv("OPENAI_BREAKER_MIN_REQUESTS", 10))
+        self.openai_breaker_failure_ratio = float(os.getenv("OPENAI_BREAKER_FAILURE_RATIO", 0.5))
+        self.openai_breaker_cooldown = int(os.getenv("OPENAI_BREAKER_COOLDOWN_SECONDS", 20))
+        self.openai_hedge_enabled = os.getenv("OPENAI_HEDGE_ENABLED", "1") == "1"
+        self.openai_hedge_min_ms = int(os.getenv("OPENAI_HEDGE_MIN_MS", 3000))
+        self.openai_hedge_percentile = float(os.getenv("OPENAI_HEDGE_PERCENTILE", 0.95))
+        self.openai_backoff_base = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", 0.5))
+        self.openai_backoff_max = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", 8))
+        self.openai_deadline = float(os.getenv("OPENAI_DEADLINE_SECONDS", 60))
+
+        # Маршрутизация по моделям: "модель:max_tokens[:detail]" для каждого класса запроса
+        self.openai_routing_enabled = os.getenv("OPENAI_ROUTING_ENABLED", "1") == "1"
+        self.openai_route_short_text = os.getenv("OPENAI_ROUTE_SHORT_TEXT", "gpt-5-mini:800")
+        self.openai_route_long_text = os.getenv("OPENAI_ROUTE_LONG_TEXT", "gpt-5-mini:1500")
+        self.openai_route_command = os.getenv("OPENAI_ROUTE_COMMAND", "gpt-5-mini:600")
+        self.openai_route_photo = os.getenv("OPENAI_ROUTE_PHOTO", f"{self.openai_default_model}:1500")
+        self.openai_fallback_model = os.getenv("OPENAI_FALLBACK_MODEL", self.openai_default_model)
+        self.openai_short_text_chars = int(os.getenv("OPENAI_SHORT_TEXT_CHARS", 80))
+        self.openai_compact_prompt_routes = os.getenv("OPENAI_COMPACT_PROMPT_ROUTES", "command")
+        self.openai_prompt_cache_key = os.getenv("OPENAI_PROMPT_CACHE_KEY", "calorie-bot")  # "" — не передавать
+        # $ за 1M токенов: "модель=вход/выход,..."
+        self.openai_prices = os.getenv("OPENAI_PRICES", "gpt-5.2=1.75/14,gpt-5-mini=0.25/2")
+
+        # Кэш ответов GPT (Redis + локальный LRU)
+        self.gpt_cache_enabled = os.getenv("GPT_CACHE_ENABLED", "1") == "1"
+        self.gpt_cache_ttl = int(os.getenv("GPT_CACHE_TTL_SECONDS", 259200))  # 3 дня
+        self.gpt_cache_local_size = int(os.getenv("GPT_CACHE_LOCAL_SIZE", 2048))
+        self.gpt_cache_local_ttl = int(os.getenv("GPT_CACHE_LOCAL_TTL_SECONDS", 600))
+
+        # Микробатчинг текстовых запросов в воркере
+        self.gpt_batch_enabled = os.getenv("GPT_BATCH_ENABLED", "1") == "1"
+        self.gpt_batch_window_ms = int(os.getenv("GPT_BATCH_WINDOW_MS", 300))
+        self.gpt_batch_max_size = int(os.getenv("GPT_BATCH_MAX_SIZE", 8))
+        self.gpt_batch_max_tokens = int(os.getenv("GPT_BATCH_MAX_TOKENS", 8192))
+
+        # Локальный разбор простых записей («гречка 200г») без GPT
+        self.food_parser_enabled = os.getenv("FOOD_PARSER_ENABLED", "1") == "1"
+        self.food_parser_min_confidence = float(os.getenv("FOOD_PARSER_MIN_CONFIDENCE", 0.85))
+
+        # Локальные правила для команд (удалить/изменить/добавить расчёт) без GPT
+        self.intent_rules_enabled = os.getenv("INTENT_RULES_ENABLED", "1") == "1"
+        self.intent_rules_audit_rate = float(os.getenv("INTENT_RULES_AUDIT_RATE", 0.05))  # 1 — только сверка
+        self.intent_rules_sample_rate = float(os.getenv("INTENT_RULES_SAMPLE_RATE", 0.02))
+        self.intent_model_path = os.getenv("INTENT_MODEL_PATH", "")
+        self.intent_model_veto = float(os.getenv("INTENT_MODEL_VETO", 0.9))
+
+        # Хранилище фото (общий том вебхука и воркеров)
+        self.blob_store_dir = os.getenv("BLOB_STORE_DIR", "/shared-blobs")
+        self.blob_ttl = int(os.getenv("BLOB_TTL_SECONDS", 3600))
+
+        # Подготовка фото перед vision-запросом
+        self.image_prep_enabled = os.getenv("IMAGE_PREP_ENABLED", "1") == "1"
+        self.image_short_side = int(os.getenv("IMAGE_SHORT_SIDE", 768))
+        self.image_jpeg_quality = int(os.getenv("IMAGE_JPEG_QUALITY", 82))
+        self.image_prep_workers = int(os.getenv("IMAGE_PREP_WORKERS", 2))
+        self.openai_image_detail = os.getenv("OPENAI_IMAGE_DETAIL", "high")
+
+        # Повторные фото: перцептивный хэш вместо нового vision-запроса
+        self.photo_dedupe_enabled = os.getenv("PHOTO_DEDUPE_ENABLED", "1") == "1"
+        self.photo_dedupe_user_distance = int(os.getenv("PHOTO_DEDUPE_USER_DISTANCE", 6))
+        self.photo_dedupe_global_distance = int(os.getenv("PHOTO_DEDUPE_GLOBAL_DISTANCE", 2))
+        self.photo_dedupe_ttl = int(os.getenv("PHOTO_DEDUPE_TTL_SECONDS", 2592000))  # 30 дней
+
+        # Кэш строк users_tbl в памяти процесса
+        self.user_cache_enabled = os.getenv("USER_CACHE_ENABLED", "1") == "1"
+        self.user_cache_ttl = int(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+        self.user_cache_size = int(os.getenv("USER_CACHE_SIZE", 10000))
+
+        # Блюда «сегодня» в Redis (today-view)
+        self.today_view_enabled = os.getenv("TODAY_VIEW_ENABLED", "1") == "1"
+        self.today_view_ttl = int(os.getenv("TODAY_VIEW_TTL_SECONDS", 172800))  # 2 дня
+
+        # Очереди ARQ и пулы воркеров: запросы пользователей, рассылки, платежи/cron
+        self.queue_interactive = os.getenv("QUEUE_INTERACTIVE", "arq:queue")
+        self.queue_bulk = os.getenv("QUEUE_BULK", "arq:queue:bulk")
+        self.queue_cron = os.getenv("QUEUE_CRON", "arq:queue:cron")
+        self.worker_interactive_max_jobs = int(os.getenv("WORKER_INTERACTIVE_MAX_JOBS", 20))
+        self.worker_bulk_max_jobs = int(os.getenv("WORKER_BULK_MAX_JOBS", 2))
+        self.worker_cron_max_jobs = int(os.getenv("WORKER_CRON_MAX_JOBS", 4))
+        self.queue_depth_interval = float(os.getenv("QUEUE_DEPTH_INTERVAL_SECONDS", 15))
+
+        # Рассылки (лимит Telegram — около 30 сообщений/с)
+        self.broadcast_rate = float(os.getenv("BROADCAST_RATE", 25))
+        self.broadcast_concurrency = int(os.getenv("BROADCAST_CONCURRENCY", 25))
+        self.broadcast_page_size = int(os.getenv("BROADCAST_PAGE_SIZE", 500))
+
+        # GPT-задачи одного пользователя — по очереди (per-user lock + список ожидания)
+        self.user_job_serialize = os.getenv("USER_JOB_SERIALIZE", "1") == "1"
+        self.user_job_lock_ttl = int(os.getenv("USER_JOB_LOCK_TTL_SECONDS", 180))
+        self.user_job_max_waiting = int(os.getenv("USER_JOB_MAX_WAITING", 10))
+
+        # Очередь обновлений вебхука (в каждом процессе gunicorn)
+        self.webhook_workers = int(os.getenv("WEBHOOK_WORKERS", 16))
+        self.webhook_queue_size = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+        self.webhook_update_timeout = float(os.getenv("WEBHOOK_UPDATE_TIMEOUT", 90))
+        self.webhook_drain_timeout = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 20))
+
+        # Метрики Prometheus (/metrics у бэкенда, отдельный порт у воркера)
+        self.metrics_enabled = os.getenv("METRICS_ENABLED", "1") == "1"
+        self.worker_metrics_port = int(os.getenv("WORKER_METRICS_PORT", 9100))
+
+        # Трассировка (спаны вебхук → очередь → GPT → ответ)
+        self.tracing_enabled = os.getenv("TRACING_ENABLED", "0") == "1"
+        self.tracing_exporter = os.getenv("TRACING_EXPORTER", "file")  # file | otlp
+        self.tracing_file_path = os.getenv("TRACING_FILE_PATH", "/tmp/traces/spans.jsonl")
+        self.tracing_otlp_endpoint = os.getenv("TRACING_OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+        self.tracing_sample_rate = float(os.getenv("TRACING_SAMPLE_RATE", 1.0))
+        self.tracing_flush_interval = float(os.getenv("TRACING_FLUSH_INTERVAL", 5))
 
         # YooKassa API
         self.yookassa_store_id = os.getenv("YOKASSA_STORE_ID")
@@ -31,6 +148,19 @@ class Settings:
         self.db_password = os.getenv("DB_PASSWORD")
         self.db_name = os.getenv("DB_NAME")
 
+        # Пул соединений MySQL (отдельный в каждом процессе вебхука и воркера)
+        self.db_pool_min = int(os.getenv("DB_POOL_MIN", 5))
+        self.db_pool_max = int(os.getenv("DB_POOL_MAX", 20))
+        self.db_pool_adaptive = os.getenv("DB_POOL_ADAPTIVE", "1") == "1"
+        self.db_pool_max_limit = int(os.getenv("DB_POOL_MAX_LIMIT", 40))
+        self.db_pool_adapt_interval = int(os.getenv("DB_POOL_ADAPT_INTERVAL_SECONDS", 30))
+        self.db_pool_adapt_step = int(os.getenv("DB_POOL_ADAPT_STEP", 2))
+        self.db_pool_wait_threshold_ms = float(os.getenv("DB_POOL_WAIT_THRESHOLD_MS", 50))
+        self.db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE_SECONDS", 3600))
+        self.db_connect_timeout = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", 10))
+        self.db_query_timeout = float(os.getenv("DB_QUERY_TIMEOUT_SECONDS", 10))
+        self.db_slow_query_ms = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+
         # Cache (Redis)
         self.redis_host = os.getenv("REDIS_HOST", "redis")
         self.redis_port = int(os.getenv("REDIS_PORT", 6379))
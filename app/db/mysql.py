@@ -1,62 +1,237 @@
 # app/db/mysql.py
+import asyncio
+import bisect
+import collections
+import time
 import aiomysql
 from fastapi import FastAPI
 from app.config import settings
+from app.utils.metrics import DB_ACQUIRE, DB_POOL_IN_USE, DB_POOL_WAITING, DB_QUERY
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Границы гистограммы ожидания соединения, мс
+ACQUIRE_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class PoolStats:
+    """Счётчики пула соединений в пределах процесса"""
+
+    def __init__(self):
+        self.acquire_buckets = [0] * (len(ACQUIRE_BUCKETS_MS) + 1)
+        self.acquire_count = 0
+        self.acquire_sum_ms = 0.0
+        self.acquire_max_ms = 0.0
+        self.waiting = 0  # Корутины, ждущие свободное соединение
+        self.queries = 0
+        self.slow_queries = 0
+        self.query_timeouts = 0
+        self._window_waits = 0  # Долгие ожидания с прошлой проверки размера пула
+
+    def observe_acquire(self, elapsed_ms: float) -> None:
+        self.acquire_buckets[bisect.bisect_left(ACQUIRE_BUCKETS_MS, elapsed_ms)] += 1
+        self.acquire_count += 1
+        self.acquire_sum_ms += elapsed_ms
+        self.acquire_max_ms = max(self.acquire_max_ms, elapsed_ms)
+        if elapsed_ms >= settings.db_pool_wait_threshold_ms:
+            self._window_waits += 1
+
+    def take_window_waits(self) -> int:
+        waits, self._window_waits = self._window_waits, 0
+        return waits
+
+
+class _TimedAcquire:
+    """async with pool.acquire() — с замером времени ожидания соединения"""
+
+    def __init__(self, pool, stats: PoolStats):
+        self._pool = pool
+        self._stats = stats
+        self._conn = None
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self._stats.waiting += 1
+        DB_POOL_WAITING.inc()
+        try:
+            self._conn = await self._pool.acquire()
+        finally:
+            self._stats.waiting -= 1
+            DB_POOL_WAITING.dec()
+        elapsed = time.perf_counter() - started
+        self._stats.observe_acquire(elapsed * 1000)
+        DB_ACQUIRE.observe(elapsed)
+        DB_POOL_IN_USE.inc()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        DB_POOL_IN_USE.dec()
+        await self._pool.release(conn)
+
+
+class InstrumentedPool:
+    """
+    Обёртка над aiomysql.Pool: acquire() с замером ожидания,
+    остальные атрибуты (size, freesize, close, ...) — как у пула.
+    """
+
+    def __init__(self, pool, stats: PoolStats):
+        self._pool = pool
+        self.stats = stats
+
+    def acquire(self):
+        return _TimedAcquire(self._pool, self.stats)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    async def resize(self, maxsize: int) -> None:
+        """
+        Меняет максимальный размер пула на лету.
+        У aiomysql нет публичного API для этого — под _cond меняем _maxsize,
+        пересоздаём очередь свободных соединений (deque(maxlen=...) из create_pool
+        молча выбрасывал бы лишние соединения при release, не закрывая их),
+        при уменьшении закрываем лишние свободные соединения и будим ждущих.
+        """
+        pool = self._pool
+        async with pool._cond:
+            pool._maxsize = maxsize
+            # Соединения сверх нового размера, которые сейчас заняты, тоже вернутся в очередь
+            maxlen = max(maxsize, pool.size, settings.db_pool_max_limit)
+            if pool._free.maxlen != maxlen:
+                pool._free = collections.deque(pool._free, maxlen=maxlen)
+            while pool.size > maxsize and pool._free:
+                pool._free.popleft().close()
+            pool._cond.notify_all()
+
+
 class MySQLClient:
     def __init__(self):
         self.pool = None
+        self.stats = PoolStats()
+        self._resizer: asyncio.Task | None = None
 
     async def init(self, app: FastAPI):
         """Инициализирует пул соединений с MySQL."""
         logger.info("Попытка инициализации MySQL пула соединений...")
         try:
-            self.pool = await aiomysql.create_pool(
+            raw_pool = await aiomysql.create_pool(
                 host=settings.db_host,
                 port=settings.db_port,
                 user=settings.db_user,
                 password=settings.db_password,
                 db=settings.db_name,
-                minsize=5, # Минимальное количество соединений в пуле
-                maxsize=20, # Максимальное количество соединений в пуле
+                minsize=settings.db_pool_min, # Минимальное количество соединений в пуле
+                maxsize=settings.db_pool_max, # Максимальное количество соединений в пуле
+                connect_timeout=settings.db_connect_timeout,
+                pool_recycle=settings.db_pool_recycle,
                 autocommit=True # Автоматический коммит транзакций
             )
+            self.pool = InstrumentedPool(raw_pool, self.stats)
             app.state.db_pool = self.pool # Сохраняем пул в состоянии FastAPI приложения
-            logger.info("MySQL пул соединений успешно инициализирован.")
+            if settings.db_pool_adaptive and settings.db_pool_max_limit > settings.db_pool_max:
+                self._resizer = asyncio.create_task(self._adapt_pool_size())
+            logger.info(
+                f"MySQL пул соединений успешно инициализирован "
+                f"(min={settings.db_pool_min}, max={settings.db_pool_max})."
+            )
         except Exception as e:
             logger.critical(f"Критическая ошибка при инициализации MySQL пула: {e}")
             raise # Перевыбрасываем исключение, так как без БД приложение неработоспособно
 
     async def close(self):
         """Закрывает пул соединений с MySQL."""
+        if self._resizer:
+            self._resizer.cancel()
+            self._resizer = None
         if self.pool:
             logger.info("Закрытие MySQL пула соединений...")
             self.pool.close()
             await self.pool.wait_closed()
             logger.info("MySQL пул соединений закрыт.")
 
+    async def _adapt_pool_size(self):
+        """
+        Раз в DB_POOL_ADAPT_INTERVAL секунд: если запросы ждали соединение —
+        увеличиваем пул (до DB_POOL_MAX_LIMIT), если пул простаивает — возвращаем
+        к DB_POOL_MAX.
+        """
+        while True:
+            await asyncio.sleep(settings.db_pool_adapt_interval)
+            try:
+                waits = self.stats.take_window_waits()
+                current = self.pool.maxsize
+                if waits and current < settings.db_pool_max_limit:
+                    new_size = min(current + settings.db_pool_adapt_step, settings.db_pool_max_limit)
+                elif not waits and current > settings.db_pool_max and self.pool.freesize > current // 2:
+                    new_size = max(current - settings.db_pool_adapt_step, settings.db_pool_max)
+                else:
+                    continue
+                await self.pool.resize(new_size)
+                logger.info(f"[MySQL] Pool maxsize {current} → {new_size} (slow acquires: {waits})")
+            except Exception as e:
+                logger.warning(f"[MySQL] Pool resize error: {e}")
+
+    def pool_stats(self) -> dict:
+        """Состояние пула для /health и метрик"""
+        stats = self.stats
+        in_use = (self.pool.size - self.pool.freesize) if self.pool else 0
+        return {
+            "size": self.pool.size if self.pool else 0,
+            "maxsize": self.pool.maxsize if self.pool else 0,
+            "in_use": in_use,
+            "idle": self.pool.freesize if self.pool else 0,
+            "waiting": stats.waiting,
+            "acquire_count": stats.acquire_count,
+            "acquire_avg_ms": round(stats.acquire_sum_ms / stats.acquire_count, 2) if stats.acquire_count else 0,
+            "acquire_max_ms": round(stats.acquire_max_ms, 2),
+            "acquire_buckets_ms": dict(zip([*map(str, ACQUIRE_BUCKETS_MS), "inf"], stats.acquire_buckets)),
+            "queries": stats.queries,
+            "slow_queries": stats.slow_queries,
+            "query_timeouts": stats.query_timeouts,
+        }
+
+    async def _run(self, conn, cur, query: str, params: tuple):
+        """Выполняет запрос с таймаутом и логированием медленных запросов"""
+        started = time.perf_counter()
+        self.stats.queries += 1
+        op = query.lstrip().split(None, 1)[0].lower() if query.strip() else "unknown"
+        try:
+            await asyncio.wait_for(cur.execute(query, params), settings.db_query_timeout)
+        except asyncio.TimeoutError:
+            self.stats.query_timeouts += 1
+            # Соединение в неизвестном состоянии — закрываем, пул его не вернёт
+            conn.close()
+            logger.error(f"[MySQL] Query timeout ({settings.db_query_timeout}s): {query[:120]}")
+            raise
+        finally:
+            DB_QUERY.labels(op=op).observe(time.perf_counter() - started)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= settings.db_slow_query_ms:
+            self.stats.slow_queries += 1
+            logger.warning(f"[MySQL] Slow query {elapsed_ms:.0f}ms: {' '.join(query.split())[:120]}")
+
     async def fetchone(self, query: str, params: tuple = ()):
         """Выполняет SELECT запрос и возвращает одну запись (словарь)."""
         async with self.pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cur: # DictCursor для получения результатов как словарей
-                await cur.execute(query, params)
+                await self._run(conn, cur, query, params)
                 return await cur.fetchone()
 
     async def fetchall(self, query: str, params: tuple = ()):
         """Выполняет SELECT запрос и возвращает все записи (список словарей)."""
         async with self.pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(query, params)
+                await self._run(conn, cur, query, params)
                 return await cur.fetchall()
 
     async def execute(self, query: str, params: tuple = ()):
         """Выполняет DML (INSERT, UPDATE, DELETE) запрос."""
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cur:
-                await cur.execute(query, params)
+                await self._run(conn, cur, query, params)
                 # Autocommit=True в create_pool, поэтому COMMIT не требуется явно
 
 mysql = MySQLClient() # Создаем экземпляр клиента MySQL
@@ -67,4 +242,4 @@ async def init_db(app: FastAPI):
 
 async def close_db(app: FastAPI):
     """Функция закрытия БД для FastAPI lifespan."""
-    await mysql.close()
\ No newline at end of file
+    await mysql.close()
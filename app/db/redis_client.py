@@ -2,12 +2,29 @@ from redis.asyncio import Redis
 from arq import create_pool
 from arq.connections import RedisSettings, ArqRedis
 from app.config import settings
+from app.utils.metrics import REDIS_CALL
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+
+class InstrumentedRedis(Redis):
+    """Redis с замером времени команд (команды pipeline не замеряются)"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            command = args[0] if args else "unknown"
+            if isinstance(command, bytes):
+                command = command.decode()
+            REDIS_CALL.labels(command=str(command).upper()).observe(time.perf_counter() - started)
+
+
 # Стандартный Redis клиент (aiogram FSM, context storage и пр.)
-redis = Redis.from_url(
+redis = InstrumentedRedis.from_url(
     settings.redis_url,
     decode_responses=False
 )
@@ -3,6 +3,7 @@ CREATE TABLE IF NOT EXISTS users_tbl (
     tg_id BIGINT NOT NULL UNIQUE,
     tg_name VARCHAR(255),
     free_tokens INT DEFAULT 0,
+    tokens_date DATE DEFAULT NULL,
     expiration_date DATE,
     payment_method_id VARCHAR(255),
     last_subscription_days INT DEFAULT 0,
@@ -20,7 +21,8 @@ CREATE TABLE IF NOT EXISTS users_tbl (
     fitness_goal VARCHAR(20) DEFAULT NULL,
     protein_goal INT DEFAULT NULL,
     fat_goal INT DEFAULT NULL,
-    carbs_goal INT DEFAULT NULL
+    carbs_goal INT DEFAULT NULL,
+    bot_blocked TINYINT DEFAULT 0
 );
 
 -- Миграция для существующей БД (запустить вручную на проде):
@@ -39,6 +41,14 @@ CREATE TABLE IF NOT EXISTS users_tbl (
 --   ADD COLUMN fat_goal INT DEFAULT NULL,
 --   ADD COLUMN carbs_goal INT DEFAULT NULL;
 
+-- Миграция v3: баланс запросов ведётся в Redis, в БД — копия с датой «калорийного дня»
+-- ALTER TABLE users_tbl
+--   ADD COLUMN tokens_date DATE DEFAULT NULL;
+
+-- Миграция v5: пользователи, заблокировавшие бота, пропускаются рассылками
+-- ALTER TABLE users_tbl
+--   ADD COLUMN bot_blocked TINYINT DEFAULT 0;
+
 CREATE TABLE IF NOT EXISTS payment_tbl (
     id INT AUTO_INCREMENT PRIMARY KEY,
     tg_id BIGINT NOT NULL,
@@ -49,3 +59,49 @@ CREATE TABLE IF NOT EXISTS payment_tbl (
     days INT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Сырые ответы GPT: один на запрос, meals_history.gpt_response_id ссылается сюда
+-- (раньше весь JSON дублировался в gpt_raw_response каждой строки)
+CREATE TABLE IF NOT EXISTS gpt_responses (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tg_id BIGINT NOT NULL,
+    response MEDIUMTEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_created_at (created_at)
+);
+
+-- Рацион: записи о блюдах и суммы за день (daily_totals обновляется инкрементально)
+CREATE TABLE IF NOT EXISTS meals_history (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tg_id BIGINT NOT NULL,
+    meal_date DATE NOT NULL,
+    meal_datetime DATETIME NOT NULL,
+    food_name VARCHAR(255) NOT NULL,
+    weight_grams INT DEFAULT 0,
+    calories DECIMAL(8,2) DEFAULT 0,
+    protein DECIMAL(8,2) DEFAULT 0,
+    fat DECIMAL(8,2) DEFAULT 0,
+    carbs DECIMAL(8,2) DEFAULT 0,
+    confidence_score DECIMAL(4,2) DEFAULT NULL,
+    gpt_response_id BIGINT DEFAULT NULL,
+    image_file_id VARCHAR(255) DEFAULT NULL,
+    INDEX idx_tg_date (tg_id, meal_date),
+    INDEX idx_gpt_response (gpt_response_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_totals (
+    tg_id BIGINT NOT NULL,
+    date DATE NOT NULL,
+    total_calories DECIMAL(10,2) DEFAULT 0,
+    total_protein DECIMAL(10,2) DEFAULT 0,
+    total_fat DECIMAL(10,2) DEFAULT 0,
+    total_carbs DECIMAL(10,2) DEFAULT 0,
+    meals_count INT DEFAULT 0,
+    PRIMARY KEY (tg_id, date)
+);
+
+-- Миграция v4: ссылка на ответ GPT вместо копии JSON в каждой строке
+-- ALTER TABLE meals_history
+--   ADD COLUMN gpt_response_id BIGINT DEFAULT NULL,
+--   ADD INDEX idx_gpt_response (gpt_response_id),
+--   MODIFY gpt_raw_response TEXT NULL;  -- новые строки его не заполняют
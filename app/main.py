@@ -1,14 +1,18 @@
 import logging
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from contextlib import asynccontextmanager
 
 from app.api.yookassa import yookassa_router
 from app.api.telegram import telegram_router
 from app.bot.bot import dp, setup_middlewares, bot
-from app.db.mysql import init_db, close_db
+from app.bot.update_queue import update_queue
+from app.db.mysql import init_db, close_db, mysql
 from app.db.redis_client import redis, init_arq_redis
 from app.config import settings
 from app.utils.logger import setup_logger
+from app.utils.metrics import render_latest
+from app.utils.tracing import start_tracing, stop_tracing
+from app.services.user_cache import start_user_cache_listener, stop_user_cache_listener
 from app.bot.handlers.start import setup_bot_commands 
 
 logger = logging.getLogger(__name__)
@@ -22,11 +26,14 @@ async def lifespan(app: FastAPI):
     # Инициализация БД и Redis
     await init_db(app)
     await init_arq_redis()
+    await start_user_cache_listener()
+    await start_tracing("calorie-bot-webhook")
     
     # Настройка middleware для Aiogram
     setup_middlewares(app)
     
     await setup_bot_commands()
+    await update_queue.start()
 
     logger.info("✅ Ресурсы инициализированы. Приложение готово принимать запросы.")
     
@@ -34,7 +41,23 @@ async def lifespan(app: FastAPI):
     
     logger.info("🔻 Приложение завершает работу: Закрытие ресурсов...")
 
+    # Сначала дорабатываем принятые обновления — им ещё нужны БД и Redis
+    try:
+        await update_queue.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при остановке очереди обновлений: {e}")
+
     # Закрытие соединений — каждое в try/except чтобы не блокировать остальные
+    try:
+        await stop_tracing()
+    except Exception as e:
+        logger.error(f"Ошибка при остановке трассировки: {e}")
+
+    try:
+        await stop_user_cache_listener()
+    except Exception as e:
+        logger.error(f"Ошибка при остановке кэша пользователей: {e}")
+
     try:
         await close_db(app)
     except Exception as e:
@@ -103,7 +126,6 @@ async def health():
     """Детальная проверка здоровья сервиса"""
     try:
         # Проверка MySQL
-        from app.db.mysql import mysql
         await mysql.fetchone("SELECT 1")
         db_status = "ok"
     except Exception as e:
@@ -121,5 +143,15 @@ async def health():
     return {
         "status": "ok" if db_status == "ok" and redis_status == "ok" else "degraded",
         "database": db_status,
-        "redis": redis_status
-    }
\ No newline at end of file
+        "redis": redis_status,
+        "db_pool": mysql.pool_stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики Prometheus"""
+    if not settings.metrics_enabled:
+        return Response(status_code=404)
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,96 @@
+# app/services/blob_store.py
+"""
+Хранилище фото на общем томе (как /shared-voice), адресуемое по SHA-256.
+
+Вебхук кладёт байты фото в файл и ставит в очередь только ключ,
+воркер читает файл через mmap в момент запроса к GPT.
+Одинаковые фото хранятся один раз; старые файлы удаляет cleanup_blobs.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import mmap
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _blob_path(key: str) -> str:
+    if not _KEY_RE.match(key):
+        raise ValueError(f"Invalid blob key: {key!r}")
+    return os.path.join(settings.blob_store_dir, key[:2], key)
+
+
+def _write_blob(key: str, data) -> None:
+    path = _blob_path(key)
+    if os.path.exists(path):
+        os.utime(path)  # Продлеваем жизнь повторно присланного фото
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"  # Свой файл у каждой записи, даже в одном процессе
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)  # Атомарно: читатель не увидит недописанный файл
+
+
+async def put_blob(data) -> str:
+    """Сохраняет байты (bytes/memoryview) и возвращает ключ — sha256 hex"""
+    key = hashlib.sha256(data).hexdigest()
+    await asyncio.to_thread(_write_blob, key, data)
+    return key
+
+
+@contextmanager
+def open_blob(key: str) -> Iterator[memoryview]:
+    """Отдаёт содержимое через mmap без копирования в память процесса"""
+    with open(_blob_path(key), "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def _read_data_url(key: str, mime: str) -> str:
+    with open_blob(key) as view:
+        return f"data:{mime};base64,{base64.b64encode(view).decode()}"
+
+
+async def blob_data_url(key: str, mime: str = "image/jpeg") -> str | None:
+    """data: URL для OpenAI vision. None, если файл уже удалён"""
+    try:
+        return await asyncio.to_thread(_read_data_url, key, mime)
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning(f"[BlobStore] Blob {key[:12]} unavailable: {e}")
+        return None
+
+
+def delete_expired_blobs(max_age: int) -> int:
+    """Удаляет файлы старше max_age секунд. Возвращает количество удалённых"""
+    root = settings.blob_store_dir
+    if not os.path.isdir(root):
+        return 0
+
+    cutoff = time.time() - max_age
+    removed = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -0,0 +1,300 @@
+# app/services/food_parser.py
+"""
+Локальный разбор простых записей вида «<продукт> <граммы>» без GPT.
+
+Справочник app/data/foods.csv загружается один раз на процесс в компактный
+индекс (отсортированные ключи + массивы КБЖУ) с поиском по точному ключу
+и по префиксам слов. Нечёткого совпадения нет: «яйцо жареное» похоже на
+«яйцо варёное», но это другой продукт. Если разбор неуверенный — возвращаем None,
+и запрос уходит в ai_request как обычно.
+"""
+import bisect
+import csv
+import logging
+import re
+from array import array
+from pathlib import Path
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+FOODS_CSV_PATH = Path(__file__).resolve().parent.parent / "data" / "foods.csv"
+
+MAX_WEIGHT_GRAMS = 3000
+MAX_PIECES = 10
+MIN_BARE_GRAMS = 20  # Число без единиц меньше этого — не граммы (скорее штуки)
+MIN_PREFIX_LEN = 4
+EXACT_CONFIDENCE = 1.0
+PREFIX_CONFIDENCE = 0.9
+# Служебные слова не делают совпадение: «на воде» ≠ «овсянка на воде»
+FUNCTION_WORDS = frozenset({"на", "с", "со", "в", "во", "без", "из", "по", "и"})
+
+# Окончания для грубого стемминга: «гречки» → «греч», «куриной грудки» → «курин грудк»
+_ENDINGS = sorted(
+    ["ами", "ями", "ого", "его", "ому", "ему", "ой", "ей", "ий", "ый", "ая", "яя",
+     "ое", "ее", "ов", "ев", "ам", "ям", "ах", "ях", "ую", "юю",
+     "а", "я", "ы", "и", "у", "ю", "е", "о"],
+    key=len,
+    reverse=True,
+)
+_WORD_RE = re.compile(r"[a-zа-я0-9%]+")
+
+_LEADING_RE = re.compile(
+    r"^(я\s+)?(съел[аи]?|ел[аи]?|выпил[аи]?|скушал[аи]?|перекусил[аи]?|"
+    r"на завтрак|на обед|на ужин|на перекус|завтрак|обед|ужин|перекус)[\s:,\-]+"
+)
+# Всё, что требует понимания смысла: вопросы, команды, время, КБЖУ из сообщения
+_REJECT_RE = re.compile(
+    r"(\?|сколько|калори|ккал|кбжу|белк|жир|углев|посчитай|удали|убери|отмени|"
+    r"исправ|поправ|помен|измени|обнови|замени|добавь|ещ[её]|было|половин|"
+    r"вчера|утра|вечера|\d{1,2}:\d{2}|\bбез\s|\bс\s)"
+)
+_SPLIT_RE = re.compile(r"\s*(?:,(?!\d)|;|\n|\+|\sи\s)\s*")
+
+_AMOUNT = (
+    r"(?P<amount>\d+(?:[.,]\d+)?)\s*"
+    r"(?P<unit>кг|гр|грамм(?:а|ов)?|г|мл|литр(?:а|ов)?|л|шт|штук[аи]?)?\.?"
+)
+_NAME = r"(?P<name>[a-zа-я][a-zа-я\s\-]*?)"
+_NAME_FIRST_RE = re.compile(rf"^{_NAME}\s+{_AMOUNT}$")
+_AMOUNT_FIRST_RE = re.compile(rf"^{_AMOUNT}\s+{_NAME}$")
+_NAME_ONLY_RE = re.compile(rf"^{_NAME}$")
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower().replace("ё", "е")).strip(" .!")
+
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+def make_key(name: str) -> str:
+    """Ключ индекса: нормализованные основы слов через пробел"""
+    return " ".join(_stem(w) for w in _WORD_RE.findall(_normalize(name)))
+
+
+class NutritionIndex:
+    """
+    Компактный индекс справочника.
+
+    Ключи (название + синонимы) хранятся отсортированным списком для
+    бинарного поиска по префиксу, КБЖУ — в плотных массивах float.
+    """
+
+    def __init__(self, rows: list[tuple[str, list[str], float, float, float, float, int]]):
+        self.names: list[str] = []
+        self._nutrients = array("f")  # kcal, protein, fat, carbs подряд
+        self._piece = array("H")
+
+        pairs = {}
+        for food_id, (name, aliases, kcal, protein, fat, carbs, piece_g) in enumerate(rows):
+            self.names.append(name)
+            self._nutrients.extend((kcal, protein, fat, carbs))
+            self._piece.append(piece_g)
+            for variant in [name, *aliases]:
+                key = make_key(variant)
+                if key:
+                    pairs.setdefault(key, food_id)
+
+        self._keys = sorted(pairs)
+        self._key_ids = array("H", (pairs[k] for k in self._keys))
+
+        # Слово ключа → номера ключей, в которых оно встречается
+        key_words: dict[str, set[int]] = {}
+        for key_pos, key in enumerate(self._keys):
+            for word in key.split():
+                key_words.setdefault(word, set()).add(key_pos)
+        self._words = sorted(key_words)
+        self._word_keys = [key_words[w] for w in self._words]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def nutrients(self, food_id: int) -> tuple[float, float, float, float]:
+        i = food_id * 4
+        return tuple(self._nutrients[i:i + 4])
+
+    def piece_grams(self, food_id: int) -> int:
+        return self._piece[food_id]
+
+    def lookup(self, query: str) -> tuple[int, float] | None:
+        """Возвращает (food_id, уверенность) или None"""
+        key = make_key(query)
+        if not key:
+            return None
+
+        pos = bisect.bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return self._key_ids[pos], EXACT_CONFIDENCE
+
+        # Слова запроса и значимые слова ключа должны покрывать друг друга
+        # (с точностью до начала слова): «куриная груд» → «курин грудк».
+        # Лишнее слово («жареное», «лапша») или непокрытое слово ключа
+        # («вода» ≠ «овсянка на воде», «суп» ≠ «суп куриный») — решает GPT.
+        words = key.split()
+        content = [w for w in words if w not in FUNCTION_WORDS]
+        if not content:
+            return None
+        candidates = None
+        for word in content:
+            keys = self._keys_with_word(word)
+            candidates = keys if candidates is None else candidates & keys
+            if not candidates:
+                return None
+        ids = {
+            self._key_ids[i] for i in candidates
+            if self._covers(words, self._keys[i].split())
+        }
+        if len(ids) == 1:
+            return ids.pop(), PREFIX_CONFIDENCE
+        return None  # Ничего или несколько продуктов — не угадываем
+
+    @staticmethod
+    def _covers(query_words: list[str], key_words: list[str]) -> bool:
+        """Каждое значимое слово ключа начинается со слова запроса, служебные слова запроса есть в ключе"""
+        for key_word in key_words:
+            if key_word in FUNCTION_WORDS:
+                continue
+            if not any(
+                key_word == w or (len(w) >= MIN_PREFIX_LEN and key_word.startswith(w))
+                for w in query_words if w not in FUNCTION_WORDS
+            ):
+                return False
+        return all(w in key_words for w in query_words if w in FUNCTION_WORDS)
+
+    def _keys_with_word(self, word: str) -> set[int]:
+        """Ключи со словом word или (для слов от MIN_PREFIX_LEN букв) со словом, начинающимся с word"""
+        pos = bisect.bisect_left(self._words, word)
+        if len(word) < MIN_PREFIX_LEN:
+            if pos < len(self._words) and self._words[pos] == word:
+                return set(self._word_keys[pos])
+            return set()
+        keys = set()
+        while pos < len(self._words) and self._words[pos].startswith(word):
+            keys |= self._word_keys[pos]
+            pos += 1
+        return keys
+
+
+def load_index(path: Path = FOODS_CSV_PATH) -> NutritionIndex:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in csv.reader(f, delimiter=";"):
+            if not line or line[0].startswith("#"):
+                continue
+            name, aliases, kcal, protein, fat, carbs, piece_g = line
+            rows.append((
+                name,
+                [a for a in aliases.split("|") if a],
+                float(kcal), float(protein), float(fat), float(carbs),
+                int(piece_g),
+            ))
+    return NutritionIndex(rows)
+
+
+_index: NutritionIndex | None = None
+
+
+def get_nutrition_index() -> NutritionIndex:
+    """Индекс загружается один раз на процесс"""
+    global _index
+    if _index is None:
+        _index = load_index()
+        logger.info(f"[FoodParser] Loaded {len(_index)} foods from {FOODS_CSV_PATH.name}")
+    return _index
+
+
+def _resolve_grams(amount: float | None, unit: str | None, piece_g: int) -> float | None:
+    if amount is None:
+        return float(piece_g) if piece_g else None
+    if unit:
+        if unit.startswith("г") or unit == "мл":
+            return amount
+        if unit in ("кг", "л") or unit.startswith("литр"):
+            return amount * 1000
+        if unit.startswith("шт"):
+            return amount * piece_g if piece_g and amount <= MAX_PIECES else None
+    if piece_g and amount <= MAX_PIECES:
+        return amount * piece_g
+    if amount >= MIN_BARE_GRAMS:
+        return amount
+    return None
+
+
+def _parse_part(part: str, index: NutritionIndex) -> dict | None:
+    match = (
+        _NAME_FIRST_RE.match(part)
+        or _AMOUNT_FIRST_RE.match(part)
+        or _NAME_ONLY_RE.match(part)
+    )
+    if not match:
+        return None
+
+    groups = match.groupdict()
+    found = index.lookup(groups["name"])
+    if not found:
+        return None
+    food_id, confidence = found
+    if confidence < settings.food_parser_min_confidence:
+        return None
+
+    amount = groups.get("amount")
+    amount = float(amount.replace(",", ".")) if amount else None
+    grams = _resolve_grams(amount, groups.get("unit"), index.piece_grams(food_id))
+    if not grams or grams > MAX_WEIGHT_GRAMS:
+        return None
+
+    kcal, protein, fat, carbs = index.nutrients(food_id)
+    factor = grams / 100
+    return {
+        "name": index.names[food_id],
+        "weight_grams": int(round(grams)),
+        "calories": round(kcal * factor, 1),
+        "protein": round(protein * factor, 1),
+        "fat": round(fat * factor, 1),
+        "carbs": round(carbs * factor, 1),
+    }
+
+
+def parse_simple_entry(text: str) -> dict | None:
+    """
+    Разбирает «гречка 200г», «2 яйца, банан», «съел творог 150 г».
+    Похожие, но другие продукты не угадываются (python -m doctest):
+
+    >>> [parse_simple_entry(t) for t in ("яйцо жареное 2", "хлебцы 2", "гречневая лапша 200г")]
+    [None, None, None]
+    >>> [parse_simple_entry(t) for t in ("на воде 200", "суп 300")]
+    [None, None]
+    >>> [parse_simple_entry(t)["items"][0]["name"] for t in ("вода 300", "вода 500мл")]
+    ['Вода', 'Вода']
+
+    Returns:
+        Ответ в формате GPT ({"intent": "add", "items": [...]}) или None,
+        если хоть одна часть не распознана уверенно.
+    """
+    if not settings.food_parser_enabled or not text:
+        return None
+
+    normalized = _normalize(text)
+    if not normalized or _REJECT_RE.search(normalized):
+        return None
+    normalized = _LEADING_RE.sub("", normalized)
+
+    parts = [p for p in _SPLIT_RE.split(normalized) if p]
+    if not parts:
+        return None
+
+    index = get_nutrition_index()
+    items = []
+    for part in parts:
+        item = _parse_part(part, index)
+        if item is None:
+            return None
+        items.append(item)
+
+    return {"intent": "add", "items": items, "notes": ""}
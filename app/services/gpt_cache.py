@@ -0,0 +1,261 @@
+# app/services/gpt_cache.py
+"""
+Кэш ответов GPT для повторяющихся текстовых запросов («гречка 200г»).
+
+Два уровня:
+- локальный LRU в памяти процесса воркера (миллисекунды, без сети);
+- общий Redis (переживает рестарт, делится между воркерами).
+
+Кэшируются только ответы add/calculate на короткий текст без фото:
+они не зависят от рациона пользователя и истории диалога.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Tuple
+
+from app.api.gpt import ai_request
+from app.api.prompts import prompt_version
+from app.api.model_router import pick_route
+from app.config import settings
+from app.db.redis_client import redis
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "gpt_cache:"
+STATS_KEY = "gpt_cache:stats"
+CACHEABLE_INTENTS = {"add", "calculate"}
+MAX_CACHEABLE_TEXT_LEN = 120  # Длинные уникальные описания почти не повторяются
+STATS_FLUSH_INTERVAL = 10  # Секунды: счётчики копятся в процессе и сбрасываются в Redis пачкой
+
+# Команды и ссылки на предыдущие сообщения: смысл зависит от рациона/истории
+CONTEXT_DEPENDENT_RE = re.compile(
+    r"(ещ[её]|тоже|такой же|такую же|такое же|то же|ту же|это|этот|эту|этого|"
+    r"добав|удали|убери|отмени|исправ|поправ|помен|измени|обнови|замени|"
+    r"не ел|а не|было|вчера|последн|предыдущ)",
+    re.IGNORECASE,
+)
+# Короткие ответы на вопрос бота — без истории не имеют смысла
+REPLY_RE = re.compile(r"^(да|нет|не|ага|угу|ок|окей|давай|конечно|верно)\W*$", re.IGNORECASE)
+
+_UNIT_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(г|гр|грамм\w*|мл|кг|л|шт|ккал)\b\.?", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[!?.;…]+$")
+
+
+class _LocalLRU:
+    """Простой LRU с TTL (в пределах одного процесса)"""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def get(self, key: str) -> str | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+_local = _LocalLRU(settings.gpt_cache_local_size, settings.gpt_cache_local_ttl)
+_stats = {"local_hit": 0, "redis_hit": 0, "miss": 0, "bypass": 0, "store": 0}
+_pending_stats: Counter = Counter()
+_stats_flushed_at = time.monotonic()
+
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к каноническому виду: 'Гречка  200 гр.' → 'гречка 200г'"""
+    text = text.lower().replace("ё", "е").strip()
+    text = _SPACE_RE.sub(" ", text)
+    text = _PUNCT_RE.sub("", text)
+
+    def _unit(m: re.Match) -> str:
+        amount = m.group(1).replace(",", ".")
+        unit = m.group(2)
+        if unit.startswith("г"):
+            unit = "г"
+        return f"{amount}{unit}"
+
+    return _UNIT_RE.sub(_unit, text)
+
+
+def should_bypass(text: str, image_link: str | None, history: list[dict] | None) -> bool:
+    """Запросы, ответ на которые зависит не только от текста"""
+    if not settings.gpt_cache_enabled:
+        return True
+    if image_link:
+        return True
+    if not text or len(text) > MAX_CACHEABLE_TEXT_LEN:
+        return True
+    if CONTEXT_DEPENDENT_RE.search(text):
+        return True
+    if history and REPLY_RE.match(text.strip()):
+        return True
+    return False
+
+
+def build_cache_key(text: str, model: str | None = None, prompt: str | None = None) -> str:
+    """Модель и версия промпта входят в ключ — после их смены старые ответы не используются"""
+    model = model or settings.openai_default_model
+    raw = f"{model}|{prompt_version(prompt)}|{normalize_text(text)}"
+    return CACHE_KEY_PREFIX + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _is_cacheable_response(response: str) -> bool:
+    try:
+        data = json.loads(response)
+    except (json.JSONDecodeError, TypeError):
+        return False
+    if not isinstance(data, dict) or data.get("intent", "add") not in CACHEABLE_INTENTS:
+        return False
+    items = data.get("items") or []
+    try:
+        return any(
+            float(it.get("calories", 0) or 0) > 0
+            for it in items if isinstance(it, dict)
+        )
+    except (TypeError, ValueError):
+        return False  # Модель вернула не число — такой ответ не кэшируем
+
+
+async def flush_cache_stats() -> None:
+    """Сбрасывает накопленные счётчики в Redis (и при остановке воркера)"""
+    global _stats_flushed_at
+    _stats_flushed_at = time.monotonic()
+    if not _pending_stats:
+        return
+    pending = dict(_pending_stats)
+    _pending_stats.clear()
+    try:
+        pipe = redis.pipeline()
+        for field, value in pending.items():
+            pipe.hincrby(STATS_KEY, field, value)
+        await pipe.execute()
+    except Exception as e:
+        logger.debug(f"[GPTCache] Stats error: {e}")
+
+
+async def _count(field: str) -> None:
+    """Счётчик в процессе; в Redis — не чаще раза в STATS_FLUSH_INTERVAL (попадание в LRU без сети)"""
+    _stats[field] += 1
+    _pending_stats[field] += 1
+    if time.monotonic() - _stats_flushed_at >= STATS_FLUSH_INTERVAL:
+        await flush_cache_stats()
+
+
+async def get_cached_response(key: str) -> str | None:
+    """Ищет ответ сначала в локальном LRU, затем в Redis"""
+    value = _local.get(key)
+    if value is not None:
+        await _count("local_hit")
+        return value
+
+    try:
+        data = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"[GPTCache] Redis read error: {e}")
+        data = None
+
+    if data is not None:
+        value = data.decode() if isinstance(data, bytes) else data
+        _local.set(key, value)
+        await _count("redis_hit")
+        return value
+
+    await _count("miss")
+    return None
+
+
+async def store_response(key: str, response: str) -> None:
+    _local.set(key, response)
+    try:
+        await redis.setex(key, settings.gpt_cache_ttl, response)
+        await _count("store")
+    except Exception as e:
+        logger.warning(f"[GPTCache] Redis write error: {e}")
+
+
+@traced("gpt.cached_request")
+async def cached_ai_request(
+    user_id: int,
+    text: str,
+    image_link: str = None,
+    context: str = None,
+    history: list[dict] = None,
+    requester: Callable[..., Awaitable[Tuple[int, str]]] = None,
+) -> Tuple[int, str]:
+    """
+    ai_request с кэшем для повторяющихся текстовых запросов.
+
+    requester — чем выполнять запрос при промахе (по умолчанию ai_request,
+    в воркере — GptBatcher.request). Ответ кэшируется под моделью и промптом,
+    которые его дали: ответ резервной модели (model_router.fallback_for)
+    не попадёт к запросам основной.
+    """
+    requester = requester or ai_request
+
+    if should_bypass(text, image_link, history):
+        await _count("bypass")
+        return await requester(
+            user_id=user_id,
+            text=text,
+            image_link=image_link,
+            context=context,
+            history=history,
+        )
+
+    route = pick_route(text, image_link, history)
+    key = build_cache_key(text, route.model, route.prompt)
+    cached = await get_cached_response(key)
+    if cached is not None:
+        logger.info(f"[GPTCache] Hit for user {user_id}: {text[:50]}")
+        return 200, cached
+
+    meta = {}
+    code, response = await requester(
+        user_id=user_id,
+        text=text,
+        image_link=image_link,
+        context=context,
+        history=history,
+        meta=meta,
+    )
+
+    if code == 200 and response and meta.get("model") and _is_cacheable_response(response):
+        await store_response(build_cache_key(text, meta["model"], meta.get("prompt")), response)
+
+    return code, response
+
+
+async def get_cache_stats() -> dict:
+    """Счётчики процесса и общие счётчики из Redis"""
+    await flush_cache_stats()
+    shared = {}
+    try:
+        raw = await redis.hgetall(STATS_KEY)
+        shared = {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in raw.items()
+        }
+    except Exception as e:
+        logger.warning(f"[GPTCache] Stats read error: {e}")
+    return {"local": dict(_stats), "shared": shared}
@@ -0,0 +1,280 @@
+# app/services/intent_rules.py
+"""
+Локальное распознавание однозначных команд без GPT.
+
+«удали последнее», «отмени», «добавь», «исправь гречку на 150г» раньше стоили
+полного запроса к OpenAI только ради intent + target. Правила (регулярные
+выражения по всему сообщению) возвращают ответ в формате GPT, и задача сразу
+идёт в handle_delete / handle_edit / handle_add_previous. Всё, что хоть
+немного сложнее шаблона, правила пропускают — решает GPT.
+
+Точность правил проверяется по GPT: доля INTENT_RULES_AUDIT_RATE сработавших
+правил всё равно уходит в GPT (действует ответ GPT), совпадение пишется
+в метрики и в выборку intent_rules:samples. Туда же с вероятностью
+INTENT_RULES_SAMPLE_RATE попадают обычные текстовые запросы — для оценки
+пропусков и обучения модели. Отчёт и обучение: python -m app.bench.intent_eval
+
+Необязательная модель (INTENT_MODEL_PATH, наивный Байес по символьным
+n-граммам, обучается на выборке) только подтверждает правила: если она уверенно
+считает сообщение другим intent, правило не применяется.
+"""
+import json
+import logging
+import math
+import random
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from app.config import settings
+from app.db.redis_client import redis
+from app.services.food_parser import make_key
+from app.utils.metrics import INTENT_RULES
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_KEY = "intent_rules:samples"
+MAX_SAMPLES = 5000
+
+_VERB_DELETE = r"(?:удали(?:ть)?|убери|убрать|сотри|стереть)"
+_VERB_EDIT = r"(?:исправь|поправь|поменяй|измени|обнови)"
+_WEIGHT = r"(?P<amount>\d{1,4})\s*(?:г|гр|грамм(?:а|ов)?|мл)\.?"
+
+# (имя правила, регулярное выражение) — сообщение должно совпасть целиком
+_DELETE_LAST = [
+    ("delete_last", re.compile(
+        rf"^(?:{_VERB_DELETE}|отмени(?:ть)?)(?:\s+(?:последн\w*|это|его|её|ее)(?:\s+(?:блюдо|запись|при[её]м))?)?$"
+    )),
+    ("undo", re.compile(r"^(?:отмена|отмени(?:ть)?\s+последн\w*(?:\s+\w+)?)$")),
+]
+_DELETE_ALL = [
+    ("delete_all", re.compile(
+        rf"^(?:{_VERB_DELETE}|очисти(?:ть)?)\s+(?:вс[её](?:\s+записи)?|все\s+блюда)(?:\s+за\s+сегодня)?$"
+    )),
+    ("clear_day", re.compile(r"^очисти(?:ть)?(?:\s+(?:день|дневник|сегодня))?$")),
+]
+_DELETE_NAME = ("delete_name", re.compile(rf"^{_VERB_DELETE}\s+(?P<name>[а-я\-]{{3,}})$"))
+_ADD_PREVIOUS = ("add_previous", re.compile(
+    r"^(?:добавь|добавить|запиши|записать|сохрани|сохранить)"
+    r"(?:\s+(?:это|его|её|ее|их|расч[её]т))?(?:\s+в\s+(?:рацион|дневник))?$"
+))
+_EDIT_WEIGHT = ("edit_weight", re.compile(
+    rf"^{_VERB_EDIT}(?:\s+(?P<name>[а-я\-]{{3,}}))?\s*[,:—\-]?\s*(?:на|было|там\s+было)?\s*{_WEIGHT}"
+    r"(?:\s*,?\s*а\s+не\s+\d{1,4}\s*(?:г|гр|мл)?\.?)?$"
+))
+_EDIT_LAST_WEIGHT = ("edit_last_weight", re.compile(
+    rf"^(?:там|на\s+самом\s+деле)\s+было\s+{_WEIGHT}(?:\s*,?\s*а\s+не\s+\d{{1,4}}\s*(?:г|гр|мл)?\.?)?$"
+))
+
+_PUNCT_RE = re.compile(r"[!.…]+$")
+
+# Слова после «удали»/«исправь», которые не название блюда: приёмы пищи,
+# «все/весь», порядковые — их разбирает GPT
+_NOT_NAME_RE = re.compile(
+    r"^(?:вс[её]|весь|сегодня|день|было|там|"
+    r"завтрак\w*|обед\w*|ужин\w*|перекус\w*|полдник\w*|"
+    r"перв\w*|втор\w*|трет\w*|четв[её]рт\w*|пят\w*|предпоследн\w*)$"
+)
+
+
+def _normalize(text: str) -> str:
+    return _PUNCT_RE.sub("", re.sub(r"\s+", " ", text.lower().replace("ё", "е"))).strip()
+
+
+def _target(name: str) -> str:
+    """Основа слова: handle_* ищут target подстрокой в названии («гречку» → «гречк»)"""
+    return make_key(name) or name
+
+
+def match_rules(text: str) -> tuple[str, dict] | None:
+    """(имя правила, ответ в формате GPT) или None, если сообщение не однозначная команда"""
+    if not text or len(text) > 60:
+        return None
+    normalized = _normalize(text)
+
+    for rule, pattern in _DELETE_LAST:
+        if pattern.match(normalized):
+            return rule, {"intent": "delete", "delete_target": "last", "items": []}
+    for rule, pattern in _DELETE_ALL:
+        if pattern.match(normalized):
+            return rule, {"intent": "delete", "delete_target": "all", "items": []}
+
+    rule, pattern = _DELETE_NAME
+    m = pattern.match(normalized)
+    if m and not _NOT_NAME_RE.match(m.group("name")):
+        return rule, {"intent": "delete", "delete_target": _target(m.group("name")), "items": []}
+
+    rule, pattern = _ADD_PREVIOUS
+    if pattern.match(normalized):
+        return rule, {"intent": "add_previous", "items": []}
+
+    for rule, pattern in (_EDIT_WEIGHT, _EDIT_LAST_WEIGHT):
+        m = pattern.match(normalized)
+        if m:
+            name = m.groupdict().get("name")
+            if name and _NOT_NAME_RE.match(name):
+                if name not in ("было", "там"):
+                    return None  # «исправь завтрак на 200г» — не одно блюдо
+                name = None
+            return rule, {
+                "intent": "edit",
+                "edit_target": _target(name) if name else "last",
+                # Остальные поля handle_edit возьмёт из записи и пересчитает по весу
+                "items": [{"weight_grams": int(m.group("amount"))}],
+            }
+    return None
+
+
+# ============================================
+# НЕОБЯЗАТЕЛЬНАЯ МОДЕЛЬ
+# ============================================
+
+def _ngrams(text: str) -> list[str]:
+    padded = f" {_normalize(text)} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class IntentModel:
+    """Мультиномиальный наивный Байес по символьным триграммам"""
+
+    def __init__(self, priors: dict[str, float], likelihoods: dict[str, dict[str, float]], unseen: dict[str, float]):
+        self.priors = priors
+        self.likelihoods = likelihoods
+        self.unseen = unseen
+
+    @classmethod
+    def fit(cls, samples: list[tuple[str, str]]) -> "IntentModel":
+        """samples: [(текст, intent)]"""
+        counts: dict[str, Counter] = defaultdict(Counter)
+        docs = Counter()
+        for text, intent in samples:
+            docs[intent] += 1
+            counts[intent].update(_ngrams(text))
+        vocab = {g for c in counts.values() for g in c}
+        priors, likelihoods, unseen = {}, {}, {}
+        for intent, grams in counts.items():
+            total = sum(grams.values()) + len(vocab)
+            priors[intent] = math.log(docs[intent] / len(samples))
+            likelihoods[intent] = {g: math.log((n + 1) / total) for g, n in grams.items()}
+            unseen[intent] = math.log(1 / total)
+        return cls(priors, likelihoods, unseen)
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """(intent, вероятность)"""
+        grams = _ngrams(text)
+        scores = {
+            intent: prior + sum(self.likelihoods[intent].get(g, self.unseen[intent]) for g in grams)
+            for intent, prior in self.priors.items()
+        }
+        best = max(scores, key=scores.get)
+        norm = sum(math.exp(s - scores[best]) for s in scores.values())
+        return best, 1 / norm
+
+    def to_dict(self) -> dict:
+        return {"priors": self.priors, "likelihoods": self.likelihoods, "unseen": self.unseen}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IntentModel":
+        return cls(data["priors"], data["likelihoods"], data["unseen"])
+
+
+_model: IntentModel | None = None
+_model_loaded = False
+
+
+def _get_model() -> IntentModel | None:
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model_loaded = True
+        path = Path(settings.intent_model_path) if settings.intent_model_path else None
+        if path and path.exists():
+            try:
+                _model = IntentModel.from_dict(json.loads(path.read_text(encoding="utf-8")))
+                logger.info(f"[IntentRules] Model loaded: {path} ({len(_model.priors)} intents)")
+            except Exception as e:
+                logger.error(f"[IntentRules] Failed to load model {path}: {e}")
+    return _model
+
+
+def target_in_meals(data: dict, meals: list) -> bool:
+    """
+    Названное в команде блюдо есть среди блюд дня. Иначе правило не применяем:
+    GPT поймёт «удали кашу» шире, чем поиск подстроки, а пользователь
+    не получит «не найдено» от правила.
+    """
+    target = data.get("delete_target") or data.get("edit_target")
+    if target in (None, "last", "all"):
+        return True
+    return any(target in _normalize(str(m.get("food_name") or "")) for m in meals)
+
+
+def classify_command(text: str) -> tuple[str, dict] | None:
+    """Правила + вето модели. None — отдать сообщение GPT"""
+    if not settings.intent_rules_enabled:
+        return None
+    matched = match_rules(text)
+    if matched is None:
+        return None
+    rule, data = matched
+    model = _get_model()
+    if model is not None:
+        intent, prob = model.predict(text)
+        if intent != data["intent"] and prob >= settings.intent_model_veto:
+            INTENT_RULES.labels(intent=data["intent"], result="vetoed").inc()
+            logger.info(f"[IntentRules] Rule {rule} vetoed by model ({intent}, {prob:.2f}): {text!r}")
+            return None
+    return rule, data
+
+
+# ============================================
+# ПРОВЕРКА ПО GPT
+# ============================================
+
+def should_audit() -> bool:
+    """Сработавшее правило всё равно проверить через GPT"""
+    return random.random() < settings.intent_rules_audit_rate
+
+
+def agrees(local: dict, gpt: dict) -> bool:
+    """Совпадает ли ответ правил с ответом GPT по смыслу"""
+    if local["intent"] != gpt.get("intent", "add"):
+        return False
+    if local["intent"] == "delete":
+        target = str(gpt.get("delete_target") or "last").lower()
+        if local["delete_target"] in ("last", "all"):
+            return target == local["delete_target"]
+        return local["delete_target"] in target
+    if local["intent"] == "edit":
+        items = gpt.get("items") or []
+        weight = items[0].get("weight_grams") if items and isinstance(items[0], dict) else None
+        return weight is not None and int(float(weight)) == local["items"][0]["weight_grams"]
+    return True
+
+
+async def record_outcome(text: str, rule: str | None, local: dict | None, gpt: dict) -> None:
+    """
+    Сравнение с ответом GPT: для сработавшего правила (аудит) — всегда,
+    для остальных текстов — выборочно (INTENT_RULES_SAMPLE_RATE)
+    """
+    gpt_intent = gpt.get("intent", "add")
+    if local is not None:
+        result = "match" if agrees(local, gpt) else "mismatch"
+        INTENT_RULES.labels(intent=local["intent"], result=result).inc()
+        if result == "mismatch":
+            logger.warning(f"[IntentRules] {rule} → {local['intent']}, GPT → {gpt_intent}: {text!r}")
+    elif random.random() < settings.intent_rules_sample_rate:
+        result = "missed" if gpt_intent in ("delete", "edit", "add_previous") else "none"
+        INTENT_RULES.labels(intent=gpt_intent, result=result).inc()
+    else:
+        return
+
+    sample = {"text": text, "rule": rule or "", "local": local or {}, "gpt": gpt_intent, "result": result}
+    if gpt_intent == "delete":
+        sample["gpt_target"] = gpt.get("delete_target")
+    try:
+        pipe = redis.pipeline()
+        pipe.lpush(SAMPLES_KEY, json.dumps(sample, ensure_ascii=False))
+        pipe.ltrim(SAMPLES_KEY, 0, MAX_SAMPLES - 1)
+        await pipe.execute()
+    except Exception as e:
+        logger.debug(f"[IntentRules] Sample write error: {e}")
@@ -1,11 +1,14 @@
-import aiomysql
 import asyncio
+import aiomysql
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import json
 import pytz
 from decimal import Decimal
 from app.db.mysql import mysql
+from app.config import settings
+from app.services import today_view
+from app.utils.tracing import traced
 import logging
 
 logger = logging.getLogger(__name__)
@@ -33,6 +36,79 @@ def _format_day_month(d) -> str:
     return f"{d.day} {MONTHS_RU[d.month]}"
 
 
+_VIEW_COLUMNS_SQL = ", ".join(today_view.VIEW_COLUMNS)
+
+
+async def _load_today_meals(user_id: int, today) -> list:
+    """
+    Блюда дня по времени: из today-view в Redis,
+    при промахе — один запрос к meals_history с заполнением view.
+    """
+    version = None
+    if settings.today_view_enabled:
+        try:
+            meals = await today_view.get_view(user_id, today)
+            if meals is not None:
+                return meals
+            version = await today_view.get_version(user_id, today)
+        except Exception as e:
+            logger.warning(f"[TodayView] Read error for {user_id}: {e}")
+
+    meals = await mysql.fetchall(
+        f"""SELECT {_VIEW_COLUMNS_SQL} FROM meals_history
+        WHERE tg_id = %s AND meal_date = %s
+        ORDER BY meal_datetime, id""",
+        (user_id, today)
+    ) or []
+
+    if version is not None:
+        try:
+            await today_view.store_view(user_id, today, meals, version)
+        except Exception as e:
+            logger.warning(f"[TodayView] Store error for {user_id}: {e}")
+    return meals
+
+
+def _money(value) -> Decimal:
+    """Округление как в колонках DECIMAL(…, 2): дельты совпадают с суммой строк"""
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def _macros_delta(items: list, sign: int = 1) -> tuple:
+    """(calories, protein, fat, carbs) — сумма по блюдам со знаком"""
+    return tuple(
+        sign * sum((_money(item[field]) for item in items), Decimal("0"))
+        for field in ("calories", "protein", "fat", "carbs")
+    )
+
+
+async def _apply_daily_delta(cur, user_id: int, meal_date, calories, protein, fat, carbs, count: int) -> None:
+    """
+    Прибавляет изменение к строке daily_totals вместо пересчёта GROUP BY по дню.
+    Расхождения (если появятся) исправляет reconcile_daily_totals.
+    """
+    await cur.execute(
+        """INSERT INTO daily_totals
+            (tg_id, date, total_calories, total_protein,
+             total_fat, total_carbs, meals_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_calories = total_calories + VALUES(total_calories),
+            total_protein = total_protein + VALUES(total_protein),
+            total_fat = total_fat + VALUES(total_fat),
+            total_carbs = total_carbs + VALUES(total_carbs),
+            meals_count = meals_count + VALUES(meals_count)""",
+        (user_id, meal_date, calories, protein, fat, carbs, count)
+    )
+    if count < 0:
+        # Удалили последние блюда дня — строка итогов не нужна
+        await cur.execute(
+            "DELETE FROM daily_totals WHERE tg_id = %s AND date = %s AND meals_count <= 0",
+            (user_id, meal_date)
+        )
+
+
+@traced("meals.save")
 async def save_meals(
     user_id: int,
     parsed_data: Dict,
@@ -55,7 +131,7 @@ async def save_meals(
     """
     try:
         tz = pytz.timezone(user_tz)
-        now = datetime.now(tz)
+        now = datetime.now(tz).replace(microsecond=0)  # DATETIME без долей секунды
         today = user_today(tz)
 
         # Если указано время приёма — используем его
@@ -68,74 +144,84 @@ async def save_meals(
                 pass  # Используем текущее время
         
         added_meal_ids = []  # ✅ Список ID добавленных блюд
+        items = parsed_data["items"]
+        if not items:
+            summary = await get_today_summary(user_id, user_tz)
+            summary['added_meal_ids'] = []
+            return summary
+        raw_response = json.dumps(parsed_data, ensure_ascii=False)
 
         max_retries = 3
         for attempt in range(max_retries):
-            added_meal_ids = []
             async with mysql.pool.acquire() as conn:
                 async with conn.cursor() as cur:
                     await conn.begin()
 
                     try:
-                        # Сохраняем каждое блюдо
-                        for item in parsed_data["items"]:
-                            await cur.execute(
-                                """INSERT INTO meals_history
-                                (tg_id, meal_date, meal_datetime, food_name, weight_grams,
-                                 calories, protein, fat, carbs, confidence_score,
-                                 gpt_raw_response, image_file_id)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                                (
-                                    user_id,
-                                    today,
-                                    now,
-                                    item["name"][:255],
-                                    int(item["weight_grams"]),
-                                    Decimal(str(item["calories"])),
-                                    Decimal(str(item["protein"])),
-                                    Decimal(str(item["fat"])),
-                                    Decimal(str(item["carbs"])),
-                                    Decimal(str(item.get("confidence", 0.8))),
-                                    json.dumps(parsed_data, ensure_ascii=False),
-                                    image_file_id
-                                )
+                        # Ответ GPT сохраняем один раз на запрос, блюда ссылаются на него
+                        await cur.execute(
+                            "INSERT INTO gpt_responses (tg_id, response) VALUES (%s, %s)",
+                            (user_id, raw_response)
+                        )
+                        response_id = cur.lastrowid
+
+                        # Все блюда — одним INSERT
+                        rows = [
+                            (
+                                user_id,
+                                today,
+                                now,
+                                item["name"][:255],
+                                int(item["weight_grams"]),
+                                _money(item["calories"]),
+                                _money(item["protein"]),
+                                _money(item["fat"]),
+                                _money(item["carbs"]),
+                                Decimal(str(item.get("confidence", 0.8))),
+                                response_id,
+                                image_file_id
                             )
+                            for item in items
+                        ]
+                        placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+                        await cur.execute(
+                            f"""INSERT INTO meals_history
+                            (tg_id, meal_date, meal_datetime, food_name, weight_grams,
+                             calories, protein, fat, carbs, confidence_score,
+                             gpt_response_id, image_file_id)
+                            VALUES {placeholders}""",
+                            [value for row in rows for value in row]
+                        )
 
-                            # ✅ Получаем ID добавленного блюда
-                            added_meal_ids.append(cur.lastrowid)
-
-                        # Пересчитываем итоги дня (атомарно)
+                        # id новых строк — по ссылке на ответ GPT, в той же транзакции
+                        # (подряд ли их выделит auto_increment, зависит от настроек сервера)
                         await cur.execute(
-                            """INSERT INTO daily_totals
-                                (tg_id, date, total_calories, total_protein,
-                                 total_fat, total_carbs, meals_count)
-                            SELECT
-                                tg_id,
-                                meal_date,
-                                SUM(calories),
-                                SUM(protein),
-                                SUM(fat),
-                                SUM(carbs),
-                                COUNT(*)
-                            FROM meals_history
-                            WHERE tg_id = %s AND meal_date = %s
-                            GROUP BY tg_id, meal_date
-                            ON DUPLICATE KEY UPDATE
-                                total_calories = VALUES(total_calories),
-                                total_protein = VALUES(total_protein),
-                                total_fat = VALUES(total_fat),
-                                total_carbs = VALUES(total_carbs),
-                                meals_count = VALUES(meals_count)""",
-                            (user_id, today)
+                            "SELECT id FROM meals_history WHERE gpt_response_id = %s ORDER BY id",
+                            (response_id,)
                         )
+                        added_meal_ids = [row[0] for row in await cur.fetchall()]
+
+                        # Прибавляем к итогам дня (без пересчёта по всему дню)
+                        delta = _macros_delta(items)
+                        await _apply_daily_delta(cur, user_id, today, *delta, len(added_meal_ids))
 
                         await conn.commit()
 
                         logger.info(
-                            f"✅ Saved {len(parsed_data['items'])} meals for user {user_id} "
+                            f"✅ Saved {len(items)} meals for user {user_id} "
                             f"on {today}, IDs: {added_meal_ids}"
                         )
 
+                        await today_view.apply_changes(user_id, today, upsert=[
+                            {
+                                "id": meal_id, "meal_date": today, "meal_datetime": now,
+                                "food_name": row[3], "weight_grams": row[4],
+                                "calories": row[5], "protein": row[6], "fat": row[7], "carbs": row[8],
+                                "confidence_score": row[9], "image_file_id": image_file_id,
+                            }
+                            for meal_id, row in zip(added_meal_ids, rows)
+                        ])
+
                         # Получаем обновленные итоги
                         summary = await get_today_summary(user_id, user_tz)
                         summary['added_meal_ids'] = added_meal_ids  # ✅ Добавляем ID
@@ -144,14 +230,15 @@ async def save_meals(
 
                     except Exception as e:
                         await conn.rollback()
-                        # Retry on deadlock
-                        if e.args[0] == 1213 and attempt < max_retries - 1:
+                        # Retry on deadlock: кнопки в food.py работают вне user_jobs,
+                        # а вставки в daily_totals разных пользователей делят gap-блокировки
+                        if e.args and e.args[0] == 1213 and attempt < max_retries - 1:
                             logger.warning(f"[save_meals] Deadlock for user {user_id}, retry {attempt + 1}")
                             await asyncio.sleep(0.1 * (attempt + 1))
                             continue
                         logger.exception(f"Error saving meals for user {user_id}: {e}")
                         raise
-                    
+
     except Exception as e:
         logger.exception(f"Critical error in save_meals: {e}")
         raise
@@ -171,29 +258,9 @@ async def get_today_summary(user_id: int, user_tz: str = "Europe/Moscow") -> Dic
         tz = pytz.timezone(user_tz)
         today = user_today(tz)
         
-        # Получаем итоги
-        totals = await mysql.fetchone(
-            "SELECT * FROM daily_totals WHERE tg_id = %s AND date = %s",
-            (user_id, today)
-        )
-        
-        # Получаем список приемов пищи
-        meals = await mysql.fetchall(
-            """SELECT * FROM meals_history
-            WHERE tg_id = %s AND meal_date = %s
-            ORDER BY meal_datetime""",
-            (user_id, today)
-        )
-        
-        # Формируем ответ с дефолтными значениями
-        if not totals:
-            totals = {
-                "total_calories": Decimal("0"),
-                "total_protein": Decimal("0"),
-                "total_fat": Decimal("0"),
-                "total_carbs": Decimal("0"),
-                "meals_count": 0
-            }
+        # Блюда дня (обычно из Redis), итоги считаются по ним
+        meals = await _load_today_meals(user_id, today)
+        totals = today_view.totals_from_meals(meals)
         
         return {
             "totals": totals,
@@ -243,7 +310,7 @@ async def get_week_summary(user_id: int, user_tz: str = "Europe/Moscow") -> List
 
 
 async def _recalculate_daily_totals(cur, user_id: int, meal_date) -> None:
-    """Пересчитывает daily_totals после удаления"""
+    """Полный пересчёт daily_totals за день (используется сверкой)"""
     # Проверяем остались ли записи за этот день
     await cur.execute(
         "SELECT COUNT(*) as cnt FROM meals_history WHERE tg_id = %s AND meal_date = %s",
@@ -280,6 +347,51 @@ async def _recalculate_daily_totals(cur, user_id: int, meal_date) -> None:
         )
 
 
+async def reconcile_daily_totals(since_date) -> int:
+    """
+    Сверяет daily_totals с суммами по meals_history начиная с since_date
+    и пересчитывает расходящиеся дни. Возвращает количество исправленных дней.
+    """
+    drifted = await mysql.fetchall(
+        """SELECT a.tg_id, a.meal_date
+        FROM (
+            SELECT tg_id, meal_date,
+                   SUM(calories) AS calories, SUM(protein) AS protein,
+                   SUM(fat) AS fat, SUM(carbs) AS carbs, COUNT(*) AS cnt
+            FROM meals_history
+            WHERE meal_date >= %s
+            GROUP BY tg_id, meal_date
+        ) a
+        LEFT JOIN daily_totals d ON d.tg_id = a.tg_id AND d.date = a.meal_date
+        WHERE d.tg_id IS NULL
+           OR d.meals_count <> a.cnt
+           OR ABS(d.total_calories - a.calories) > 0.05
+           OR ABS(d.total_protein - a.protein) > 0.05
+           OR ABS(d.total_fat - a.fat) > 0.05
+           OR ABS(d.total_carbs - a.carbs) > 0.05
+        UNION
+        SELECT d.tg_id, d.date
+        FROM daily_totals d
+        LEFT JOIN meals_history m ON m.tg_id = d.tg_id AND m.meal_date = d.date
+        WHERE d.date >= %s AND m.id IS NULL""",
+        (since_date, since_date)
+    ) or []
+
+    for row in drifted:
+        async with mysql.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await conn.begin()
+                try:
+                    await _recalculate_daily_totals(cur, row["tg_id"], row["meal_date"])
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+        logger.warning(f"[Meals] daily_totals drift fixed: user {row['tg_id']}, {row['meal_date']}")
+
+    return len(drifted)
+
+
 async def delete_meal(meal_id: int, user_id: int) -> bool:
     """Удаляет прием пищи и пересчитывает daily_totals (в транзакции)"""
     try:
@@ -287,9 +399,10 @@ async def delete_meal(meal_id: int, user_id: int) -> bool:
             async with conn.cursor(aiomysql.DictCursor) as cur:
                 await conn.begin()
                 try:
-                    # Получаем дату для пересчёта
+                    # Получаем дату и КБЖУ для вычитания из итогов
                     await cur.execute(
-                        "SELECT meal_date FROM meals_history WHERE id = %s AND tg_id = %s",
+                        """SELECT meal_date, calories, protein, fat, carbs
+                        FROM meals_history WHERE id = %s AND tg_id = %s FOR UPDATE""",
                         (meal_id, user_id)
                     )
 
@@ -308,15 +421,13 @@ async def delete_meal(meal_id: int, user_id: int) -> bool:
                     )
 
                     if cur.rowcount > 0:
-                        # Пересчитываем daily_totals
-                        await _recalculate_daily_totals(cur, user_id, meal_date)
+                        # Вычитаем блюдо из daily_totals
+                        delta = _macros_delta([result], sign=-1)
+                        await _apply_daily_delta(cur, user_id, meal_date, *delta, -1)
                         await conn.commit()
 
-                        # Инвалидируем кэш
-                        from app.db.redis_client import redis
-                        cache_key = f"meals:summary:{user_id}:{meal_date}"
-                        await redis.delete(cache_key)
-                        logger.info(f"[Meals] Deleted meal {meal_id}, recalculated totals for {meal_date}")
+                        await today_view.apply_changes(user_id, meal_date, delete_ids=[meal_id])
+                        logger.info(f"[Meals] Deleted meal {meal_id}, updated totals for {meal_date}")
                         return True
 
                     await conn.rollback()
@@ -416,14 +527,17 @@ async def delete_multiple_meals(meal_ids: list, user_id: int) -> int:
                 try:
                     placeholders = ', '.join(['%s'] * len(meal_ids))
 
-                    # Получаем даты для пересчёта
+                    # Получаем даты и КБЖУ для вычитания из итогов
                     await cur.execute(
-                        f"""SELECT DISTINCT meal_date
+                        f"""SELECT id, meal_date, calories, protein, fat, carbs
                         FROM meals_history
-                        WHERE id IN ({placeholders}) AND tg_id = %s""",
+                        WHERE id IN ({placeholders}) AND tg_id = %s
+                        FOR UPDATE""",
                         (*meal_ids, user_id)
                     )
-                    dates_to_recalculate = await cur.fetchall()
+                    meals_by_date = {}
+                    for row in await cur.fetchall():
+                        meals_by_date.setdefault(row["meal_date"], []).append(row)
 
                     # Удаляем приемы пищи
                     await cur.execute(
@@ -433,19 +547,20 @@ async def delete_multiple_meals(meal_ids: list, user_id: int) -> int:
                     )
                     deleted_count = cur.rowcount
 
-                    # Пересчитываем daily_totals
+                    # Вычитаем удалённые блюда из daily_totals
                     if deleted_count > 0:
-                        for date_row in dates_to_recalculate:
-                            await _recalculate_daily_totals(cur, user_id, date_row["meal_date"])
+                        for meal_date, rows in meals_by_date.items():
+                            delta = _macros_delta(rows, sign=-1)
+                            await _apply_daily_delta(cur, user_id, meal_date, *delta, -len(rows))
 
                     await conn.commit()
 
-                    # Инвалидируем кэш после коммита
+                    # Обновляем today-view после коммита
                     if deleted_count > 0:
-                        from app.db.redis_client import redis
-                        for date_row in dates_to_recalculate:
-                            cache_key = f"meals:summary:{user_id}:{date_row['meal_date']}"
-                            await redis.delete(cache_key)
+                        for meal_date, rows in meals_by_date.items():
+                            await today_view.apply_changes(
+                                user_id, meal_date, delete_ids=[row["id"] for row in rows]
+                            )
 
                     logger.info(f"[Meals] Deleted {deleted_count} meals for user {user_id}")
                     return deleted_count
@@ -741,19 +856,12 @@ async def get_today_meals(user_id: int, user_tz: str = "Europe/Moscow", limit: i
         tz = pytz.timezone(user_tz)
         today = user_today(tz)
         
+        meals = await _load_today_meals(user_id, today)
         if limit:
-            query = """SELECT * FROM meals_history
-                      WHERE tg_id = %s AND meal_date = %s
-                      ORDER BY meal_datetime DESC
-                      LIMIT %s"""
-            meals = await mysql.fetchall(query, (user_id, today, limit))
-        else:
-            query = """SELECT * FROM meals_history
-                      WHERE tg_id = %s AND meal_date = %s
-                      ORDER BY meal_datetime"""
-            meals = await mysql.fetchall(query, (user_id, today))
+            # Последние limit блюд, от новых к старым
+            return meals[::-1][:limit]
         
-        return meals or []
+        return meals
         
     except Exception as e:
         logger.exception(f"Error getting today meals for user {user_id}: {e}")
@@ -792,15 +900,9 @@ async def get_last_meal(user_id: int, user_tz: str = "Europe/Moscow"):
         tz = pytz.timezone(user_tz)
         today = user_today(tz)
         
-        meal = await mysql.fetchone(
-            """SELECT * FROM meals_history
-            WHERE tg_id = %s AND meal_date = %s
-            ORDER BY meal_datetime DESC
-            LIMIT 1""",
-            (user_id, today)
-        )
+        meals = await _load_today_meals(user_id, today)
         
-        return meal
+        return meals[-1] if meals else None
         
     except Exception as e:
         logger.exception(f"Error getting last meal for user {user_id}: {e}")
@@ -835,7 +937,8 @@ async def update_meal(
                 try:
                     # Проверяем принадлежность приема пользователю
                     await cur.execute(
-                        "SELECT meal_date FROM meals_history WHERE id = %s AND tg_id = %s FOR UPDATE",
+                        """SELECT meal_date, calories, protein, fat, carbs
+                        FROM meals_history WHERE id = %s AND tg_id = %s FOR UPDATE""",
                         (meal_id, user_id)
                     )
                     
@@ -860,19 +963,19 @@ async def update_meal(
                     
                     if calories is not None:
                         update_fields.append("calories = %s")
-                        values.append(Decimal(str(calories)))
+                        values.append(_money(calories))
                     
                     if protein is not None:
                         update_fields.append("protein = %s")
-                        values.append(Decimal(str(protein)))
+                        values.append(_money(protein))
                     
                     if fat is not None:
                         update_fields.append("fat = %s")
-                        values.append(Decimal(str(fat)))
+                        values.append(_money(fat))
                     
                     if carbs is not None:
                         update_fields.append("carbs = %s")
-                        values.append(Decimal(str(carbs)))
+                        values.append(_money(carbs))
                     
                     if not update_fields:
                         logger.warning(f"[Meals] No fields to update for meal {meal_id}")
@@ -887,39 +990,33 @@ async def update_meal(
                         values
                     )
                     
-                    # Пересчитываем итоги дня
+                    # Прибавляем к итогам дня разницу между новым и старым КБЖУ
+                    new_values = {
+                        "calories": result["calories"] if calories is None else calories,
+                        "protein": result["protein"] if protein is None else protein,
+                        "fat": result["fat"] if fat is None else fat,
+                        "carbs": result["carbs"] if carbs is None else carbs,
+                    }
+                    delta = tuple(
+                        new - old for new, old in zip(
+                            _macros_delta([new_values]), _macros_delta([result])
+                        )
+                    )
+                    if any(delta):
+                        await _apply_daily_delta(cur, user_id, meal_date, *delta, 0)
+
                     await cur.execute(
-                        """INSERT INTO daily_totals 
-                            (tg_id, date, total_calories, total_protein, 
-                             total_fat, total_carbs, meals_count)
-                        SELECT 
-                            tg_id, 
-                            meal_date,
-                            SUM(calories), 
-                            SUM(protein), 
-                            SUM(fat), 
-                            SUM(carbs), 
-                            COUNT(*)
-                        FROM meals_history
-                        WHERE tg_id = %s AND meal_date = %s
-                        GROUP BY tg_id, meal_date
-                        ON DUPLICATE KEY UPDATE
-                            total_calories = VALUES(total_calories),
-                            total_protein = VALUES(total_protein),
-                            total_fat = VALUES(total_fat),
-                            total_carbs = VALUES(total_carbs),
-                            meals_count = VALUES(meals_count)""",
-                        (user_id, meal_date)
+                        f"SELECT {_VIEW_COLUMNS_SQL} FROM meals_history WHERE id = %s",
+                        (meal_id,)
                     )
+                    updated = await cur.fetchone()
                     
                     await conn.commit()
                     
                     logger.info(f"✅ Updated meal {meal_id} for user {user_id}")
                     
-                    # Инвалидируем кэш
-                    from app.db.redis_client import redis
-                    cache_key = f"meals:summary:{user_id}:{meal_date}"
-                    await redis.delete(cache_key)
+                    if updated:
+                        await today_view.apply_changes(user_id, meal_date, upsert=[updated])
                     
                     return True
                     
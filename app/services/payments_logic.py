@@ -8,6 +8,7 @@ import pytz
 from app.config import settings
 from app.db.queries.payment_queries import save_payment
 from app.services.user import extend_subscription, block_autopay, get_user_by_id
+from app.services.user_cache import invalidate_user
 from app.db.mysql import mysql
 
 logger = logging.getLogger(__name__)
@@ -214,6 +215,7 @@ async def try_autopay(user: dict):
                         "UPDATE users_tbl SET failed_autopay_attempts = 0 WHERE tg_id=%s",
                         (user_id,),
                     )
+            await invalidate_user(user_id)
         elif payment.status == "canceled":
             logger.warning(f"[AutoPay] User {user_id} payment canceled: {payment.id}")
             raise RuntimeError(f"YooKassa status: canceled")
@@ -236,9 +238,10 @@ async def try_autopay(user: dict):
                     "UPDATE users_tbl SET failed_autopay_attempts = failed_autopay_attempts + 1 WHERE tg_id=%s",
                     (user_id,),
                 )
+        await invalidate_user(user_id)
         
         # Проверяем количество попыток
-        fresh = await get_user_by_id(user_id)
+        fresh = await get_user_by_id(user_id, use_cache=False)
         new_attempts = int(fresh.get("failed_autopay_attempts", 0))
         
         if new_attempts >= settings.max_failed_autopay_attempts:
@@ -0,0 +1,176 @@
+# app/services/photo_dedupe.py
+"""
+Поиск почти одинаковых фото еды по перцептивному хэшу (dHash, 64 бита).
+
+Пользователи часто повторно присылают то же фото упаковки или привычного блюда.
+Если новое фото отличается от уже разобранного не больше чем на N бит,
+берём сохранённый ответ GPT вместо нового vision-запроса.
+
+Два индекса в Redis:
+- пользовательский: phash:user:{id} — hash {phash_hex: ответ}, полный перебор
+  (записей мало), порог PHOTO_DEDUPE_USER_DISTANCE;
+- общий: 4 полосы по 16 бит (phash:zband:{i}:{значение} → zset хэшей по времени
+  записи; устаревшие удаляются при каждой записи, размер полосы ограничен).
+  По принципу Дирихле хэши с расстоянием ≤ 3 совпадают хотя бы в одной полосе,
+  поэтому общий порог не больше 3 — чужой ответ берём только для практически того же кадра.
+"""
+import asyncio
+import logging
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from app.config import settings
+from app.db.redis_client import redis
+from app.services.blob_store import open_blob
+
+logger = logging.getLogger(__name__)
+
+USER_KEY = "phash:user:{user_id}"
+BAND_KEY = "phash:zband:{band}:{value}"
+RESPONSE_KEY = "phash:resp:{phash}"
+STATS_KEY = "phash:stats"
+BANDS = 4
+BAND_BITS = 16
+MAX_USER_ENTRIES = 300
+MAX_BAND_ENTRIES = 200
+MAX_GLOBAL_DISTANCE = BANDS - 1
+
+
+def dhash(img: Image.Image) -> int:
+    """Разностный хэш: яркость соседних пикселей на картинке 9×8"""
+    small = img.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _hash_blob(key: str) -> int:
+    with open_blob(key) as view:
+        with Image.open(BytesIO(view)) as img:
+            return dhash(img)
+
+
+async def photo_hash_for_blob(key: str) -> int | None:
+    try:
+        return await asyncio.to_thread(_hash_blob, key)
+    except Exception as e:
+        logger.warning(f"[PhotoDedupe] Hash failed for {key[:12]}: {e}")
+        return None
+
+
+def _bands(phash: int) -> list[tuple[int, int]]:
+    mask = (1 << BAND_BITS) - 1
+    return [(i, (phash >> (i * BAND_BITS)) & mask) for i in range(BANDS)]
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def _count(field: str) -> None:
+    try:
+        await redis.hincrby(STATS_KEY, field, 1)
+    except Exception as e:
+        logger.debug(f"[PhotoDedupe] Stats error: {e}")
+
+
+async def _find_for_user(user_id: int, phash: int) -> str | None:
+    entries = await redis.hgetall(USER_KEY.format(user_id=user_id))
+    best, best_distance = None, settings.photo_dedupe_user_distance + 1
+    for stored_hex, response in entries.items():
+        distance = hamming(phash, int(_decode(stored_hex), 16))
+        if distance < best_distance:
+            best, best_distance = response, distance
+    if best is None:
+        return None
+    logger.info(f"[PhotoDedupe] User {user_id} hit, distance={best_distance}")
+    return _decode(best)
+
+
+async def _find_global(phash: int) -> str | None:
+    distance_limit = min(settings.photo_dedupe_global_distance, MAX_GLOBAL_DISTANCE)
+    if distance_limit < 0:
+        return None
+
+    since = time.time() - settings.photo_dedupe_ttl
+    pipe = redis.pipeline()
+    for band, value in _bands(phash):
+        pipe.zrangebyscore(BAND_KEY.format(band=band, value=value), since, "+inf")
+    candidates = set()
+    for members in await pipe.execute():
+        candidates.update(_decode(m) for m in members)
+
+    for stored_hex in sorted(candidates, key=lambda h: hamming(phash, int(h, 16))):
+        if hamming(phash, int(stored_hex, 16)) > distance_limit:
+            break
+        response = await redis.get(RESPONSE_KEY.format(phash=stored_hex))
+        if response is not None:
+            logger.info(f"[PhotoDedupe] Global hit {stored_hex}")
+            return _decode(response)
+    return None
+
+
+async def find_similar_photo(user_id: int, phash: int) -> str | None:
+    """Ответ GPT для похожего фото (сначала свои, затем общие) или None"""
+    try:
+        response = await _find_for_user(user_id, phash)
+        if response is not None:
+            await _count("user_hit")
+            return response
+        response = await _find_global(phash)
+        if response is not None:
+            await _count("global_hit")
+            return response
+    except Exception as e:
+        logger.warning(f"[PhotoDedupe] Lookup error for {user_id}: {e}")
+        return None
+
+    await _count("miss")
+    return None
+
+
+async def remember_photo(user_id: int, phash: int, response: str) -> None:
+    """Сохраняет ответ GPT для фото в обоих индексах"""
+    phash_hex = f"{phash:016x}"
+    ttl = settings.photo_dedupe_ttl
+    user_key = USER_KEY.format(user_id=user_id)
+    now = time.time()
+    try:
+        pipe = redis.pipeline()
+        pipe.hset(user_key, phash_hex, response)
+        pipe.expire(user_key, ttl)
+        pipe.setex(RESPONSE_KEY.format(phash=phash_hex), ttl, response)
+        for band, value in _bands(phash):
+            band_key = BAND_KEY.format(band=band, value=value)
+            pipe.zadd(band_key, {phash_hex: now})
+            # Хэши старше TTL и сверх MAX_BAND_ENTRIES (самые старые) — удаляем
+            pipe.zremrangebyscore(band_key, "-inf", now - ttl)
+            pipe.zremrangebyrank(band_key, 0, -MAX_BAND_ENTRIES - 1)
+            pipe.expire(band_key, ttl)
+        pipe.hlen(user_key)
+        results = await pipe.execute()
+
+        # Ограничиваем размер пользовательского индекса (перебор должен оставаться дешёвым)
+        overflow = results[-1] - MAX_USER_ENTRIES
+        if overflow > 0:
+            victims = await redis.hrandfield(user_key, overflow)
+            if victims:
+                await redis.hdel(user_key, *victims)
+    except Exception as e:
+        logger.warning(f"[PhotoDedupe] Store error for {user_id}: {e}")
+
+
+def is_reusable_response(data: dict) -> bool:
+    """Переиспользуем только распознанную еду"""
+    return data.get("intent", "add") == "add" and bool(data.get("items"))
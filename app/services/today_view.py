@@ -0,0 +1,156 @@
+# app/services/today_view.py
+"""
+Материализованный «сегодня» пользователя в Redis.
+
+today:{user_id}:{date} — hash {"m:{id}": JSON блюда, "_loaded": "1"}.
+Итоги дня считаются из блюд при чтении, поэтому изменения коммутативны:
+добавление/удаление/правка — это HSET/HDEL отдельных полей, без гонок
+за общую строку итогов.
+
+Заполнение при промахе защищено версией (today_ver:{user_id}:{date}):
+если во время чтения из MySQL блюда изменились, устаревший снимок не записывается.
+Изменения применяются только к уже загруженному view, иначе — лишь версия +1.
+"""
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+
+from app.config import settings
+from app.db.redis_client import redis
+
+logger = logging.getLogger(__name__)
+
+VIEW_KEY = "today:{user_id}:{day}"
+VERSION_KEY = "today_ver:{user_id}:{day}"
+LOADED_FIELD = "_loaded"
+MEAL_PREFIX = "m:"
+
+# Колонки meals_history, которые нужны экранам «сегодня»
+VIEW_COLUMNS = (
+    "id", "meal_date", "meal_datetime", "food_name", "weight_grams",
+    "calories", "protein", "fat", "carbs", "confidence_score", "image_file_id",
+)
+_DECIMAL_FIELDS = {"calories", "protein", "fat", "carbs", "confidence_score"}
+
+# Записывает снимок, только если версия не изменилась с момента чтения
+_STORE = redis.register_script("""
+local current = redis.call('GET', KEYS[2]) or '0'
+if current ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '_loaded', '1')
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""")
+
+# ARGV: ttl, число удаляемых полей, поля на удаление..., пары поле/значение
+_APPLY = redis.register_script("""
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+if redis.call('HEXISTS', KEYS[1], '_loaded') == 0 then return 0 end
+local n = tonumber(ARGV[2])
+for i = 3, 2 + n do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+end
+for i = 3 + n, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+""")
+
+
+def _keys(user_id: int, day: date) -> list[str]:
+    return [
+        VIEW_KEY.format(user_id=user_id, day=day.isoformat()),
+        VERSION_KEY.format(user_id=user_id, day=day.isoformat()),
+    ]
+
+
+def _encode(meal: dict) -> str:
+    data = {}
+    for field in VIEW_COLUMNS:
+        value = meal.get(field)
+        if isinstance(value, datetime):
+            value = value.replace(tzinfo=None).isoformat()
+        elif isinstance(value, (date, Decimal)):
+            value = str(value)
+        data[field] = value
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _decode(raw) -> dict:
+    meal = json.loads(raw)
+    for field in _DECIMAL_FIELDS:
+        if meal.get(field) is not None:
+            meal[field] = Decimal(meal[field])
+    if meal.get("meal_datetime"):
+        meal["meal_datetime"] = datetime.fromisoformat(meal["meal_datetime"])
+    if meal.get("meal_date"):
+        meal["meal_date"] = date.fromisoformat(meal["meal_date"])
+    return meal
+
+
+def sort_meals(meals: list[dict]) -> list[dict]:
+    return sorted(meals, key=lambda m: (m["meal_datetime"], m["id"]))
+
+
+def totals_from_meals(meals: list[dict]) -> dict:
+    """Итоги в формате строки daily_totals"""
+    return {
+        "total_calories": sum((Decimal(m["calories"]) for m in meals), Decimal("0")),
+        "total_protein": sum((Decimal(m["protein"]) for m in meals), Decimal("0")),
+        "total_fat": sum((Decimal(m["fat"]) for m in meals), Decimal("0")),
+        "total_carbs": sum((Decimal(m["carbs"]) for m in meals), Decimal("0")),
+        "meals_count": len(meals),
+    }
+
+
+async def get_view(user_id: int, day: date) -> list[dict] | None:
+    """Блюда дня по времени или None, если view не загружен"""
+    raw = await redis.hgetall(_keys(user_id, day)[0])
+    if not raw or LOADED_FIELD.encode() not in raw:
+        return None
+    return sort_meals([
+        _decode(value)
+        for field, value in raw.items()
+        if field.startswith(MEAL_PREFIX.encode())
+    ])
+
+
+async def get_version(user_id: int, day: date) -> bytes:
+    return await redis.get(_keys(user_id, day)[1]) or b"0"
+
+
+async def store_view(user_id: int, day: date, meals: list[dict], version: bytes) -> bool:
+    args = [version, settings.today_view_ttl]
+    for meal in meals:
+        args += [f"{MEAL_PREFIX}{meal['id']}", _encode(meal)]
+    return bool(await _STORE(keys=_keys(user_id, day), args=args))
+
+
+async def apply_changes(
+    user_id: int,
+    day: date,
+    upsert: list[dict] = (),
+    delete_ids: list[int] = (),
+) -> None:
+    """Применяет изменения блюд (вызывать после COMMIT в MySQL)"""
+    if not settings.today_view_enabled:
+        return
+    args = [settings.today_view_ttl, len(delete_ids)]
+    args += [f"{MEAL_PREFIX}{meal_id}" for meal_id in delete_ids]
+    for meal in upsert:
+        args += [f"{MEAL_PREFIX}{meal['id']}", _encode(meal)]
+    try:
+        await _APPLY(keys=_keys(user_id, day), args=args)
+    except Exception as e:
+        # View мог остаться устаревшим — удаляем, следующее чтение загрузит из MySQL
+        logger.warning(f"[TodayView] Apply error for {user_id}: {e}")
+        try:
+            await redis.delete(_keys(user_id, day)[0])
+        except Exception:
+            pass
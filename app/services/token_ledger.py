@@ -0,0 +1,149 @@
+# app/services/token_ledger.py
+"""
+Дневной баланс запросов в Redis вместо UPDATE users_tbl на каждое сообщение.
+
+tokens:{user_id} — hash {balance, day}. day — «калорийный день» пользователя
+(user_today): при первом списании в новом дне баланс лениво сбрасывается
+до дневного лимита, ночной массовый UPDATE не нужен.
+
+Все операции — Lua-скрипты (атомарно, без гонок между вебхуком и воркерами).
+Изменённые балансы попадают в множество tokens:dirty, откуда их периодически
+забирает flush_dirty_balances и записывает в users_tbl (free_tokens, tokens_date).
+
+Здесь только низкоуровневые операции; лимиты и дни считает app.services.user.
+"""
+import logging
+from datetime import date
+
+from app.db.mysql import mysql
+from app.db.redis_client import redis
+
+logger = logging.getLogger(__name__)
+
+BALANCE_KEY = "tokens:{user_id}"
+DIRTY_KEY = "tokens:dirty"
+KEY_TTL = 7 * 24 * 3600  # После истечения баланс восстанавливается из MySQL
+FLUSH_BATCH = 500
+
+MISSING = -2    # Ключа нет — нужно загрузить баланс из MySQL (init)
+REJECTED = -1   # Списание: баланс 0; возврат: уже максимум или новый день
+
+_DEDUCT = redis.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then return -2 end
+local balance = tonumber(redis.call('HGET', KEYS[1], 'balance'))
+if redis.call('HGET', KEYS[1], 'day') ~= ARGV[1] then
+    balance = tonumber(ARGV[2])
+end
+if balance <= 0 then return -1 end
+balance = balance - 1
+redis.call('HSET', KEYS[1], 'balance', balance, 'day', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[3])
+return balance
+""")
+
+_REFUND = redis.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then return -2 end
+if redis.call('HGET', KEYS[1], 'day') ~= ARGV[1] then return -1 end
+local balance = tonumber(redis.call('HGET', KEYS[1], 'balance'))
+if balance >= tonumber(ARGV[2]) then return -1 end
+balance = balance + 1
+redis.call('HSET', KEYS[1], 'balance', balance)
+redis.call('SADD', KEYS[2], ARGV[3])
+return balance
+""")
+
+_INIT = redis.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], 'balance', ARGV[1], 'day', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[3])
+return 1
+""")
+
+_SET = redis.register_script("""
+redis.call('HSET', KEYS[1], 'balance', ARGV[1], 'day', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('SADD', KEYS[2], ARGV[3])
+return 1
+""")
+
+
+def _keys(user_id: int) -> list[str]:
+    return [BALANCE_KEY.format(user_id=user_id), DIRTY_KEY]
+
+
+async def deduct(user_id: int, day: date, limit: int) -> int:
+    """Новый баланс, REJECTED (нет запросов) или MISSING"""
+    return int(await _DEDUCT(
+        keys=_keys(user_id),
+        args=[day.isoformat(), limit, user_id, KEY_TTL],
+    ))
+
+
+async def refund(user_id: int, day: date, limit: int) -> int:
+    """Новый баланс, REJECTED (уже максимум) или MISSING"""
+    return int(await _REFUND(
+        keys=_keys(user_id),
+        args=[day.isoformat(), limit, user_id, KEY_TTL],
+    ))
+
+
+async def init(user_id: int, balance: int, day: date) -> bool:
+    """Загружает баланс из MySQL, если другой процесс не успел раньше"""
+    return bool(await _INIT(
+        keys=_keys(user_id),
+        args=[balance, day.isoformat(), user_id, KEY_TTL],
+    ))
+
+
+async def set_balance(user_id: int, balance: int, day: date) -> None:
+    """Перезаписывает баланс (подписка оформлена или истекла)"""
+    await _SET(
+        keys=_keys(user_id),
+        args=[balance, day.isoformat(), user_id, KEY_TTL],
+    )
+
+
+async def get(user_id: int) -> tuple[int, str] | None:
+    """(balance, day ISO) или None, если ключа нет"""
+    balance, day = await redis.hmget(BALANCE_KEY.format(user_id=user_id), "balance", "day")
+    if balance is None or day is None:
+        return None
+    return int(balance), day.decode() if isinstance(day, bytes) else day
+
+
+async def flush_dirty_balances() -> int:
+    """Записывает изменённые балансы в users_tbl. Возвращает количество строк"""
+    total = 0
+    while True:
+        members = await redis.spop(DIRTY_KEY, FLUSH_BATCH)
+        if not members:
+            return total
+        user_ids = [int(m) for m in members]
+
+        pipe = redis.pipeline()
+        for user_id in user_ids:
+            pipe.hmget(BALANCE_KEY.format(user_id=user_id), "balance", "day")
+        values = await pipe.execute()
+
+        rows = [
+            (int(balance), day.decode() if isinstance(day, bytes) else day, user_id)
+            for user_id, (balance, day) in zip(user_ids, values)
+            if balance is not None and day is not None
+        ]
+        if not rows:
+            continue
+
+        try:
+            async with mysql.pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(
+                        "UPDATE users_tbl SET free_tokens=%s, tokens_date=%s WHERE tg_id=%s",
+                        rows,
+                    )
+        except Exception:
+            # Вернём id обратно, чтобы записать в следующий раз
+            await redis.sadd(DIRTY_KEY, *user_ids)
+            raise
+        total += len(rows)
@@ -1,6 +1,13 @@
 from app.db.mysql import mysql
 from datetime import datetime, timedelta, date
 from app.config import settings
+from app.services import token_ledger
+from app.services.meals import user_today
+from app.services.user_cache import (
+    get_cached_user,
+    cache_user,
+    invalidate_user,
+)
 import logging
 import re
 import pytz
@@ -15,18 +22,30 @@ SUBSCRIBED_TOKENS_COUNT = 25  # Для подписчиков
 EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
 
 
-async def get_user_by_id(user_id: int) -> dict:
+async def get_user_by_id(user_id: int, use_cache: bool = True) -> dict:
     """
     Получить информацию о пользователе по Telegram ID
     
+    Args:
+        user_id: Telegram ID
+        use_cache: False — читать из БД в обход кэша процесса
+            (подписка и оплата, где нужна точная строка)
+    
     Returns:
         dict с полями пользователя или None если не найден
     """
+    if use_cache:
+        user = get_cached_user(user_id)
+        if user is not None:
+            return user
+
     try:
-        return await mysql.fetchone(
+        user = await mysql.fetchone(
             "SELECT * FROM users_tbl WHERE tg_id=%s",
             (user_id,)
         )
+        cache_user(user_id, user)
+        return user
     except Exception as e:
         logger.error(f"Error fetching user {user_id}: {e}")
         raise
@@ -59,6 +78,12 @@ async def get_or_create_user(tg_id: int, tg_name: str) -> dict:
             raise
         return user
     
+    # Пользователь снова пишет боту — значит, разблокировал: возвращаем в рассылки
+    if user.get("bot_blocked"):
+        await mysql.execute("UPDATE users_tbl SET bot_blocked = 0 WHERE tg_id = %s", (tg_id,))
+        await invalidate_user(tg_id)
+        user["bot_blocked"] = 0
+
     # Проверка актуальности подписки (только если дата точно устарела)
     exp_date = user.get("expiration_date")
     user_tz = user.get("timezone", "Europe/Moscow")
@@ -70,7 +95,7 @@ async def get_or_create_user(tg_id: int, tg_name: str) -> dict:
 
     if exp_date and exp_date < today:
         # Двойная проверка из БД перед сбросом (защита от race condition)
-        fresh_user = await get_user_by_id(tg_id)
+        fresh_user = await get_user_by_id(tg_id, use_cache=False)
         if fresh_user["expiration_date"] and fresh_user["expiration_date"] < today:
             logger.info(f"[Subscription] User {tg_id} subscription expired, resetting")
             async with mysql.pool.acquire() as conn:
@@ -83,6 +108,8 @@ async def get_or_create_user(tg_id: int, tg_name: str) -> dict:
                            WHERE tg_id = %s""",
                         (FREE_TOKENS_COUNT, tg_id)
                     )
+            await invalidate_user(tg_id)
+            await reset_token_balance(tg_id)
             user["expiration_date"] = None
             user["free_tokens"] = FREE_TOKENS_COUNT
         else:
@@ -107,7 +134,7 @@ async def extend_subscription(
         method_id: ID метода оплаты (для автопродления)
         amount: Сумма платежа
     """
-    user = await get_user_by_id(user_id)
+    user = await get_user_by_id(user_id, use_cache=False)
     if not user:
         logger.error(f"Cannot extend subscription: user {user_id} not found")
         return
@@ -155,6 +182,8 @@ async def extend_subscription(
                         user_id
                     )
                 )
+        await invalidate_user(user_id)
+        await reset_token_balance(user_id)
         
         logger.info(
             f"✅ Subscription updated for user {user_id}: "
@@ -183,81 +212,107 @@ async def block_autopay(user_id: int):
                        WHERE tg_id=%s""",
                     (settings.max_failed_autopay_attempts, user_id)
                 )
+        await invalidate_user(user_id)
         logger.info(f"✅ Autopay blocked for user {user_id}")
     except Exception as e:
         logger.error(f"Error blocking autopay for user {user_id}: {e}")
         raise
 
 
-async def update_tokens_daily():
-    """
-    Ежедневное обновление токенов для ВСЕХ пользователей
-    
-    НОВАЯ ЛОГИКА:
-    - Активная подписка → 25 токенов
-    - Без подписки → 5 токенов
-    """
-    logger.info("📅 Starting daily token reset...")
+# ============================================
+# ДНЕВНЫЕ ЗАПРОСЫ (баланс в Redis, см. token_ledger)
+# ============================================
 
+def _token_day(user: dict) -> date:
+    """«Калорийный день» пользователя — к нему привязан дневной баланс"""
     try:
-        # Используем московское время (основная аудитория)
-        msk = pytz.timezone("Europe/Moscow")
-        today = datetime.now(msk).date()
+        return user_today(user.get("timezone") or "Europe/Moscow")
+    except pytz.exceptions.UnknownTimeZoneError:
+        return user_today("Europe/Moscow")
 
-        async with mysql.pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                # 1. Обновляем токены для подписчиков
-                await cur.execute(
-                    """UPDATE users_tbl 
-                       SET free_tokens = %s 
-                       WHERE expiration_date IS NOT NULL 
-                       AND expiration_date >= %s""",
-                    (SUBSCRIBED_TOKENS_COUNT, today)
-                )
-                subscribed_count = cur.rowcount
-                
-                # 2. Обновляем токены для бесплатных пользователей
-                await cur.execute(
-                    """UPDATE users_tbl 
-                       SET free_tokens = %s 
-                       WHERE expiration_date IS NULL 
-                       OR expiration_date < %s""",
-                    (FREE_TOKENS_COUNT, today)
-                )
-                free_count = cur.rowcount
 
-        logger.info(
-            f"✅ Daily token reset completed: "
-            f"{subscribed_count} subscribed, {free_count} free users"
-        )
-        
-    except Exception as e:
-        logger.error(f"❌ Error in daily token reset: {e}", exc_info=True)
-        raise
+def daily_token_limit(user: dict, today: date) -> int:
+    """Дневной лимит: подписчикам больше"""
+    exp_date = user.get("expiration_date")
+    if exp_date and exp_date >= today:
+        return SUBSCRIBED_TOKENS_COUNT
+    return FREE_TOKENS_COUNT
+
+
+def _stored_balance(user: dict, today: date, limit: int) -> int:
+    """Баланс из users_tbl: актуален, только если записан за сегодня"""
+    if user.get("tokens_date") == today:
+        return max(0, min(int(user.get("free_tokens") or 0), limit))
+    return limit
+
+
+async def _load_balance(user_id: int, today: date, limit: int) -> None:
+    fresh = await get_user_by_id(user_id, use_cache=False)
+    if fresh:
+        await token_ledger.init(user_id, _stored_balance(fresh, today, limit), today)
+
+
+async def deduct_token(user_id: int) -> bool:
+    """Атомарно списывает запрос. False — запросы на сегодня закончились"""
+    user = await get_user_by_id(user_id)
+    if not user:
+        return False
+    today = _token_day(user)
+    limit = daily_token_limit(user, today)
+
+    result = await token_ledger.deduct(user_id, today, limit)
+    if result == token_ledger.MISSING:
+        await _load_balance(user_id, today, limit)
+        result = await token_ledger.deduct(user_id, today, limit)
+    return result >= 0
+
 
 async def refund_token(user_id: int):
     """Возвращает токен при ошибке (не выше максимума для типа пользователя)"""
     try:
-        async with mysql.pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    """UPDATE users_tbl
-                       SET free_tokens = free_tokens + 1
-                       WHERE tg_id = %s
-                       AND free_tokens < CASE
-                           WHEN expiration_date >= CURDATE() THEN %s
-                           ELSE %s
-                       END""",
-                    (user_id, SUBSCRIBED_TOKENS_COUNT, FREE_TOKENS_COUNT)
-                )
-                if cur.rowcount > 0:
-                    logger.info(f"[User] Token refunded: user {user_id}")
-                else:
-                    logger.info(f"[User] Token refund skipped (at max): user {user_id}")
+        user = await get_user_by_id(user_id)
+        if not user:
+            return
+        today = _token_day(user)
+        limit = daily_token_limit(user, today)
+
+        result = await token_ledger.refund(user_id, today, limit)
+        if result == token_ledger.MISSING:
+            await _load_balance(user_id, today, limit)
+            result = await token_ledger.refund(user_id, today, limit)
+
+        if result >= 0:
+            logger.info(f"[User] Token refunded: user {user_id}")
+        else:
+            logger.info(f"[User] Token refund skipped (at max): user {user_id}")
     except Exception as e:
         logger.error(f"[User] Failed to refund token: {e}")
 
 
+async def get_token_balance(user: dict) -> int:
+    """Остаток запросов на сегодня (для отображения)"""
+    today = _token_day(user)
+    limit = daily_token_limit(user, today)
+    try:
+        stored = await token_ledger.get(user["tg_id"])
+    except Exception as e:
+        logger.warning(f"[User] Token balance read error for {user['tg_id']}: {e}")
+        stored = None
+    if stored is None:
+        return _stored_balance(user, today, limit)
+    balance, day = stored
+    return balance if day == today.isoformat() else limit
+
+
+async def reset_token_balance(user_id: int) -> None:
+    """Выставляет полный дневной лимит (после оплаты или окончания подписки)"""
+    user = await get_user_by_id(user_id, use_cache=False)
+    if not user:
+        return
+    today = _token_day(user)
+    await token_ledger.set_balance(user_id, daily_token_limit(user, today), today)
+
+
 async def set_user_email(user_id: int, email: str) -> None:
     """
     Установить email пользователя
@@ -281,6 +336,7 @@ async def set_user_email(user_id: int, email: str) -> None:
                        WHERE tg_id=%s""",
                     (email.strip().lower(), user_id)
                 )
+        await invalidate_user(user_id)
         logger.info(f"✅ Email set for user {user_id}: {email}")
     except Exception as e:
         logger.error(f"Error setting email for user {user_id}: {e}")
@@ -306,6 +362,7 @@ async def set_user_timezone(user_id: int, timezone: str) -> None:
                     "UPDATE users_tbl SET timezone=%s WHERE tg_id=%s",
                     (timezone, user_id)
                 )
+        await invalidate_user(user_id)
         logger.info(f"✅ Timezone set for user {user_id}: {timezone}")
     except pytz.exceptions.UnknownTimeZoneError:
         logger.error(f"Invalid timezone: {timezone}")
@@ -399,6 +456,7 @@ async def save_user_profile(
                      fitness_goal, protein_goal, fat_goal, carbs_goal,
                      user_id)
                 )
+        await invalidate_user(user_id)
         logger.info(
             f"[User] Profile saved for {user_id}: "
             f"goal={calorie_goal}, fitness={fitness_goal}, "
@@ -427,6 +485,7 @@ async def save_manual_goals(
                        WHERE tg_id=%s""",
                     (calorie_goal, protein_goal, fat_goal, carbs_goal, user_id)
                 )
+        await invalidate_user(user_id)
         logger.info(
             f"[User] Manual goals saved for {user_id}: "
             f"cal={calorie_goal}, P={protein_goal}g F={fat_goal}g C={carbs_goal}g"
@@ -0,0 +1,118 @@
+# app/services/user_cache.py
+"""
+Кэш строк users_tbl в памяти процесса (вебхук и каждый ARQ воркер).
+
+get_user_by_id вызывается почти в каждом обработчике. Строка кэшируется
+на USER_CACHE_TTL_SECONDS; любое изменение users_tbl сбрасывает запись
+(invalidate_user) локально и публикует id в Redis-канал, чтобы остальные
+процессы тоже сбросили свою копию.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from app.config import settings
+from app.db.redis_client import redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "user_cache:invalidate"
+
+
+class _UserLRU:
+    """LRU с TTL для строк пользователей"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+
+    def get(self, user_id: int) -> dict | None:
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        expires_at, row = entry
+        if expires_at < time.monotonic():
+            del self._data[user_id]
+            return None
+        self._data.move_to_end(user_id)
+        return dict(row)  # Копия: вызывающий код меняет dict
+
+    def set(self, user_id: int, row: dict) -> None:
+        self._data[user_id] = (time.monotonic() + self.ttl, dict(row))
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+_cache = _UserLRU(settings.user_cache_size, settings.user_cache_ttl)
+_listener: asyncio.Task | None = None
+
+
+def get_cached_user(user_id: int) -> dict | None:
+    if not settings.user_cache_enabled:
+        return None
+    return _cache.get(user_id)
+
+
+def cache_user(user_id: int, row: dict) -> None:
+    if settings.user_cache_enabled and row:
+        _cache.set(user_id, row)
+
+
+async def invalidate_user(user_id: int) -> None:
+    """Сбрасывает пользователя во всех процессах (вызывать после UPDATE users_tbl)"""
+    _cache.pop(user_id)
+    try:
+        await redis.publish(CHANNEL, str(user_id))
+    except Exception as e:
+        logger.warning(f"[UserCache] Publish error for {user_id}: {e}")
+
+
+async def _listen() -> None:
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                _cache.pop(int(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Пропущенные сообщения опасны — после переподключения начинаем с пустого кэша
+            logger.warning(f"[UserCache] Listener error, reconnecting: {e}")
+            _cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+async def start_user_cache_listener() -> None:
+    global _listener
+    if settings.user_cache_enabled and _listener is None:
+        _listener = asyncio.create_task(_listen())
+        logger.info("[UserCache] Invalidation listener started")
+
+
+async def stop_user_cache_listener() -> None:
+    global _listener
+    if _listener:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+    _cache.clear()
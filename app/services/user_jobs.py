@@ -0,0 +1,129 @@
+# app/services/user_jobs.py
+"""
+Последовательная обработка GPT-задач одного пользователя.
+
+Два быстрых сообщения пользователя могли выполняться параллельно на разных
+ARQ воркерах и гоняться за meals_history/daily_totals и chat_history.
+Теперь задача сначала берёт per-user lock (user_job:lock:{user_id}):
+    - lock свободен — задача выполняется, а по завершении забирает
+      следующую из списка ожидания (user_job:wait:{user_id}) и выполняет её
+      в том же воркере, пока список не опустеет;
+    - lock занят — kwargs задачи дописываются в список ожидания, задача
+      сразу завершается и не держит слот воркера.
+Захват/постановка в ожидание и освобождение/выбор следующей — Lua-скрипты,
+поэтому задача не может «потеряться» между проверкой lock и его снятием.
+Список ожидания живёт вдвое дольше lock и продлевается при каждой выдаче задачи.
+Если держатель lock упал или был отменён, ожидающие задачи по одной
+возвращаются в очередь ARQ (handoff): в finally задачи и cron-проверкой
+recover_waiting_jobs для воркеров, убитых без finally.
+Задачи разных пользователей друг друга не ждут.
+"""
+import json
+import logging
+
+from app.config import settings
+from app.db.redis_client import redis
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = "user_job:lock:{user_id}"
+WAIT_KEY = "user_job:wait:{user_id}"
+WAIT_PATTERN = "user_job:wait:*"
+
+ACQUIRED = 1
+QUEUED = 0
+REJECTED = -1  # Список ожидания полон
+
+# ARGV: token, ttl, payload, max waiting
+_ACQUIRE = redis.register_script("""
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then return 1 end
+if redis.call('LLEN', KEYS[2]) >= tonumber(ARGV[4]) then return -1 end
+redis.call('RPUSH', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]) * 2)
+return 0
+""")
+
+# ARGV: token, ttl. Возвращает следующую задачу (lock остаётся у нас) или nil
+_RELEASE = redis.register_script("""
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    -- lock истёк и мог достаться другой задаче: она и разберёт список
+    return false
+end
+local job = redis.call('LPOP', KEYS[2])
+if job then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]) * 2)
+    return job
+end
+redis.call('DEL', KEYS[1])
+return false
+""")
+
+# ARGV: token ('' — только если lock ничей), ttl.
+# Снимает наш lock; если lock свободен — отдаёт первую ожидающую задачу,
+# остальные остаются в списке: их разберёт та, что снова возьмёт lock
+_HANDOFF = redis.register_script("""
+local holder = redis.call('GET', KEYS[1])
+if holder and holder == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+elseif holder then
+    return false
+end
+local job = redis.call('LPOP', KEYS[2])
+if job and redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]) * 2)
+end
+return job
+""")
+
+
+def _keys(user_id: int) -> list[str]:
+    return [LOCK_KEY.format(user_id=user_id), WAIT_KEY.format(user_id=user_id)]
+
+
+async def acquire_or_wait(user_id: int, token: str, job: dict) -> int:
+    """ACQUIRED — выполнять сейчас; QUEUED — задача в списке ожидания; REJECTED — список полон"""
+    return int(await _ACQUIRE(
+        keys=_keys(user_id),
+        args=[token, settings.user_job_lock_ttl, json.dumps(job, ensure_ascii=False), settings.user_job_max_waiting],
+    ))
+
+
+async def release_and_next(user_id: int, token: str) -> dict | None:
+    """Снимает lock или, если есть ожидающая задача, оставляет его и возвращает её"""
+    raw = await _RELEASE(keys=_keys(user_id), args=[token, settings.user_job_lock_ttl])
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        logger.error(f"[UserJobs] Bad waiting job for {user_id}: {raw!r}")
+        return await release_and_next(user_id, token)
+
+
+async def handoff_next(user_id: int, token: str = "") -> dict | None:
+    """
+    Держатель lock больше не будет разбирать список (отменён, упал):
+    снимает его lock и отдаёт следующую задачу для новой постановки в очередь.
+    token='' — для проверки по cron: задача выдаётся, только если lock уже истёк.
+    """
+    while True:
+        raw = await _HANDOFF(keys=_keys(user_id), args=[token, settings.user_job_lock_ttl])
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except (TypeError, ValueError):
+            logger.error(f"[UserJobs] Bad waiting job for {user_id}: {raw!r}")
+
+
+async def waiting_users() -> list[int]:
+    """Пользователи с непустым списком ожидания"""
+    users = []
+    async for key in redis.scan_iter(match=WAIT_PATTERN, count=500):
+        key = key.decode() if isinstance(key, bytes) else key
+        try:
+            users.append(int(key.rsplit(":", 1)[1]))
+        except ValueError:
+            continue
+    return users
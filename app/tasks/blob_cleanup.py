@@ -0,0 +1,31 @@
+# app/tasks/blob_cleanup.py
+import asyncio
+import logging
+from app.config import settings
+from app.db.redis_client import redis
+from app.services.blob_store import delete_expired_blobs
+
+logger = logging.getLogger(__name__)
+
+LOCK_TTL = 300  # 5 минут
+
+
+async def cleanup_blobs(ctx):
+    """
+    Удаляет фото из blob-хранилища старше BLOB_TTL_SECONDS.
+    Distributed lock предотвращает двойное выполнение.
+    """
+    lock_key = "lock:cleanup_blobs"
+    acquired = await redis.set(lock_key, "1", ex=LOCK_TTL, nx=True)
+    if not acquired:
+        logger.info("[Task] Очистка фото уже выполняется другим воркером, пропускаем")
+        return
+
+    try:
+        removed = await asyncio.to_thread(delete_expired_blobs, settings.blob_ttl)
+        if removed:
+            logger.info(f"[Task] Очистка фото: удалено {removed} файлов")
+    except Exception as e:
+        logger.exception(f"[Task] Ошибка при очистке фото: {e}")
+    finally:
+        await redis.delete(lock_key)
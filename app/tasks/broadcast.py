@@ -1,72 +1,244 @@
 # app/tasks/broadcast.py
-import logging
+"""
+Рассылка всем пользователям.
+
+- Пользователи читаются страницами по tg_id (keyset, без OFFSET и без
+  загрузки всей таблицы в память).
+- Отправка — параллельно, пачками по BROADCAST_CONCURRENCY, под общим
+  token bucket (BROADCAST_RATE сообщений/с). TelegramRetryAfter ставит на паузу
+  весь bucket, сообщение отправляется повторно.
+- Прогресс (последний обработанный tg_id и счётчики) после каждой пачки
+  пишется в Redis: broadcast:{id}. Незавершённые рассылки из broadcast:active
+  перезапускаются воркером рассылок (resume_broadcasts: при старте и по cron) —
+  повторно получат сообщение не больше одной пачки.
+- Заблокировавшие бота помечаются users_tbl.bot_blocked = 1 и пропускаются
+  следующими рассылками (флаг снимается, когда пользователь снова пишет /start).
+"""
 import asyncio
-from app.db.mysql import mysql
+import json
+import logging
+import time
+import uuid
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from arq.connections import ArqRedis
+
 from app.bot.bot import bot
+from app.config import settings
+from app.db.mysql import mysql
+from app.db.redis_client import redis
+from app.services.user_cache import invalidate_user
+from app.utils.metrics import BROADCAST_MESSAGES
+
 logger = logging.getLogger(__name__)
-from arq.connections import ArqRedis
 
 REDIS_KEY_ADMIN = "broadcast:admin_id"
+STATE_KEY = "broadcast:{broadcast_id}"
+ACTIVE_KEY = "broadcast:active"
+LOCK_KEY = "lock:broadcast:{broadcast_id}"
+LOCK_TTL = 120  # Продлевается после каждой пачки
+STATE_TTL = 7 * 24 * 3600
+MAX_SEND_ATTEMPTS = 3
 
-async def send_broadcast(ctx, data: dict):
-    redis: ArqRedis = ctx["redis"]
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
 
-    users = await mysql.fetchall("SELECT tg_id FROM users_tbl")
-    total = len(users)
-    sent = 0
-    failed = 0
 
-    logger.info(f"[Broadcast] Начинаем рассылку для {total} пользователей.")
+class TokenBucket:
+    """Ограничение скорости отправки; pause() — общая пауза после RetryAfter"""
 
-    for user in users:
-        user_id = user["tg_id"]
-        try:
-            if data.get("photo_id"):
-                await bot.send_photo(
-                    user_id, 
-                    data["photo_id"], 
-                    caption=data.get("text", ""),
-                    parse_mode="HTML"  # ← ДОБАВЛЕНО
-                )
-            elif data.get("animation_id"):
-                await bot.send_animation(
-                    user_id, 
-                    data["animation_id"], 
-                    caption=data.get("text", ""),
-                    parse_mode="HTML"  # ← ДОБАВЛЕНО
-                )
-            elif data.get("video_id"):
-                await bot.send_video(
-                    user_id, 
-                    data["video_id"], 
-                    caption=data.get("text", ""),
-                    parse_mode="HTML"  # ← ДОБАВЛЕНО
-                )
-            elif data.get("text"):
-                await bot.send_message(
-                    user_id, 
-                    data["text"],
-                    parse_mode="HTML"  # ← ДОБАВЛЕНО
-                )
-            else:
-                continue
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
 
-            sent += 1
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Один bucket на процесс: параллельные рассылки делят общий лимит
+_bucket: TokenBucket | None = None
+
+
+def _get_bucket() -> TokenBucket:
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(settings.broadcast_rate, settings.broadcast_rate)
+    return _bucket
 
-        except Exception as e:
-            logger.warning(f"[Broadcast] Ошибка отправки {user_id}: {e}")
-            failed += 1
 
-        await asyncio.sleep(0.1)
+async def _send_once(user_id: int, data: dict) -> None:
+    caption = data.get("text", "")
+    if data.get("photo_id"):
+        await bot.send_photo(user_id, data["photo_id"], caption=caption, parse_mode="HTML")
+    elif data.get("animation_id"):
+        await bot.send_animation(user_id, data["animation_id"], caption=caption, parse_mode="HTML")
+    elif data.get("video_id"):
+        await bot.send_video(user_id, data["video_id"], caption=caption, parse_mode="HTML")
+    else:
+        await bot.send_message(user_id, data["text"], parse_mode="HTML")
 
-    admin_id = await redis.get(REDIS_KEY_ADMIN)
-    if admin_id:
+
+async def _send(user_id: int, data: dict) -> str:
+    bucket = _get_bucket()
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        await bucket.acquire()
         try:
-            await bot.send_message(
-                int(admin_id), 
-                f"📬 Рассылка завершена.\n✅ Успешно: {sent}\n❌ Ошибок: {failed}"
-            )
+            await _send_once(user_id, data)
+            return SENT
+        except TelegramRetryAfter as e:
+            logger.warning(f"[Broadcast] Flood control, pause {e.retry_after}s")
+            bucket.pause(e.retry_after)
+        except TelegramForbiddenError:
+            return BLOCKED  # Бот заблокирован или аккаунт удалён
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                return BLOCKED
+            logger.warning(f"[Broadcast] Ошибка отправки {user_id}: {e}")
+            return FAILED
         except Exception as e:
-            logger.warning(f"[Broadcast] Не удалось отправить отчёт администратору: {e}")
+            logger.warning(f"[Broadcast] Ошибка отправки {user_id} (attempt {attempt + 1}): {e}")
+    return FAILED
+
+
+async def _load_state(broadcast_id: str) -> dict:
+    raw = await redis.hgetall(STATE_KEY.format(broadcast_id=broadcast_id))
+    return {k.decode(): v.decode() for k, v in raw.items()}
+
+
+async def _mark_blocked(user_ids: list[int]) -> None:
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    await mysql.execute(
+        f"UPDATE users_tbl SET bot_blocked = 1 WHERE tg_id IN ({placeholders})",
+        tuple(user_ids),
+    )
+    for user_id in user_ids:
+        await invalidate_user(user_id)
+
+
+async def send_broadcast(ctx, data: dict = None, broadcast_id: str = None):
+    """Новая рассылка (data) или продолжение незавершённой (broadcast_id)"""
+    if broadcast_id is None:
+        if not data or not (data.get("text") or data.get("photo_id")
+                            or data.get("animation_id") or data.get("video_id")):
+            logger.warning("[Broadcast] Пустое сообщение, рассылка не запущена")
+            return
+        broadcast_id = uuid.uuid4().hex[:12]
+        state_key = STATE_KEY.format(broadcast_id=broadcast_id)
+        admin_id = await redis.get(REDIS_KEY_ADMIN)
+        await redis.hset(state_key, mapping={
+            "data": json.dumps(data, ensure_ascii=False),
+            "last_tg_id": 0,
+            SENT: 0, FAILED: 0, BLOCKED: 0,
+            "admin_id": admin_id or b"",
+        })
+        await redis.expire(state_key, STATE_TTL)
+        await redis.sadd(ACTIVE_KEY, broadcast_id)
+
+    state_key = STATE_KEY.format(broadcast_id=broadcast_id)
+    lock_key = LOCK_KEY.format(broadcast_id=broadcast_id)
+    if not await redis.set(lock_key, "1", ex=LOCK_TTL, nx=True):
+        logger.info(f"[Broadcast] {broadcast_id} уже выполняется другим воркером, пропускаем")
+        return
+
+    try:
+        state = await _load_state(broadcast_id)
+        if not state:
+            logger.warning(f"[Broadcast] {broadcast_id}: прогресс не найден")
+            await redis.srem(ACTIVE_KEY, broadcast_id)
+            return
+        data = json.loads(state["data"])
+        last_tg_id = int(state["last_tg_id"])
+        counters = {key: int(state.get(key, 0)) for key in (SENT, FAILED, BLOCKED)}
+
+        logger.info(
+            f"[Broadcast] {broadcast_id}: {'продолжаем с ' + str(last_tg_id) if last_tg_id else 'начинаем'}"
+        )
+
+        while True:
+            users = await mysql.fetchall(
+                """SELECT tg_id FROM users_tbl
+                   WHERE tg_id > %s AND bot_blocked = 0
+                   ORDER BY tg_id LIMIT %s""",
+                (last_tg_id, settings.broadcast_page_size),
+            )
+            if not users:
+                break
+            user_ids = [row["tg_id"] for row in users]
+
+            for i in range(0, len(user_ids), settings.broadcast_concurrency):
+                chunk = user_ids[i:i + settings.broadcast_concurrency]
+                results = await asyncio.gather(*(_send(user_id, data) for user_id in chunk))
+
+                blocked = [user_id for user_id, result in zip(chunk, results) if result == BLOCKED]
+                if blocked:
+                    await _mark_blocked(blocked)
+                for result in results:
+                    counters[result] += 1
+                    BROADCAST_MESSAGES.labels(result=result).inc()
+
+                # Чекпоинт: после падения продолжим со следующей пачки
+                last_tg_id = chunk[-1]
+                pipe = redis.pipeline()
+                pipe.hset(state_key, mapping={"last_tg_id": last_tg_id, **counters})
+                pipe.expire(lock_key, LOCK_TTL)
+                await pipe.execute()
+
+        await redis.srem(ACTIVE_KEY, broadcast_id)
+        await redis.hset(state_key, "finished", int(time.time()))
+
+        admin_id = state.get("admin_id")
+        if admin_id:
+            try:
+                await bot.send_message(
+                    int(admin_id),
+                    f"📬 Рассылка завершена.\n"
+                    f"✅ Успешно: {counters[SENT]}\n"
+                    f"❌ Ошибок: {counters[FAILED]}\n"
+                    f"🚫 Заблокировали бота: {counters[BLOCKED]}"
+                )
+            except Exception as e:
+                logger.warning(f"[Broadcast] Не удалось отправить отчёт администратору: {e}")
+
+        logger.info(
+            f"[Broadcast] {broadcast_id} завершена: {counters[SENT]} отправлено, "
+            f"{counters[FAILED]} ошибок, {counters[BLOCKED]} заблокировали"
+        )
+    finally:
+        await redis.delete(lock_key)
+
 
-    logger.info(f"[Broadcast] Рассылка завершена: {sent} отправлено, {failed} ошибок.")
\ No newline at end of file
+async def resume_broadcasts(ctx):
+    """
+    Ставит в очередь рассылки, прерванные перезапуском воркера.
+    Запускается при старте воркера рассылок и по cron — lock упавшего
+    воркера истекает через LOCK_TTL.
+    """
+    arq: ArqRedis = ctx["redis"]
+    for raw in await redis.smembers(ACTIVE_KEY):
+        broadcast_id = raw.decode()
+        if await redis.exists(LOCK_KEY.format(broadcast_id=broadcast_id)):
+            continue  # Идёт прямо сейчас
+        if not await redis.exists(STATE_KEY.format(broadcast_id=broadcast_id)):
+            await redis.srem(ACTIVE_KEY, broadcast_id)
+            continue
+        logger.info(f"[Broadcast] Возобновляем рассылку {broadcast_id}")
+        await arq.enqueue_job("send_broadcast", broadcast_id=broadcast_id, _queue_name=settings.queue_bulk)
@@ -44,6 +44,12 @@ async def reset_daily_food(ctx):
                     (cutoff_date,)
                 )
                 totals_deleted = cur.rowcount
+
+                # Сырые ответы GPT к удалённым записям больше не нужны
+                await cur.execute(
+                    "DELETE FROM gpt_responses WHERE created_at < %s",
+                    (cutoff_date,)
+                )
         
         logger.info(
             f"✅ [Task] Очистка завершена: удалено {meals_deleted} приемов пищи "
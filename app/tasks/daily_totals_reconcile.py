@@ -0,0 +1,35 @@
+import logging
+from datetime import datetime, timedelta
+from app.db.redis_client import redis
+from app.services.meals import reconcile_daily_totals
+import pytz
+
+logger = logging.getLogger(__name__)
+
+LOCK_TTL = 600  # 10 минут
+RECONCILE_DAYS = 2  # Сегодня и вчера — старые дни почти не меняются
+
+
+async def reconcile_totals(ctx):
+    """
+    Сверяет daily_totals (обновляются дельтами) с meals_history
+    и исправляет расхождения. Distributed lock предотвращает двойное выполнение.
+    """
+    lock_key = "lock:reconcile_totals"
+    acquired = await redis.set(lock_key, "1", ex=LOCK_TTL, nx=True)
+    if not acquired:
+        logger.info("[Task] Сверка итогов уже выполняется другим воркером, пропускаем")
+        return
+
+    try:
+        # Запас в день: у пользователей разные часовые пояса
+        since_date = datetime.now(pytz.utc).date() - timedelta(days=RECONCILE_DAYS)
+        fixed = await reconcile_daily_totals(since_date)
+        if fixed:
+            logger.warning(f"[Task] Сверка итогов: исправлено {fixed} дней")
+        else:
+            logger.info("[Task] Сверка итогов: расхождений нет")
+    except Exception as e:
+        logger.exception(f"[Task] Ошибка при сверке итогов: {e}")
+    finally:
+        await redis.delete(lock_key)
@@ -0,0 +1,149 @@
+# app/tasks/gpt_batcher.py
+"""
+Микробатчинг текстовых GPT-запросов внутри ARQ воркера.
+
+Запросы без фото и без истории диалога собираются в течение короткого окна
+(GPT_BATCH_WINDOW_MS) и отправляются одним вызовом ai_batch_request.
+Ответы раздаются обратно ожидающим задачам. Всё, что не попало в ответ
+батча, не прошло сверку со своим запросом (ai_batch_request) или проверку
+model_router.check_response, повторяется обычным ai_request.
+
+Batch API провайдера не используется: его окно выполнения — часы,
+а здесь пользователь ждёт ответ в чате.
+"""
+import asyncio
+import logging
+import uuid
+from typing import Tuple
+
+from app.api import prompts
+from app.api.gpt import ai_request, ai_batch_request, batch_model
+from app.api.model_router import check_response
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class GptBatcher:
+    """Собирает запросы в батчи и раздаёт ответы по Future"""
+
+    def __init__(self, window_ms: int, max_size: int):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._runner: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+            logger.info(
+                f"[Batcher] Started: window={self.window * 1000:.0f}ms, max_size={self.max_size}"
+            )
+
+    async def stop(self) -> None:
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+        # Всё, что осталось в очереди, отправляем по одному
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending:
+            await self._dispatch_single(pending)
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        logger.info("[Batcher] Stopped")
+
+    async def request(
+        self,
+        user_id: int,
+        text: str,
+        image_link: str = None,
+        context: str = None,
+        history: list[dict] = None,
+        meta: dict = None,
+    ) -> Tuple[int, str]:
+        """Та же сигнатура, что у ai_request"""
+        # Фото и диалог с историей в общий промпт не складываем
+        if image_link or history or self._runner is None:
+            return await ai_request(user_id, text, image_link, context, history, meta)
+
+        future = asyncio.get_running_loop().create_future()
+        request = {
+            "id": uuid.uuid4().hex[:8], "user_id": user_id, "text": text, "context": context,
+            "meta": meta if meta is not None else {},
+        }
+        await self._queue.put((request, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: list) -> None:
+        if len(batch) == 1:
+            await self._dispatch_single(batch)
+            return
+
+        try:
+            answers = await ai_batch_request([request for request, _ in batch])
+        except Exception as e:
+            logger.exception(f"[Batcher] Batch request failed: {e}")
+            answers = {}
+
+        missing = []
+        for request, future in batch:
+            answer = answers.get(request["id"])
+            # Забракованный ответ повторяем по одному — с эскалацией модели
+            if answer is None or check_response(answer):
+                missing.append((request, future))
+            elif not future.done():
+                request["meta"].update(model=batch_model(), prompt=prompts.FULL)
+                future.set_result((200, answer))
+
+        logger.info(
+            f"[Batcher] Batch of {len(batch)}: {len(batch) - len(missing)} answered, "
+            f"{len(missing)} retried individually"
+        )
+        if missing:
+            await self._dispatch_single(missing)
+
+    @staticmethod
+    async def _dispatch_single(entries: list) -> None:
+        async def _one(request: dict, future: asyncio.Future):
+            try:
+                result = await ai_request(
+                    request["user_id"], request["text"], context=request["context"], meta=request["meta"]
+                )
+            except Exception as e:
+                logger.exception(f"[Batcher] Single request failed: {e}")
+                result = (500, "")
+            if not future.done():
+                future.set_result(result)
+
+        await asyncio.gather(*(_one(request, future) for request, future in entries))
+
+
+def create_batcher() -> GptBatcher:
+    return GptBatcher(settings.gpt_batch_window_ms, settings.gpt_batch_max_size)
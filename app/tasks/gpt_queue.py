@@ -6,23 +6,36 @@
 import logging
 import json
 import hashlib
+import time
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from app.api.gpt import ai_request
-from app.services.user import get_user_by_id, refund_token
+from app.api.gpt import ai_request_stream
+from app.services.gpt_cache import cached_ai_request
+from app.services.food_parser import parse_simple_entry
+from app.services import intent_rules
+from app.services.blob_store import blob_data_url
+from app.services.today_view import totals_from_meals
+from app.services import user_jobs
+from app.services.photo_dedupe import (
+    photo_hash_for_blob,
+    find_similar_photo,
+    remember_photo,
+    is_reusable_response,
+)
+from app.services.user import get_user_by_id, get_token_balance, refund_token
 from app.services.meals import (
     save_meals,
-    get_today_summary,
-    get_last_meal,
     get_today_meals,
     update_meal,
     delete_meal,
     delete_multiple_meals,
     user_today,
 )
-from app.db.redis_client import redis
+from app.db.redis_client import get_arq_redis, redis
 from app.bot.bot import bot
-from app.utils.telegram_helpers import safe_send_message, safe_delete_message, escape_html
+from app.utils.telegram_helpers import safe_send_message, safe_edit_message, safe_delete_message, escape_html
 from app.config import settings
+from app.utils.metrics import HANDLER, INTENT_RULES, observe
+from app.utils.tracing import span
 import pytz
 from datetime import datetime
 import uuid
@@ -135,6 +148,15 @@ def format_edit_success(meal: dict, totals: dict) -> str:
     return "\n".join(lines)
 
 
+def format_stream_progress(items: list) -> str:
+    """Промежуточный статус во время потокового ответа"""
+    lines = ["⏳ Распознаю...\n"]
+    for meal in items:
+        name = escape_html(meal.get('name', 'Блюдо')[:MAX_FOOD_NAME_LEN])
+        lines.append(f"• {name} — {meal.get('weight_grams', 0)}г, {meal.get('calories', 0):.0f} ккал")
+    return "\n".join(lines)
+
+
 def format_today_meals(meals: list) -> str:
     """Список за сегодня"""
     if not meals:
@@ -227,10 +249,59 @@ def check_all_zeros(items: list) -> bool:
 # HELPERS
 # ============================================
 
-async def get_meals_context(user_id: int, user_tz: str) -> str:
+class RequestLoader:
+    """
+    Данные одной задачи: строка пользователя и блюда за сегодня загружаются
+    один раз и передаются обработчикам. После изменений блюд снимок
+    обновляется на месте (set_summary/drop_meals) или сбрасывается (reset_meals).
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.user_tz = "Europe/Moscow"
+        self._user = None
+        self._user_loaded = False
+        self._meals: list | None = None
+
+    async def user(self) -> dict | None:
+        if not self._user_loaded:
+            self._user = await get_user_by_id(self.user_id)
+            self._user_loaded = True
+            if self._user:
+                self.user_tz = self._user.get('timezone', 'Europe/Moscow')
+        return self._user
+
+    async def meals(self) -> list:
+        """Блюда за сегодня по времени"""
+        if self._meals is None:
+            self._meals = await get_today_meals(self.user_id, self.user_tz)
+        return self._meals
+
+    async def summary(self) -> dict:
+        """То же, что get_today_summary, но из снимка"""
+        meals = await self.meals()
+        return {"totals": totals_from_meals(meals), "meals": meals}
+
+    async def last_meal(self) -> dict | None:
+        meals = await self.meals()
+        return meals[-1] if meals else None
+
+    def set_summary(self, summary: dict) -> None:
+        """save_meals уже вернул свежие блюда дня"""
+        self._meals = list(summary.get("meals", []))
+
+    def drop_meals(self, meal_ids: list) -> None:
+        if self._meals is not None:
+            self._meals = [m for m in self._meals if m['id'] not in meal_ids]
+
+    def reset_meals(self) -> None:
+        self._meals = None
+
+
+async def get_meals_context(loader: RequestLoader) -> str:
     """Контекст для GPT"""
     try:
-        meals = await get_today_meals(user_id, user_tz, limit=5)
+        meals = (await loader.meals())[::-1][:5]  # Последние 5, от новых к старым
         if not meals:
             return ""
         
@@ -244,6 +315,27 @@ async def get_meals_context(user_id: int, user_tz: str) -> str:
         return ""
 
 
+class StreamProgress:
+    """
+    Показывает блюда по мере прихода потокового ответа GPT,
+    редактируя статусное сообщение не чаще settings.stream_edit_interval.
+    """
+
+    def __init__(self, chat_id: int, message_id: int):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.items: list[dict] = []
+        self._last_edit = 0.0
+
+    async def on_items(self, new_items: list[dict]) -> None:
+        self.items.extend(validate_and_fix_item(it) for it in new_items)
+        now = time.monotonic()
+        if now - self._last_edit < settings.stream_edit_interval:
+            return
+        self._last_edit = now
+        await safe_edit_message(bot, self.chat_id, self.message_id, format_stream_progress(self.items))
+
+
 async def save_undo_data(meal_ids: list, user_id: int) -> str:
     """Сохраняет для отмены"""
     key = f"undo:{user_id}:{uuid.uuid4().hex[:8]}"
@@ -378,20 +470,156 @@ def build_assistant_summary(intent: str, items: list, notes: str) -> str:
 # ГЛАВНАЯ ФУНКЦИЯ
 # ============================================
 
+# Интенты со своим обработчиком; остальное роутится как "add"
+# (и как метка метрики bot_handler_seconds)
+ROUTED_INTENTS = {"unknown", "calculate", "add_previous", "delete", "edit", "add"}
+
 async def process_universal_request(
     ctx,
     user_id: int,
     chat_id: int,
     message_id: int,
     text: str,
-    image_url: str = None
+    image_url: str = None,
+    image_key: str = None,
+    image_file_id: str = None,
+    traceparent: str = None
+):
+    """
+    Универсальная обработка.
+
+    Фото приходит как image_key — ключ файла в blob-хранилище
+    (image_url остаётся для задач, поставленных до перехода на blob store).
+    traceparent — контекст трассировки из вебхука.
+
+    Задачи одного пользователя выполняются по очереди (см. app.services.user_jobs):
+    если у пользователя уже идёт задача, эта встаёт в его список ожидания.
+    """
+    job = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": text,
+        "image_url": image_url,
+        "image_key": image_key,
+        "image_file_id": image_file_id,
+        "traceparent": traceparent,
+    }
+    if not settings.user_job_serialize:
+        await _run_job(ctx, user_id, job)
+        return
+
+    token = (ctx or {}).get("job_id") or uuid.uuid4().hex
+    try:
+        state = await user_jobs.acquire_or_wait(user_id, token, job)
+    except Exception as e:
+        logger.warning(f"[GPT] User lock unavailable for {user_id}: {e}, running unserialized")
+        await _run_job(ctx, user_id, job)
+        return
+
+    if state == user_jobs.QUEUED:
+        logger.info(f"[GPT] User {user_id}: previous request in progress, job queued")
+        return
+    if state == user_jobs.REJECTED:
+        await safe_delete_message(bot, chat_id, message_id)
+        await safe_send_message(bot, chat_id, "⏳ Дождитесь ответа на предыдущие сообщения.")
+        await refund_token(user_id)
+        return
+
+    deferred = False
+    released = False
+    try:
+        while job:
+            await _run_job(ctx, user_id, job, deferred)
+            try:
+                job = await user_jobs.release_and_next(user_id, token)
+            except Exception as e:
+                logger.warning(f"[GPT] User lock release failed for {user_id}: {e}")
+                break
+            deferred = True
+        else:
+            released = True
+    finally:
+        if not released:
+            # Отмена (остановка воркера, job_timeout) или сбой Redis:
+            # ожидающие задачи не должны ждать, пока lock истечёт
+            await _handoff_waiting(ctx, user_id, token)
+
+
+async def _handoff_waiting(ctx, user_id: int, token: str = "") -> int:
+    """
+    Снимает lock и ставит следующую ожидающую задачу пользователя обратно в очередь ARQ
+    (остальные она разберёт сама). Если поставить не удалось — возвращает запрос
+    и убирает «⏳». Возвращает число поставленных задач.
+    """
+    requeued = 0
+    while True:
+        try:
+            job = await user_jobs.handoff_next(user_id, token)
+        except Exception as e:
+            # Lock истечёт по TTL, задачи подберёт recover_waiting_jobs
+            logger.warning(f"[GPT] Handoff failed for {user_id}: {e}")
+            return requeued
+        if not job:
+            return requeued
+        token = ""  # Lock уже снят, дальше — только пока он ничей
+        try:
+            arq = (ctx or {}).get("redis") or await get_arq_redis()
+            await arq.enqueue_job(
+                "process_universal_request",
+                user_id=user_id,
+                **job,
+                _queue_name=settings.queue_interactive,
+            )
+            logger.info(f"[GPT] User {user_id}: waiting job re-enqueued")
+            return requeued + 1
+        except Exception as e:
+            logger.error(f"[GPT] Re-enqueue failed for {user_id}: {e}")
+            await safe_delete_message(bot, job["chat_id"], job["message_id"])
+            await safe_send_message(bot, job["chat_id"], "Не удалось обработать. Попробуйте ещё раз.")
+            await refund_token(user_id)
+
+
+async def recover_waiting_jobs(ctx):
+    """
+    Cron: списки ожидания, чей держатель lock исчез без finally (воркер убит).
+    Lock истекает по USER_JOB_LOCK_TTL_SECONDS, список живёт вдвое дольше —
+    ежеминутная проверка успевает вернуть задачи в очередь.
+    """
+    recovered = 0
+    for user_id in await user_jobs.waiting_users():
+        recovered += await _handoff_waiting(ctx, user_id)
+    if recovered:
+        logger.info(f"[GPT] Recovered {recovered} orphaned waiting jobs")
+
+
+async def _run_job(ctx, user_id: int, job: dict, deferred: bool = False):
+    with span("gpt_queue.process", traceparent=job.get("traceparent"), user_id=user_id) as s:
+        enqueue_time = (ctx or {}).get("enqueue_time")
+        if enqueue_time and not deferred:
+            s.set("queue_wait_ms", round((datetime.now(pytz.utc) - enqueue_time).total_seconds() * 1000, 1))
+        s.set("deferred", deferred)
+        await _process_request(
+            ctx, user_id, job["chat_id"], job["message_id"], job["text"],
+            job.get("image_url"), job.get("image_key"), job.get("image_file_id"),
+        )
+
+
+async def _process_request(
+    ctx,
+    user_id: int,
+    chat_id: int,
+    message_id: int,
+    text: str,
+    image_url: str,
+    image_key: str,
+    image_file_id: str
 ):
-    """Универсальная обработка"""
     logger.info(f"[GPT] User {user_id}: {text[:50]}...")
+    has_image = bool(image_url or image_key)
     
     try:
         # Антидубликат (15 сек окно — защита от двойного нажатия)
-        text_hash = hashlib.md5((text + str(image_url)).encode()).hexdigest()[:8]
+        text_hash = hashlib.md5((text + str(image_key or image_url)).encode()).hexdigest()[:8]
         if await is_duplicate_request(user_id, text_hash):
             logger.info(f"[GPT] Duplicate from {user_id}")
             await safe_delete_message(bot, chat_id, message_id)
@@ -399,61 +627,123 @@ async def process_universal_request(
             await refund_token(user_id)
             return
 
-        user = await get_user_by_id(user_id)
+        # Пользователь и блюда дня читаются один раз на задачу
+        loader = RequestLoader(user_id)
+        user = await loader.user()
         if not user:
             await safe_delete_message(bot, chat_id, message_id)
             await safe_send_message(bot, chat_id, "Пользователь не найден. Нажмите /start")
             await refund_token(user_id)
             return
-        
-        user_tz = user.get('timezone', 'Europe/Moscow')
-        context = await get_meals_context(user_id, user_tz)
-
-        # Получаем историю диалога для контекста
-        chat_history = await get_chat_history(user_id)
 
-        if image_url:
+        # Однозначные команды («удали последнее», «добавь») — локальными правилами, без GPT;
+        # часть сработавших правил всё равно уходит в GPT для сверки
+        data = None
+        matched = intent_rules.classify_command(text) if not has_image else None
+        if matched and not intent_rules.target_in_meals(matched[1], await loader.meals()):
+            matched = None
+        local_rule, local_data = matched or (None, None)
+        if local_data and not intent_rules.should_audit():
+            data = local_data
+            INTENT_RULES.labels(intent=data["intent"], result="hit").inc()
+            logger.info(f"[GPT] Local rule {local_rule} for {user_id}: {data['intent']}")
+
+        # Простые записи «продукт + граммы» разбираем локально, без GPT
+        if data is None and local_data is None and not has_image:
+            data = parse_simple_entry(text)
+            if data:
+                logger.info(f"[GPT] Local fast-path for {user_id}: {len(data['items'])} items")
+
+        # Фото без подписи: ищем почти такое же уже разобранное фото
+        photo_hash = None
+        if data is None and image_key and not text and settings.photo_dedupe_enabled:
+            photo_hash = await photo_hash_for_blob(image_key)
+            if photo_hash is not None:
+                cached = await find_similar_photo(user_id, photo_hash)
+                if cached:
+                    data = json.loads(cached)
+                    data.pop("meal_time", None)  # Время приёма относится к прошлому фото
+                    photo_hash = None
+
+        if has_image:
             text = f"[ФОТО ЕДЫ] {text}" if text else "[ФОТО ЕДЫ]"
 
-        code, gpt_response = await ai_request(
-            user_id=user_id,
-            text=text,
-            image_link=image_url,
-            context=context,
-            history=chat_history,
-        )
-        logger.info(f"[GPT] Raw response for {user_id}: {gpt_response[:500] if gpt_response else 'None'}...")
+        if data is None:
+            if image_key and not image_url:
+                # Байты фото читаются из общего тома только сейчас, в Redis их нет
+                image_url = await blob_data_url(image_key)
+                if not image_url:
+                    await safe_delete_message(bot, chat_id, message_id)
+                    await safe_send_message(bot, chat_id, "Фото устарело. Отправьте его ещё раз.")
+                    await refund_token(user_id)
+                    return
+
+            context = await get_meals_context(loader)
+
+            # Получаем историю диалога для контекста
+            chat_history = await get_chat_history(user_id)
+
+            if image_url and settings.openai_stream_enabled:
+                # Фото обрабатываются долго — показываем блюда по мере распознавания
+                progress = StreamProgress(chat_id, message_id)
+                code, gpt_response = await ai_request_stream(
+                    user_id=user_id,
+                    text=text,
+                    image_link=image_url,
+                    context=context,
+                    history=chat_history,
+                    on_items=progress.on_items,
+                )
+            else:
+                # Повторяющиеся текстовые запросы отдаются из кэша без обращения к OpenAI,
+                # промахи в воркере идут через микробатчинг
+                batcher = ctx.get("gpt_batcher") if ctx else None
+                code, gpt_response = await cached_ai_request(
+                    user_id=user_id,
+                    text=text,
+                    image_link=image_url,
+                    context=context,
+                    history=chat_history,
+                    requester=batcher.request if batcher else None,
+                )
+            logger.info(f"[GPT] Raw response for {user_id}: {gpt_response[:500] if gpt_response else 'None'}...")
         
-        if code == 429 and gpt_response == "QUOTA_EXCEEDED":
-            await safe_delete_message(bot, chat_id, message_id)
-            await safe_send_message(bot, chat_id, "Сервис временно недоступен. Попробуйте позже.")
-            await refund_token(user_id)
-            return
+            if code == 429 and gpt_response == "QUOTA_EXCEEDED":
+                await safe_delete_message(bot, chat_id, message_id)
+                await safe_send_message(bot, chat_id, "Сервис временно недоступен. Попробуйте позже.")
+                await refund_token(user_id)
+                return
         
-        if code == 279:
-            await safe_delete_message(bot, chat_id, message_id)
-            await safe_send_message(
-                bot, chat_id,
-                "Изображение не прошло модерацию и не может быть обработано. "
-                "Отправьте фото еды или опишите блюдо текстом."
-            )
-            await refund_token(user_id)
-            return
+            if code == 279:
+                await safe_delete_message(bot, chat_id, message_id)
+                await safe_send_message(
+                    bot, chat_id,
+                    "Изображение не прошло модерацию и не может быть обработано. "
+                    "Отправьте фото еды или опишите блюдо текстом."
+                )
+                await refund_token(user_id)
+                return
 
-        if code != 200 or not gpt_response:
-            await safe_delete_message(bot, chat_id, message_id)
-            await safe_send_message(bot, chat_id, "Не удалось обработать. Попробуйте ещё раз.")
-            await refund_token(user_id)
-            return
-        
-        try:
-            data = json.loads(gpt_response)
-        except json.JSONDecodeError:
-            await safe_delete_message(bot, chat_id, message_id)
-            await safe_send_message(bot, chat_id, "Ошибка распознавания. Переформулируйте.")
-            await refund_token(user_id)
-            return
+            if code != 200 or not gpt_response:
+                await safe_delete_message(bot, chat_id, message_id)
+                await safe_send_message(bot, chat_id, "Не удалось обработать. Попробуйте ещё раз.")
+                await refund_token(user_id)
+                return
         
+            try:
+                data = json.loads(gpt_response)
+            except json.JSONDecodeError:
+                await safe_delete_message(bot, chat_id, message_id)
+                await safe_send_message(bot, chat_id, "Ошибка распознавания. Переформулируйте.")
+                await refund_token(user_id)
+                return
+
+            if photo_hash is not None and is_reusable_response(data):
+                await remember_photo(user_id, photo_hash, gpt_response)
+
+            if not has_image:
+                await intent_rules.record_outcome(text, local_rule, local_data, data)
+
         intent = data.get("intent", "add")
         raw_items = data.get("items", [])
         items = validate_items(raw_items)
@@ -468,30 +758,32 @@ async def process_universal_request(
 
         # Сохраняем обмен в историю диалога
         try:
-            user_summary = build_user_summary(text, image_url is not None)
+            user_summary = build_user_summary(text, has_image)
             assistant_summary = build_assistant_summary(intent, items, notes)
             await save_chat_exchange(user_id, user_summary, assistant_summary)
         except Exception as e:
             logger.warning(f"[GPT] Error saving chat history for {user_id}: {e}")
 
         # Роутинг
-        if intent == "unknown":
-            await handle_unknown(user_id, chat_id, message_id, notes)
-        elif intent == "calculate":
-            await handle_calculate(user_id, chat_id, message_id, items)
-        elif intent == "add_previous":
-            await handle_add_previous(user_id, chat_id, message_id, user_tz, user)
-        elif intent == "delete":
-            await handle_delete(user_id, chat_id, message_id, data, user_tz)
-        elif intent == "edit":
-            await handle_edit(user_id, chat_id, message_id, data, user_tz)
-        else:
-            if not items:
-                await safe_delete_message(bot, chat_id, message_id)
-                await safe_send_message(bot, chat_id, notes or "Не распознал еду. Опишите подробнее.")
-                await refund_token(user_id)
-                return
-            await handle_add(user_id, chat_id, message_id, items, user_tz, image_url, meal_time, user)
+        route = intent if intent in ROUTED_INTENTS else "add"
+        with observe(HANDLER, intent=route), span(f"handler.{route}", intent=intent, items=len(items)):
+            if intent == "unknown":
+                await handle_unknown(user_id, chat_id, message_id, notes)
+            elif intent == "calculate":
+                await handle_calculate(user_id, chat_id, message_id, items)
+            elif intent == "add_previous":
+                await handle_add_previous(user_id, chat_id, message_id, loader)
+            elif intent == "delete":
+                await handle_delete(user_id, chat_id, message_id, data, loader)
+            elif intent == "edit":
+                await handle_edit(user_id, chat_id, message_id, data, loader)
+            else:
+                if not items:
+                    await safe_delete_message(bot, chat_id, message_id)
+                    await safe_send_message(bot, chat_id, notes or "Не распознал еду. Опишите подробнее.")
+                    await refund_token(user_id)
+                    return
+                await handle_add(user_id, chat_id, message_id, items, loader, image_file_id, meal_time)
         
     except Exception as e:
         logger.exception(f"[GPT] Error: {e}")
@@ -514,16 +806,19 @@ async def handle_unknown(user_id: int, chat_id: int, message_id: int, notes: str
     await refund_token(user_id)
 
 
-async def handle_add(user_id: int, chat_id: int, message_id: int, items: list, user_tz: str, image_url: str = None, meal_time: str = None, user_data: dict = None):
+async def handle_add(user_id: int, chat_id: int, message_id: int, items: list, loader: RequestLoader, image_file_id: str = None, meal_time: str = None):
     """Добавление"""
     try:
-        user_data = user_data or {}
+        user_tz = loader.user_tz
+        user_data = await loader.user() or {}
         goal = user_data.get("calorie_goal") or settings.default_calorie_goal
 
-        result = await save_meals(user_id, {"items": items, "notes": ""}, user_tz, image_url, meal_time=meal_time)
+        result = await save_meals(user_id, {"items": items, "notes": ""}, user_tz, image_file_id, meal_time=meal_time)
         added_ids = result.get('added_meal_ids', [])
 
-        summary = await get_today_summary(user_id, user_tz)
+        # save_meals возвращает итоги дня — повторно не запрашиваем
+        loader.set_summary(result)
+        summary = await loader.summary()
         date_str = user_today(user_tz).strftime("%d.%m")
 
         text = format_add_success(items, summary["totals"], date_str)
@@ -551,8 +846,7 @@ async def handle_add(user_id: int, chat_id: int, message_id: int, items: list, u
             )
 
         # Показываем остаток запросов
-        user = await get_user_by_id(user_id)
-        remaining = user.get('free_tokens', 0) if user else 0
+        remaining = await get_token_balance(user_data) if user_data else 0
         text += f"\n\nОсталось запросов: {remaining}"
 
         buttons = []
@@ -591,7 +885,7 @@ async def handle_calculate(user_id: int, chat_id: int, message_id: int, items: l
     await safe_send_message(bot, chat_id, text, keyboard)
 
 
-async def handle_add_previous(user_id: int, chat_id: int, message_id: int, user_tz: str, user_data: dict = None):
+async def handle_add_previous(user_id: int, chat_id: int, message_id: int, loader: RequestLoader):
     """Добавить расчёт"""
     items = await get_calc_data(user_id)
 
@@ -606,16 +900,16 @@ async def handle_add_previous(user_id: int, chat_id: int, message_id: int, user_
     if last_key:
         await redis.delete(last_key)
     await redis.delete(f"calc_last:{user_id}")
-    await handle_add(user_id, chat_id, message_id, items, user_tz, None, None, user_data)
+    await handle_add(user_id, chat_id, message_id, items, loader)
 
 
-async def handle_delete(user_id: int, chat_id: int, message_id: int, data: dict, user_tz: str):
+async def handle_delete(user_id: int, chat_id: int, message_id: int, data: dict, loader: RequestLoader):
     """Удаление"""
     try:
         target = data.get("delete_target", "last")
         
         if target == "all":
-            summary = await get_today_summary(user_id, user_tz)
+            summary = await loader.summary()
             meals = summary.get("meals", [])
 
             if not meals:
@@ -645,7 +939,7 @@ async def handle_delete(user_id: int, chat_id: int, message_id: int, data: dict,
             return
         
         if target == "last":
-            last = await get_last_meal(user_id, user_tz)
+            last = await loader.last_meal()
             
             if not last:
                 await safe_delete_message(bot, chat_id, message_id)
@@ -654,7 +948,8 @@ async def handle_delete(user_id: int, chat_id: int, message_id: int, data: dict,
                 return
             
             if await delete_meal(last['id'], user_id):
-                summary = await get_today_summary(user_id, user_tz)
+                loader.drop_meals([last['id']])
+                summary = await loader.summary()
                 text = format_delete_success(last['food_name'], float(summary["totals"]['total_calories']))
                 await safe_delete_message(bot, chat_id, message_id)
                 await safe_send_message(bot, chat_id, text)
@@ -664,7 +959,7 @@ async def handle_delete(user_id: int, chat_id: int, message_id: int, data: dict,
             return
         
         # По названию
-        summary = await get_today_summary(user_id, user_tz)
+        summary = await loader.summary()
         meals = summary.get("meals", [])
         
         if not meals:
@@ -681,7 +976,8 @@ async def handle_delete(user_id: int, chat_id: int, message_id: int, data: dict,
         
         if found:
             if await delete_meal(found['id'], user_id):
-                summary = await get_today_summary(user_id, user_tz)
+                loader.drop_meals([found['id']])
+                summary = await loader.summary()
                 text = format_delete_success(found['food_name'], float(summary["totals"]['total_calories']))
                 await safe_delete_message(bot, chat_id, message_id)
                 await safe_send_message(bot, chat_id, text)
@@ -701,7 +997,7 @@ async def handle_delete(user_id: int, chat_id: int, message_id: int, data: dict,
         await refund_token(user_id)
 
 
-async def handle_edit(user_id: int, chat_id: int, message_id: int, data: dict, user_tz: str):
+async def handle_edit(user_id: int, chat_id: int, message_id: int, data: dict, loader: RequestLoader):
     """Редактирование (по имени или последнее)"""
     try:
         edit_target = data.get("edit_target", "last")
@@ -709,15 +1005,14 @@ async def handle_edit(user_id: int, chat_id: int, message_id: int, data: dict, u
 
         if edit_target and edit_target != "last":
             # Поиск по названию
-            summary = await get_today_summary(user_id, user_tz)
-            meals = summary.get("meals", [])
+            meals = await loader.meals()
             for m in reversed(meals):
                 if edit_target.lower() in m['food_name'].lower():
                     meal = m
                     break
 
         if not meal:
-            meal = await get_last_meal(user_id, user_tz)
+            meal = await loader.last_meal()
 
         if not meal:
             await safe_delete_message(bot, chat_id, message_id)
@@ -725,7 +1020,19 @@ async def handle_edit(user_id: int, chat_id: int, message_id: int, data: dict, u
             await refund_token(user_id)
             return
 
-        items = validate_items(data.get("items", []))
+        raw_items = data.get("items") or []
+        if raw_items and isinstance(raw_items[0], dict):
+            # Поля, которых нет в ответе (локальное правило присылает только вес), берём из записи
+            raw_items[0] = {
+                "name": meal["food_name"],
+                "weight_grams": meal["weight_grams"],
+                "calories": float(meal["calories"]),
+                "protein": float(meal["protein"]),
+                "fat": float(meal["fat"]),
+                "carbs": float(meal["carbs"]),
+                **raw_items[0],
+            }
+        items = validate_items(raw_items)
 
         if items:
             new = items[0]
@@ -751,7 +1058,8 @@ async def handle_edit(user_id: int, chat_id: int, message_id: int, data: dict, u
                 carbs=new.get('carbs', meal['carbs'])
             )
 
-            summary = await get_today_summary(user_id, user_tz)
+            loader.reset_meals()  # Блюдо изменилось — перечитываем (today-view в Redis)
+            summary = await loader.summary()
             text = format_edit_success(new, summary["totals"])
             await safe_delete_message(bot, chat_id, message_id)
             await safe_send_message(bot, chat_id, text)
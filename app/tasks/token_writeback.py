@@ -0,0 +1,28 @@
+import logging
+from app.db.redis_client import redis
+from app.services.token_ledger import flush_dirty_balances
+
+logger = logging.getLogger(__name__)
+
+LOCK_TTL = 120  # 2 минуты
+
+
+async def flush_token_balances(ctx):
+    """
+    Записывает изменённые балансы запросов из Redis в users_tbl.
+    Ежедневного сброса нет — баланс сбрасывается лениво при первом списании за день.
+    """
+    lock_key = "lock:flush_token_balances"
+    acquired = await redis.set(lock_key, "1", ex=LOCK_TTL, nx=True)
+    if not acquired:
+        logger.info("[Task] Запись балансов уже выполняется другим воркером, пропускаем")
+        return
+
+    try:
+        flushed = await flush_dirty_balances()
+        if flushed:
+            logger.info(f"[Task] Балансы запросов записаны в БД: {flushed}")
+    except Exception as e:
+        logger.exception(f"[Task] Ошибка при записи балансов запросов: {e}")
+    finally:
+        await redis.delete(lock_key)
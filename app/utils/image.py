@@ -0,0 +1,148 @@
+# app/utils/image.py
+"""
+Подготовка фото еды перед отправкой в vision-модель.
+
+OpenAI при detail=high всё равно уменьшает картинку: вписывает в 2048×2048,
+затем короткую сторону — в 768 px, и считает токены по плиткам 512×512.
+Поэтому больший размер — лишние байты загрузки без выигрыша в качестве.
+Уменьшаем заранее, убираем EXIF и пережимаем JPEG. Экономия — в байтах и времени
+загрузки; токены при тех же размерах не меняются (их считаем только для справки).
+"""
+import asyncio
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.db.redis_client import redis
+
+logger = logging.getLogger(__name__)
+
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+STATS_KEY = "image_prep:stats"
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.image_prep_workers,
+    thread_name_prefix="image-prep",
+)
+
+
+def vision_target_size(width: int, height: int, short_side: int = MAX_SHORT_SIDE) -> tuple[int, int]:
+    """
+    Размер, до которого модель сама уменьшит картинку при detail=high.
+    short_side меньше 768 — уменьшаем сильнее, чтобы попасть в меньше плиток.
+    """
+    scale = min(1.0, MAX_LONG_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, min(short_side, MAX_SHORT_SIDE) / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Оценка входных токенов за картинку"""
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = vision_target_size(width, height)
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_TOKENS + TILE_TOKENS * tiles
+
+
+def pick_photo_size(photos: list):
+    """
+    Выбирает наименьший PhotoSize, короткая сторона которого не меньше
+    целевой (IMAGE_SHORT_SIDE), иначе самый большой из доступных.
+    """
+    if not photos:
+        return None
+    target = min(settings.image_short_side, MAX_SHORT_SIDE)
+    suitable = [p for p in photos if min(p.width, p.height) >= target]
+    if suitable:
+        return min(suitable, key=lambda p: p.width * p.height)
+    return max(photos, key=lambda p: p.width * p.height)
+
+
+def _prepare(data: bytes) -> tuple[bytes, dict]:
+    with Image.open(BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)  # Поворот по EXIF до того, как EXIF будет удалён
+        src_w, src_h = img.size
+        dst_w, dst_h = vision_target_size(src_w, src_h, settings.image_short_side)
+
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if (dst_w, dst_h) != (src_w, src_h):
+            img = img.resize((dst_w, dst_h), Image.LANCZOS)
+
+        out = BytesIO()
+        # Без exif=... метаданные не сохраняются
+        img.save(out, "JPEG", quality=settings.image_jpeg_quality, optimize=True)
+
+    result = out.getvalue()
+    # Перекодирование могло оказаться тяжелее исходника (маленький сильно сжатый JPEG)
+    if len(result) >= len(data) and (dst_w, dst_h) == (src_w, src_h):
+        result = data
+
+    stats = {
+        "bytes_in": len(data),
+        "bytes_out": len(result),
+        "tokens": estimate_vision_tokens(dst_w, dst_h, settings.openai_image_detail),
+        "size_in": f"{src_w}x{src_h}",
+        "size_out": f"{dst_w}x{dst_h}",
+    }
+    return result, stats
+
+
+async def _count(stats: dict) -> None:
+    try:
+        pipe = redis.pipeline()
+        pipe.hincrby(STATS_KEY, "images", 1)
+        for field in ("bytes_in", "bytes_out", "tokens"):
+            pipe.hincrby(STATS_KEY, field, stats[field])
+        await pipe.execute()
+    except Exception as e:
+        logger.debug(f"[ImagePrep] Stats error: {e}")
+
+
+async def prepare_image(data: bytes) -> bytes:
+    """
+    Уменьшает и пережимает фото в пуле потоков (не блокируя event loop).
+    При любой ошибке возвращает исходные байты.
+    """
+    if not settings.image_prep_enabled:
+        return data
+
+    loop = asyncio.get_running_loop()
+    try:
+        result, stats = await loop.run_in_executor(_executor, _prepare, data)
+    except Exception as e:
+        logger.warning(f"[ImagePrep] Failed, sending original: {e}")
+        return data
+
+    logger.info(
+        f"[ImagePrep] {stats['size_in']} → {stats['size_out']}, "
+        f"{stats['bytes_in'] // 1024} → {stats['bytes_out'] // 1024} KB, "
+        f"~{stats['tokens']} tokens"
+    )
+    await _count(stats)
+    return result
+
+
+async def get_image_prep_stats() -> dict:
+    """Суммарная экономия байтов по всем обработанным фото"""
+    try:
+        raw = await redis.hgetall(STATS_KEY)
+    except Exception as e:
+        logger.warning(f"[ImagePrep] Stats read error: {e}")
+        return {}
+    stats = {
+        (k.decode() if isinstance(k, bytes) else k): int(v)
+        for k, v in raw.items()
+    }
+    stats["bytes_saved"] = stats.get("bytes_in", 0) - stats.get("bytes_out", 0)
+    return stats
@@ -0,0 +1,206 @@
+# app/utils/metrics.py
+"""
+Prometheus-метрики всего конвейера: вебхук → очередь → GPT → БД → ответ в Telegram.
+
+Вебхук (gunicorn, несколько процессов) отдаёт их на /metrics; при заданном
+PROMETHEUS_MULTIPROC_DIR значения собираются со всех процессов.
+ARQ воркер поднимает отдельный HTTP-экспортер на WORKER_METRICS_PORT.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    start_http_server,
+)
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Бакеты под секунды-десятки секунд (GPT, очередь) и миллисекунды (БД, Redis)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+WEBHOOK_TO_ENQUEUE = Histogram(
+    "bot_webhook_to_enqueue_seconds",
+    "От получения вебхука до постановки задачи в очередь",
+    ["kind"],
+    buckets=SLOW_BUCKETS,
+)
+UPDATES = Counter(
+    "bot_webhook_updates_total",
+    "Обновления Telegram по результату (shed — очередь полна)",
+    ["result"],
+)
+UPDATE_QUEUE_DEPTH = Gauge(
+    "bot_webhook_update_queue_depth",
+    "Обновления в очереди вебхука, включая обрабатываемые",
+    multiprocess_mode="livesum",
+)
+UPDATE_QUEUE_WAIT = Histogram(
+    "bot_webhook_update_queue_wait_seconds",
+    "Ожидание обновления в очереди вебхука до начала обработки",
+    buckets=SLOW_BUCKETS,
+)
+QUEUE_WAIT = Histogram(
+    "bot_queue_wait_seconds",
+    "Время задачи в очереди ARQ до начала выполнения",
+    ["queue"],
+    buckets=SLOW_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "bot_arq_queue_depth",
+    "Задачи в очереди ARQ (ready — время выполнения наступило)",
+    ["queue", "state"],
+    multiprocess_mode="max",
+)
+AI_REQUEST = Histogram(
+    "bot_ai_request_seconds",
+    "Длительность HTTP-запроса к OpenAI",
+    ["status", "attempt"],
+    buckets=SLOW_BUCKETS,
+)
+AI_TOKENS = Counter(
+    "bot_ai_tokens_total",
+    "Токены OpenAI из usage",
+    ["kind"],
+)
+AI_HEDGES = Counter(
+    "bot_ai_hedges_total",
+    "Дублирующие (hedged) запросы к OpenAI: fired, won — дубль ответил первым, lost",
+    ["outcome"],
+)
+AI_GUARD_REJECTS = Counter(
+    "bot_ai_guard_rejects_total",
+    "Запросы к OpenAI, отклонённые до отправки (breaker, rate_limit)",
+    ["reason"],
+)
+AI_ROUTE_SECONDS = Histogram(
+    "bot_ai_route_seconds",
+    "Полное время запроса к OpenAI (с ретраями) по маршруту и модели",
+    ["route", "model"],
+    buckets=SLOW_BUCKETS,
+)
+AI_ROUTE_COST = Counter(
+    "bot_ai_route_cost_usd_total",
+    "Оценка стоимости запросов к OpenAI в $ по маршруту и модели",
+    ["route", "model"],
+)
+AI_ROUTE_FALLBACKS = Counter(
+    "bot_ai_route_fallbacks_total",
+    "Повторы на OPENAI_FALLBACK_MODEL после забракованного ответа",
+    ["route", "reason"],
+)
+INTENT_RULES = Counter(
+    "bot_intent_rules_total",
+    "Локальные правила intent: hit — обработано без GPT, match/mismatch — сверка с GPT, "
+    "vetoed — отклонено моделью, missed/none — выборка запросов без правила",
+    ["intent", "result"],
+)
+HANDLER = Histogram(
+    "bot_handler_seconds",
+    "Время обработки intent в process_universal_request (после ответа GPT)",
+    ["intent"],
+    buckets=SLOW_BUCKETS,
+)
+TELEGRAM_CALL = Histogram(
+    "bot_telegram_call_seconds",
+    "Вызовы Bot API из safe_* хелперов",
+    ["method", "outcome"],
+    buckets=SLOW_BUCKETS,
+)
+BROADCAST_MESSAGES = Counter(
+    "bot_broadcast_messages_total",
+    "Сообщения рассылки по результату",
+    ["result"],
+)
+DB_QUERY = Histogram(
+    "bot_db_query_seconds",
+    "Запросы MySQL через MySQLClient",
+    ["op"],
+    buckets=FAST_BUCKETS,
+)
+DB_ACQUIRE = Histogram(
+    "bot_db_pool_acquire_seconds",
+    "Ожидание соединения из пула MySQL",
+    buckets=FAST_BUCKETS,
+)
+DB_POOL_IN_USE = Gauge(
+    "bot_db_pool_in_use",
+    "Занятые соединения пула MySQL",
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAITING = Gauge(
+    "bot_db_pool_waiting",
+    "Корутины, ждущие соединение MySQL",
+    multiprocess_mode="livesum",
+)
+REDIS_CALL = Histogram(
+    "bot_redis_command_seconds",
+    "Команды Redis",
+    ["command"],
+    buckets=FAST_BUCKETS,
+)
+
+
+@contextmanager
+def observe(histogram: Histogram, **labels):
+    """with observe(DB_QUERY, op="fetchone"): ..."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        target = histogram.labels(**labels) if labels else histogram
+        target.observe(time.perf_counter() - started)
+
+
+def observe_since(histogram: Histogram, started: float | None, **labels) -> None:
+    """Наблюдение от момента started (time.perf_counter()), если он известен"""
+    if started is None:
+        return
+    target = histogram.labels(**labels) if labels else histogram
+    target.observe(time.perf_counter() - started)
+
+
+def record_usage(usage: dict | None) -> None:
+    """usage из ответа Chat Completions → счётчики токенов"""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = usage.get(kind)
+        if value:
+            AI_TOKENS.labels(kind=kind.removesuffix("_tokens")).inc(value)
+    # Префикс промпта, взятый из кэша провайдера
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached:
+        AI_TOKENS.labels(kind="cached").inc(cached)
+
+
+def render_latest() -> tuple[bytes, str]:
+    """Тело и Content-Type для /metrics"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def start_worker_exporter() -> None:
+    """HTTP-экспортер метрик для ARQ воркера"""
+    if not settings.metrics_enabled or not settings.worker_metrics_port:
+        return
+    try:
+        start_http_server(settings.worker_metrics_port)
+        logger.info(f"[Metrics] Worker exporter on :{settings.worker_metrics_port}")
+    except OSError as e:
+        logger.warning(f"[Metrics] Exporter not started: {e}")
@@ -4,12 +4,17 @@
 """
 import html
 import asyncio
+import functools
 import logging
+import time
 from typing import Optional
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
 
+from app.utils.metrics import TELEGRAM_CALL
+from app.utils.tracing import span
+
 logger = logging.getLogger(__name__)
 
 # Максимум попыток для retry
@@ -17,6 +22,26 @@ MAX_RETRIES = 3
 RETRY_DELAY = 1.0
 
 
+def _timed(method: str):
+    """Время вызова вместе с ретраями → bot_telegram_call_seconds и спан telegram.<method>"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            try:
+                with span(f"telegram.{method}"):
+                    result = await func(*args, **kwargs)
+                return result
+            finally:
+                outcome = "ok" if result not in (None, False) else "error"
+                TELEGRAM_CALL.labels(method=method, outcome=outcome).observe(
+                    time.perf_counter() - started
+                )
+        return wrapper
+    return decorator
+
+
 def escape_html(text: str) -> str:
     """Экранирует HTML-символы в тексте"""
     if not text:
@@ -24,6 +49,7 @@ def escape_html(text: str) -> str:
     return html.escape(str(text))
 
 
+@_timed("send_message")
 async def safe_send_message(
     bot: Bot,
     chat_id: int,
@@ -90,6 +116,7 @@ async def safe_send_message(
     return None
 
 
+@_timed("edit_message_text")
 async def safe_edit_message(
     bot: Bot,
     chat_id: int,
@@ -160,6 +187,7 @@ async def safe_edit_message(
     return False
 
 
+@_timed("delete_message")
 async def safe_delete_message(bot: Bot, chat_id: int, message_id: int) -> bool:
     """Безопасное удаление сообщения"""
     try:
@@ -0,0 +1,302 @@
+# app/utils/tracing.py
+"""
+Лёгкая трассировка конвейера: вебхук → очередь → GPT → БД → ответ.
+
+with span("gpt.request", attempt=1) as s:
+    ...
+    s.set("status", 200)
+
+Текущий спан хранится в contextvar, поэтому вложенные span() автоматически
+становятся дочерними (в том числе в задачах, созданных через create_task).
+Между процессами контекст передаётся строкой traceparent (формат W3C:
+00-<trace_id>-<span_id>-<flags>) в kwargs задачи ARQ.
+
+Спаны копятся в буфере и пачками уходят в экспортёр:
+    file — JSON lines в TRACING_FILE_PATH;
+    otlp — OTLP/HTTP JSON (коллектор OpenTelemetry, Jaeger, Tempo).
+При TRACING_ENABLED=0 span() ничего не записывает.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import secrets
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_BUFFERED_SPANS = 10000
+EXPORT_BATCH = 512
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "sampled",
+        "start_ns", "end_ns", "attributes", "error",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, sampled: bool, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Заглушка при выключенной трассировке"""
+    traceparent = None
+
+    def set(self, key: str, value) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def _parse_traceparent(value: str | None) -> tuple[str, str, bool] | None:
+    if not value:
+        return None
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2], parts[3] == "01"
+
+
+@contextmanager
+def span(name: str, traceparent: str | None = None, **attributes):
+    """
+    Спан вокруг блока кода. traceparent — контекст из другого процесса
+    (kwargs задачи ARQ); без него родителем становится текущий спан.
+    """
+    processor = _processor
+    if processor is None:
+        yield _NOOP
+        return
+
+    parent = _current.get()
+    remote = _parse_traceparent(traceparent)
+    if remote:
+        trace_id, parent_id, sampled = remote
+    elif parent:
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+        sampled = random.random() < settings.tracing_sample_rate
+
+    current = Span(name, trace_id, parent_id, sampled, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current.reset(token)
+        current.end_ns = time.time_ns()
+        if sampled:
+            processor.add(current)
+
+
+def traced(name: str):
+    """Декоратор: вся корутина — один спан"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_traceparent() -> str | None:
+    """Контекст текущего спана для передачи в задачу ARQ"""
+    current = _current.get()
+    return current.traceparent if current else None
+
+
+# ============================================
+# ЭКСПОРТ
+# ============================================
+
+class FileExporter:
+    """JSON lines, по строке на спан (дописывание — безопасно для нескольких процессов)"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, payload: str) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(payload)
+
+    async def export(self, spans: list[Span]) -> None:
+        payload = "".join(
+            json.dumps({"service": _service, **s.to_dict()}, ensure_ascii=False, default=str) + "\n"
+            for s in spans
+        )
+        await asyncio.to_thread(self._write, payload)
+
+    async def close(self) -> None:
+        pass
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPExporter:
+    """OTLP/HTTP с JSON-кодированием (POST {endpoint}, обычно .../v1/traces)"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self._client = httpx.AsyncClient(timeout=5)
+
+    def _encode(self, s: Span) -> dict:
+        data = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,  # INTERNAL
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            data["parentSpanId"] = s.parent_id
+        return data
+
+    async def export(self, spans: list[Span]) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": _service}},
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "app.utils.tracing"},
+                    "spans": [self._encode(s) for s in spans],
+                }],
+            }]
+        }
+        response = await self._client.post(self.endpoint, json=body)
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class _BatchProcessor:
+    """Буфер спанов с фоновой отправкой; при переполнении новые спаны отбрасываются"""
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.buffer: deque[Span] = deque()
+        self.dropped = 0
+        self._task: asyncio.Task | None = None
+
+    def add(self, s: Span) -> None:
+        if len(self.buffer) >= MAX_BUFFERED_SPANS:
+            self.dropped += 1
+            return
+        self.buffer.append(s)
+
+    async def flush(self) -> None:
+        while self.buffer:
+            batch = [self.buffer.popleft() for _ in range(min(EXPORT_BATCH, len(self.buffer)))]
+            try:
+                await self.exporter.export(batch)
+            except Exception as e:
+                logger.warning(f"[Tracing] Export of {len(batch)} spans failed: {e}")
+                return
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.tracing_flush_interval)
+            await self.flush()
+            if self.dropped:
+                logger.warning(f"[Tracing] Buffer full, dropped {self.dropped} spans")
+                self.dropped = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        await self.exporter.close()
+
+
+_processor: _BatchProcessor | None = None
+_service = "calorie-bot"
+
+
+def _create_exporter():
+    if settings.tracing_exporter == "otlp":
+        return OTLPExporter(settings.tracing_otlp_endpoint)
+    return FileExporter(settings.tracing_file_path)
+
+
+async def start_tracing(service: str, exporter=None) -> None:
+    """
+    Включает запись спанов в процессе (lifespan / startup воркера).
+    exporter — свой объект с export(spans) и close() вместо настроенного.
+    """
+    global _processor, _service
+    if not settings.tracing_enabled or _processor is not None:
+        return
+    _service = service
+    _processor = _BatchProcessor(exporter or _create_exporter())
+    _processor.start()
+    name = type(exporter).__name__ if exporter else settings.tracing_exporter
+    logger.info(f"[Tracing] Enabled for {service}, exporter={name}")
+
+
+async def stop_tracing() -> None:
+    global _processor
+    if _processor is None:
+        return
+    processor, _processor = _processor, None
+    await processor.stop()